@@ -1,6 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from openai import OpenAI
 import os
+import time
 import dotenv
+from model_health import ModelHealth
+from metrics import metrics, log_event
 dotenv.load_dotenv()
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -11,25 +15,321 @@ client = OpenAI(
     base_url="https://openrouter.ai/api/v1"
 )
 
-def consultar_ia(mensagem, system_message=None):
+# Lista de modelos para tentar, em ordem
+MODELOS = [
+    "openai/gpt-oss-20b:free",
+    "meta-llama/llama-3.2-3b-instruct:free",
+    "google/gemma-2-9b-it:free",
+]
+
+# Modo de consulta: 'hedge' (reserva após um atraso), 'race' (todos juntos) ou 'sequential'
+HEDGE_MODE = os.getenv("OPENROUTER_HEDGE_MODE", "hedge")
+
+# Atraso máximo (segundos) antes de disparar o modelo reserva no modo 'hedge'
+HEDGE_DELAY = float(os.getenv("OPENROUTER_HEDGE_DELAY", "4"))
+
+# Tempo limite (segundos) de cada chamada a um modelo
+TIMEOUT_MODELO = float(os.getenv("OPENROUTER_TIMEOUT", "30"))
+
+# Saúde dos modelos, usada para ordenar as tentativas
+model_health = ModelHealth()
+
+# Threads das chamadas concorrentes (as perdedoras terminam em segundo plano)
+_executor = ThreadPoolExecutor(max_workers=len(MODELOS) * 4)
+
+# Máximo de rodadas de chamadas de ferramentas antes da resposta final
+MAX_RODADAS_FERRAMENTAS = int(os.getenv("OPENROUTER_TOOL_ROUNDS", "5"))
+
+# Prazo total (segundos) de uma consulta com ferramentas, somando todas as rodadas
+TIMEOUT_FERRAMENTAS = float(os.getenv("OPENROUTER_TOOLS_TIMEOUT", "60"))
+
+# Último trecho do streaming quando o modelo falha no meio da resposta
+AVISO_INTERROMPIDA = "\n\n*⚠️ A resposta foi interrompida. Tente novamente.*"
+
+# Mensagem do sistema padrão
+SYSTEM_MESSAGE_PADRAO = "Você é um assistente especializado em análise de dados de vendas. Responda em português brasileiro de forma clara, profissional e útil. Use formatação Markdown para organizar suas respostas."
+
+def _registrar_uso(modelo, usage, campos):
     """
-    Função para consultar a IA usando OpenRouter com múltiplas tentativas
+    Soma os tokens informados pelo OpenRouter nos contadores e no log do span
     """
-    # Lista de modelos para tentar
-    modelos = [
-        "openai/gpt-oss-20b:free",
-        "meta-llama/llama-3.2-3b-instruct:free",
-        "google/gemma-2-9b-it:free",
-    ]
+    if usage is None:
+        return
+    prompt = getattr(usage, 'prompt_tokens', None) or 0
+    completion = getattr(usage, 'completion_tokens', None) or 0
+    metrics.inc('llm_tokens_total', prompt, model=modelo, type='prompt')
+    metrics.inc('llm_tokens_total', completion, model=modelo, type='completion')
+    campos['tokens_prompt'] = campos.get('tokens_prompt', 0) + prompt
+    campos['tokens_resposta'] = campos.get('tokens_resposta', 0) + completion
+
+def _chamar_modelo(modelo, mensagem, system_message):
+    """
+    Uma chamada a um modelo, registrando latência e resultado no monitor de saúde
+    e a duração e os tokens nas métricas
+    """
+    inicio = time.monotonic()
+    try:
+        with metrics.span('llm', model=modelo, mode='completo') as campos:
+            print(f"🤖 Tentando modelo: {modelo}")
+            completion = client.chat.completions.create(
+                extra_headers={
+                    "HTTP-Referer": "https://localhost", 
+                    "X-Title": "Bot Consultor de planilha", 
+                },
+                model=modelo,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": system_message
+                    },
+                    {
+                        "role": "user",
+                        "content": mensagem
+                    }
+                ],
+                max_tokens=1500,
+                temperature=0.7,
+                timeout=TIMEOUT_MODELO
+            )
+            _registrar_uso(modelo, completion.usage, campos)
+            resposta = completion.choices[0].message.content
+            if not resposta:
+                raise ValueError("resposta vazia")
+    except Exception:
+        model_health.record_failure(modelo, time.monotonic() - inicio)
+        raise
+    
+    model_health.record_success(modelo, time.monotonic() - inicio)
+    return resposta
+
+def consultar_ia(mensagem, system_message=None, fallback=True):
+    """
+    Função para consultar a IA usando OpenRouter com múltiplas tentativas.
     
+    Os modelos são ordenados pela saúde recente. No modo 'hedge' o modelo reserva
+    é disparado se o principal não responder dentro do atraso configurado; no modo
+    'race' todos começam juntos; em ambos vale a primeira resposta válida.
+    
+    Com fallback=False, levanta RuntimeError em vez de devolver a resposta local
+    quando todos os modelos falham.
+    """
     # Mensagem do sistema padrão ou personalizada
     if system_message is None:
-        system_message = "Você é um assistente especializado em análise de dados de vendas. Responda em português brasileiro de forma clara, profissional e útil. Use formatação Markdown para organizar suas respostas."
+        system_message = SYSTEM_MESSAGE_PADRAO
+    
+    # Lazy: a disponibilidade (e a chamada de teste de um circuito meio aberto)
+    # só é verificada quando o modelo vai de fato ser chamado
+    candidatos = (m for m in model_health.ordered(MODELOS) if model_health.available(m))
+    
+    if HEDGE_MODE == 'sequential':
+        for modelo in candidatos:
+            try:
+                resposta = _chamar_modelo(modelo, mensagem, system_message)
+                print(f"✅ Sucesso com modelo: {modelo}")
+                return resposta
+            except Exception as e:
+                print(f"❌ Erro com modelo {modelo}: {e}")
+        
+        return _sem_modelos(mensagem, fallback)
+    
+    limite = time.monotonic() + TIMEOUT_MODELO + HEDGE_DELAY * len(MODELOS)
+    vencedor = _primeira_resposta(
+        candidatos, lambda modelo: _chamar_modelo(modelo, mensagem, system_message), limite
+    )
+    if vencedor is not None:
+        modelo, resposta = vencedor
+        print(f"✅ Sucesso com modelo: {modelo}")
+        return resposta
     
-    for modelo in modelos:
+    return _sem_modelos(mensagem, fallback)
+
+def _primeira_resposta(candidatos, chamar, limite):
+    """
+    Dispara chamar(modelo) no _executor para os modelos de `candidatos` (iterador)
+    conforme HEDGE_MODE e devolve (modelo, resultado) da primeira chamada sem erro,
+    ou None se todas falharem ou o prazo `limite` (time.monotonic) passar.
+    Os candidatos ainda não disparados continuam no iterador.
+    """
+    pendentes = {}
+    # Cada candidato só é tirado do iterador quando vai ser disparado
+    esgotado = False
+    hedge = HEDGE_MODE != 'sequential'
+    
+    while True:
+        # Dispara o próximo modelo quando não há nenhum em andamento (ou sempre, no modo race)
+        if not esgotado and (HEDGE_MODE == 'race' or not pendentes):
+            proximo = next(candidatos, None)
+            if proximo is not None:
+                pendentes[_executor.submit(chamar, proximo)] = proximo
+                ultimo = proximo
+                continue
+            esgotado = True
+        if not pendentes:
+            break
+        
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        if hedge and not esgotado:
+            espera = min(restante, model_health.hedge_delay(ultimo, HEDGE_DELAY))
+        else:
+            espera = restante
+        
+        prontos, _ = wait(pendentes, timeout=espera, return_when=FIRST_COMPLETED)
+        if not prontos:
+            if hedge and not esgotado:
+                proximo = next(candidatos, None)
+                if proximo is None:
+                    esgotado = True
+                else:
+                    print(f"⏱️ Sem resposta em {espera:.1f}s, disparando modelo reserva: {proximo}")
+                    pendentes[_executor.submit(chamar, proximo)] = proximo
+                    ultimo = proximo
+            continue
+        
+        for future in prontos:
+            modelo = pendentes.pop(future)
+            try:
+                resultado = future.result()
+            except Exception as e:
+                print(f"❌ Erro com modelo {modelo}: {e}")
+                continue
+            # As chamadas que perderam a corrida seguem em segundo plano só para registrar a saúde
+            return modelo, resultado
+    
+    return None
+
+def _rodada_ferramentas(modelo, messages, tools, rodada, limite):
+    """
+    Uma chamada com ferramentas, limitada ao que resta do prazo da consulta;
+    devolve a mensagem do modelo (com tool_calls ou a resposta final)
+    """
+    restante = limite - time.monotonic()
+    if restante <= 0:
+        raise TimeoutError("prazo da consulta com ferramentas esgotado")
+    if rodada == 0:
+        print(f"🤖 Tentando modelo com ferramentas: {modelo}")
+    
+    inicio = time.monotonic()
+    with metrics.span('llm', model=modelo, mode='ferramentas') as campos:
+        completion = client.chat.completions.create(
+            extra_headers={
+                "HTTP-Referer": "https://localhost", 
+                "X-Title": "Bot Consultor de planilha", 
+            },
+            model=modelo,
+            messages=messages,
+            tools=tools,
+            tool_choice="auto",
+            max_tokens=1500,
+            temperature=0.3,
+            timeout=min(TIMEOUT_MODELO, restante)
+        )
+        campos['rodada'] = rodada
+        _registrar_uso(modelo, completion.usage, campos)
+    if rodada == 0:
+        model_health.record_success(modelo, time.monotonic() - inicio)
+    
+    resposta = completion.choices[0].message
+    if not resposta.tool_calls and not resposta.content:
+        raise ValueError("resposta vazia")
+    return resposta
+
+def _concluir_ferramentas(modelo, resposta, messages, tools, executar_ferramenta, max_rodadas, limite):
+    """
+    Executa as ferramentas pedidas e segue com o mesmo modelo até a resposta final
+    """
+    for rodada in range(1, max_rodadas + 1):
+        if not resposta.tool_calls:
+            print(f"✅ Sucesso com modelo: {modelo} ({rodada - 1} rodadas de ferramentas)")
+            return resposta.content
+        if rodada == max_rodadas:
+            break
+        
+        messages.append({
+            "role": "assistant",
+            "content": resposta.content or "",
+            "tool_calls": [
+                {
+                    "id": chamada.id,
+                    "type": "function",
+                    "function": {"name": chamada.function.name, "arguments": chamada.function.arguments},
+                }
+                for chamada in resposta.tool_calls
+            ],
+        })
+        for chamada in resposta.tool_calls:
+            print(f"🔧 {chamada.function.name}({chamada.function.arguments})")
+            messages.append({
+                "role": "tool",
+                "tool_call_id": chamada.id,
+                "content": executar_ferramenta(chamada.function.name, chamada.function.arguments),
+            })
+        resposta = _rodada_ferramentas(modelo, messages, tools, rodada, limite)
+    
+    raise RuntimeError(f"limite de {max_rodadas} rodadas de ferramentas atingido")
+
+def consultar_ia_ferramentas(mensagem, system_message, tools, executar_ferramenta, max_rodadas=None):
+    """
+    Consulta com function calling: o modelo pode chamar as ferramentas (executadas por
+    executar_ferramenta(nome, argumentos_json) -> str) antes de responder.
+    
+    A primeira rodada é disparada como em consultar_ia (hedge/race pela saúde dos
+    modelos); o primeiro a responder segue com as rodadas seguintes e, se falhar,
+    os modelos ainda não tentados recomeçam a conversa. Todas as rodadas dividem um
+    único prazo (TIMEOUT_FERRAMENTAS); levanta RuntimeError se nenhum modelo concluir.
+    """
+    max_rodadas = max_rodadas or MAX_RODADAS_FERRAMENTAS
+    limite = time.monotonic() + TIMEOUT_FERRAMENTAS
+    
+    inicial = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": mensagem},
+    ]
+    # Nem todo modelo gratuito aceita ferramentas; falhas aqui não contam para a saúde
+    candidatos = (m for m in model_health.ordered(MODELOS) if not model_health.is_open(m))
+    
+    while True:
+        vencedor = _primeira_resposta(
+            candidatos, lambda modelo: _rodada_ferramentas(modelo, inicial, tools, 0, limite), limite
+        )
+        if vencedor is None:
+            raise RuntimeError("Nenhum modelo concluiu a consulta com ferramentas")
+        
+        modelo, resposta = vencedor
         try:
-            print(f"🤖 Tentando modelo: {modelo}")
-            completion = client.chat.completions.create(
+            return _concluir_ferramentas(
+                modelo, resposta, list(inicial), tools, executar_ferramenta, max_rodadas, limite
+            )
+        except Exception as e:
+            print(f"❌ Erro com modelo {modelo} (ferramentas): {e}")
+
+def _sem_modelos(mensagem, fallback):
+    if not fallback:
+        raise RuntimeError("Todos os modelos falharam")
+    print("⚠️ Todos os modelos falharam, usando fallback local")
+    return generate_fallback_response(mensagem)
+
+def consultar_ia_stream(mensagem, system_message=None, fallback=True):
+    """
+    Versão em streaming de consultar_ia: gera os trechos da resposta conforme o
+    modelo os produz. Se um modelo falhar antes do primeiro trecho, tenta o próximo;
+    se todos falharem, gera a resposta local de uma vez (ou levanta RuntimeError,
+    com fallback=False). Uma falha no meio da resposta termina com AVISO_INTERROMPIDA.
+    """
+    if system_message is None:
+        system_message = SYSTEM_MESSAGE_PADRAO
+    
+    for modelo in model_health.ordered(MODELOS):
+        if not model_health.available(modelo):
+            continue
+        started = False
+        inicio = time.monotonic()
+        campos = {}
+        status = 'erro'
+        try:
+            print(f"🤖 Tentando modelo (streaming): {modelo}")
+            stream = client.chat.completions.create(
                 extra_headers={
                     "HTTP-Referer": "https://localhost", 
                     "X-Title": "Bot Consultor de planilha", 
@@ -46,18 +346,48 @@ def consultar_ia(mensagem, system_message=None):
                     }
                 ],
                 max_tokens=1500,
-                temperature=0.7
+                temperature=0.7,
+                stream=True,
+                timeout=TIMEOUT_MODELO
             )
-            resposta = completion.choices[0].message.content
-            print(f"✅ Sucesso com modelo: {modelo}")
-            return resposta
+            
+            for chunk in stream:
+                # O último trecho do OpenRouter traz o uso de tokens
+                _registrar_uso(modelo, getattr(chunk, 'usage', None), campos)
+                if not chunk.choices:
+                    continue
+                texto = chunk.choices[0].delta.content
+                if texto:
+                    if not started:
+                        # Latência até o primeiro trecho é o que o usuário percebe
+                        model_health.record_success(modelo, time.monotonic() - inicio)
+                        campos['primeiro_trecho_ms'] = round((time.monotonic() - inicio) * 1000, 2)
+                        started = True
+                    yield texto
+            
+            if started:
+                status = 'ok'
+                print(f"✅ Sucesso com modelo: {modelo}")
+                return
+            print(f"⚠️ Modelo {modelo} não retornou conteúdo")
+            model_health.record_failure(modelo, time.monotonic() - inicio)
             
         except Exception as e:
             print(f"❌ Erro com modelo {modelo}: {e}")
+            if not started:
+                model_health.record_failure(modelo, time.monotonic() - inicio)
+            if started:
+                # Parte da resposta já foi enviada; não dá para trocar de modelo no meio
+                yield AVISO_INTERROMPIDA
+                return
             continue
+        finally:
+            # Span medido à mão: o gerador pausa entre os trechos
+            duracao = time.monotonic() - inicio
+            metrics.observe('span_seconds', duracao, span='llm', status=status, model=modelo, mode='stream')
+            log_event('span', span='llm', status=status, duracao_ms=round(duracao * 1000, 2), model=modelo, mode='stream', **campos)
     
-    print("⚠️ Todos os modelos falharam, usando fallback local")
-    return generate_fallback_response(mensagem)
+    yield _sem_modelos(mensagem, fallback)
 
 def generate_fallback_response(mensagem):
     """
@@ -2,11 +2,16 @@
 Serviço para acessar dados via Google Apps Script
 """
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import json
 import os
 import dotenv
+from row_parser import parse_sheet, merge_reports, MAX_EXEMPLOS
+from sheet_store import SheetRows
+from metrics import metrics
 
 # Carrega variáveis de ambiente
 dotenv.load_dotenv()
@@ -16,6 +21,24 @@ class AppsScriptService:
         self.spreadsheet_id = "1B0k2LbBkGCUu4lmR4P67xx7OjQ5HXbsr6JrLwEiRUIM"
         self.script_url = self.load_script_url()
         
+        # Sincronização incremental (APPS_SCRIPT_INCREMENTAL=0 desativa)
+        self.incremental = os.getenv('APPS_SCRIPT_INCREMENTAL', '1') != '0'
+        self.sheets_cache = {}
+        self.sheet_versions = {}
+        self.last_result = None
+        
+        # Colunas tipadas e relatório de conversão de cada guia (convertidas uma vez por sincronização)
+        self.typed_sheets = {}
+        
+        # Download paralelo por guia (APPS_SCRIPT_WORKERS=1 usa a resposta única)
+        self.max_workers = max(1, int(os.getenv('APPS_SCRIPT_WORKERS', '6')))
+        # False quando o Apps Script ignora ?mode=list (versão antiga): não tenta mais
+        self.list_supported = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
     def load_script_url(self):
         """
         Carrega a URL do Apps Script da variável de ambiente
@@ -49,6 +72,136 @@ class AppsScriptService:
         except:
             return False
     
+    def _request(self, params=None, timeout=60):
+        """
+        Faz um GET no Apps Script e retorna o JSON (None em caso de erro)
+        """
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
+            'Accept': 'application/json',
+        }
+        
+        # Modo da chamada: resposta única, lista de guias, versões ou uma guia
+        params = params or {}
+        mode = params.get('mode') or ('sheet' if 'gid' in params else 'all')
+        with metrics.span('fetch', mode=mode) as info:
+            response = self.session.get(self.script_url, params=params, headers=headers, timeout=timeout)
+            info.update(http_status=response.status_code, bytes=len(response.content))
+        
+        if response.status_code != 200:
+            print(f"❌ Erro HTTP: {response.status_code}")
+            print(f"Resposta: {response.text[:200]}...")
+            return None
+        
+        data = response.json()
+        if not data.get('success'):
+            print(f"❌ Erro no Apps Script: {data.get('error')}")
+            return None
+        
+        return data
+    
+    def _build_sheet(self, sheet_name, sheet_gid, rows, columns):
+        """
+        Converte as linhas de uma guia no formato usado pelo cache: colunas compactas
+        (SheetRows), com nome da guia e horário da sincronização fora das linhas.
+        Retorna (guia, (colunas tipadas, relatório de conversão)).
+        """
+        with metrics.span('parse') as info:
+            df = pd.DataFrame(rows, columns=columns)
+            parsed = parse_sheet(df, sheet_name)
+            
+            dados = SheetRows.from_frame(df, sheet_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            info.update(guia=sheet_name, linhas=len(df))
+        metrics.inc('rows_processed_total', len(df), stage='parse')
+        
+        entry = {
+            'nome': sheet_name,
+            'gid': sheet_gid,
+            'dados': dados,
+            'total_registros': len(dados),
+            'colunas': dados.columns + ['guia', 'ultima_atualizacao']
+        }
+        return entry, parsed
+    
+    def _append_parsed(self, key, parsed, offset):
+        """
+        Junta as colunas tipadas das linhas novas às da guia já em cache
+        """
+        previous_frame, previous_report = self.typed_sheets[key][1]
+        frame, report = parsed
+        
+        # Linhas novas começam depois das que já estavam na guia
+        examples = [dict(example, linha=example['linha'] + offset) for example in report['exemplos']]
+        failures = dict(previous_report['falhas'])
+        for column, count in report['falhas'].items():
+            failures[column] = failures.get(column, 0) + count
+        
+        merged = {
+            'linhas': previous_report['linhas'] + report['linhas'],
+            'tipos': previous_report['tipos'],
+            'falhas': failures,
+            'exemplos': (previous_report['exemplos'] + examples)[:MAX_EXEMPLOS],
+        }
+        return pd.concat([previous_frame, frame], ignore_index=True), merged
+    
+    def _log_memory(self, all_sheets):
+        """
+        Mostra a memória ocupada pelas linhas em cache
+        """
+        total = sum(sheet['dados'].nbytes for sheet in all_sheets.values())
+        print(f"💾 Linhas em cache: {total / 1024 / 1024:.1f} MB (colunar)")
+    
+    def typed_data(self, data):
+        """
+        Colunas tipadas e relatório de conversão das guias em `data`, na mesma ordem.
+        None se `data` não for o resultado da última sincronização.
+        """
+        if not isinstance(data, dict) or data is not self.last_result:
+            return None
+        
+        frames, reports = [], []
+        for key, entry in data.items():
+            cached = self.typed_sheets.get(key)
+            if cached is None or cached[0] is not entry:
+                return None
+            frames.append(cached[1][0])
+            reports.append((entry['nome'], cached[1][1]))
+        
+        report = merge_reports(reports)
+        if report['falhas']:
+            print(f"⚠️ Células que não puderam ser convertidas: {report['falhas']}")
+        return frames, report
+    
+    def _fetch_sheets(self, requests_by_key):
+        """
+        Busca várias guias em paralelo (pool limitado a max_workers) e gera
+        (chave, resposta) conforme cada uma chega
+        """
+        if not requests_by_key:
+            return
+        
+        workers = min(self.max_workers, len(requests_by_key))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self._request, params): key for key, params in requests_by_key.items()}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ Erro ao buscar {futures[future]}: {e}")
+                    result = None
+                yield futures[future], result
+    
+    def _remember(self, key, entry, rows, sheet_hash, parsed):
+        """
+        Guarda a guia, suas colunas tipadas e seu marcador de versão para a próxima sincronização
+        """
+        self.sheets_cache[key] = entry
+        self.typed_sheets[key] = (entry, parsed)
+        if sheet_hash:
+            self.sheet_versions[key] = {'linhas': rows, 'hash': sheet_hash}
+        else:
+            self.sheet_versions.pop(key, None)
+    
     def get_latest_data(self):
         """
         Obtém dados via Google Apps Script
@@ -58,65 +211,223 @@ class AppsScriptService:
             print("💡 Configure APPS_SCRIPT_URL no arquivo .env")
             return None
         
+        if self.incremental and self.sheet_versions:
+            try:
+                data = self.get_incremental_data()
+                if data is not None:
+                    return data
+            except Exception as e:
+                print(f"⚠️ Sincronização incremental falhou: {e}")
+            print("🔄 Voltando para o download completo...")
+        
+        if self.max_workers > 1 and self.list_supported is not False:
+            try:
+                data = self.get_parallel_data()
+                if data is not None:
+                    return data
+            except Exception as e:
+                print(f"⚠️ Download paralelo falhou: {e}")
+            print("🔄 Usando a resposta única do Apps Script...")
+        
         print("🔄 Buscando dados via Google Apps Script...")
         print(f"🔗 URL: {self.script_url}")
         
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
-                'Accept': 'application/json',
-            }
-            
-            response = requests.get(self.script_url, headers=headers, timeout=60)
+            data = self._request()
             
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data.get('success'):
-                    print(f"✅ Apps Script funcionando!")
-                    print(f"📊 {data.get('totalSheets', 0)} guias encontradas")
-                    
-                    # Processa os dados
-                    all_sheets = {}
-                    total_records = 0
-                    
-                    for sheet_data in data.get('sheets', []):
-                        sheet_name = sheet_data.get('name', 'Unknown')
-                        sheet_gid = sheet_data.get('gid', 0)
-                        rows = sheet_data.get('data', [])
-                        columns = sheet_data.get('columns', [])
-                        
-                        if rows and columns:
-                            # Cria DataFrame
-                            df = pd.DataFrame(rows, columns=columns)
-                            df['guia'] = sheet_name
-                            df['ultima_atualizacao'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            all_sheets[f"guia_{sheet_gid}"] = {
-                                'nome': sheet_name,
-                                'gid': sheet_gid,
-                                'dados': df.to_dict('records'),
-                                'total_registros': len(df),
-                                'colunas': df.columns.tolist()
-                            }
-                            
-                            total_records += len(df)
-                            print(f"✅ {sheet_name}: {len(df)} registros")
-                    
-                    print(f"📈 Total: {total_records} registros em {len(all_sheets)} guias")
-                    return all_sheets if all_sheets else None
-                else:
-                    print(f"❌ Erro no Apps Script: {data.get('error')}")
-                    return None
+            if data is not None:
+                print(f"✅ Apps Script funcionando!")
+                return self._load_workbook(data)
             else:
-                print(f"❌ Erro HTTP: {response.status_code}")
-                print(f"Resposta: {response.text[:200]}...")
                 return None
                 
         except Exception as e:
             print(f"❌ Erro: {e}")
             return None
     
+    def _load_workbook(self, data):
+        """
+        Processa a resposta única do Apps Script (todas as guias de uma vez)
+        """
+        print(f"📊 {data.get('totalSheets', 0)} guias encontradas")
+        
+        all_sheets = {}
+        total_records = 0
+        self.sheets_cache = {}
+        self.sheet_versions = {}
+        self.typed_sheets = {}
+        
+        for sheet_data in data.get('sheets', []):
+            sheet_name = sheet_data.get('name', 'Unknown')
+            sheet_gid = sheet_data.get('gid', 0)
+            rows = sheet_data.get('data', [])
+            columns = sheet_data.get('columns', [])
+            
+            if rows and columns:
+                key = f"guia_{sheet_gid}"
+                entry, parsed = self._build_sheet(sheet_name, sheet_gid, rows, columns)
+                all_sheets[key] = entry
+                self._remember(key, entry, len(rows), sheet_data.get('hash'), parsed)
+                
+                total_records += entry['total_registros']
+                print(f"✅ {sheet_name}: {entry['total_registros']} registros")
+        
+        print(f"📈 Total: {total_records} registros em {len(all_sheets)} guias")
+        self._log_memory(all_sheets)
+        self.last_result = all_sheets if all_sheets else None
+        return self.last_result
+    
+    def get_parallel_data(self):
+        """
+        Lista as guias e baixa cada uma em paralelo, processando cada guia assim
+        que ela chega. Retorna None se o Apps Script não suportar ?mode=list.
+        """
+        print("🔄 Listando guias no Apps Script...")
+        print(f"🔗 URL: {self.script_url}")
+        listing = self._request({'mode': 'list'}, timeout=60)
+        
+        if listing is not None and 'list' not in listing and 'sheets' in listing:
+            # Apps Script antigo ignora ?mode=list e já devolve a planilha inteira:
+            # usa essa resposta e não pergunta de novo nas próximas atualizações
+            print("⚠️ Apps Script sem suporte a download por guia, usando a resposta única")
+            self.list_supported = False
+            return self._load_workbook(listing)
+        
+        if listing is None or 'list' not in listing:
+            print("⚠️ Apps Script sem suporte a download por guia")
+            return None
+        
+        self.list_supported = True
+        sheets = [sheet for sheet in listing['list'] if sheet.get('rows', 0) > 0]
+        print(f"📊 {len(listing['list'])} guias encontradas, baixando {len(sheets)} em paralelo ({self.max_workers} conexões)")
+        
+        names = {f"guia_{sheet.get('gid', 0)}": sheet.get('name', 'Unknown') for sheet in sheets}
+        results = {}
+        
+        for key, part in self._fetch_sheets({f"guia_{sheet.get('gid', 0)}": {'gid': sheet.get('gid', 0)} for sheet in sheets}):
+            if part is None:
+                return None
+            rows = part.get('data', [])
+            columns = part.get('columns', [])
+            if rows and columns:
+                entry, parsed = self._build_sheet(part.get('name', names[key]), part.get('gid', 0), rows, columns)
+                results[key] = (entry, parsed, len(rows), part.get('hash'))
+                print(f"✅ {results[key][0]['nome']}: {len(rows)} registros")
+        
+        # Mantém a ordem das guias na planilha
+        all_sheets = {}
+        self.sheets_cache = {}
+        self.sheet_versions = {}
+        self.typed_sheets = {}
+        for key in names:
+            if key in results:
+                entry, parsed, rows, sheet_hash = results[key]
+                all_sheets[key] = entry
+                self._remember(key, entry, rows, sheet_hash, parsed)
+        
+        total_records = sum(sheet['total_registros'] for sheet in all_sheets.values())
+        print(f"📈 Total: {total_records} registros em {len(all_sheets)} guias")
+        self._log_memory(all_sheets)
+        self.last_result = all_sheets if all_sheets else None
+        return self.last_result
+    
+    def get_incremental_data(self):
+        """
+        Sincroniza só o que mudou desde a última carga, usando os marcadores de
+        versão (linhas e hash) de cada guia. Guias sem alteração são reaproveitadas,
+        guias que só ganharam linhas no final baixam apenas as novas linhas.
+        Retorna None se o Apps Script não suportar o modo incremental.
+        """
+        print("🔄 Verificando versões das guias no Apps Script...")
+        response = self._request({'mode': 'versions'}, timeout=30)
+        
+        if response is None or 'versions' not in response:
+            print("⚠️ Apps Script sem suporte a sincronização incremental")
+            return None
+        
+        versions = {}
+        appends = {}
+        full = {}
+        
+        for version in response['versions']:
+            key = f"guia_{version.get('gid', 0)}"
+            if version.get('rows', 0) <= 0:
+                continue
+            versions[key] = version
+            
+            previous = self.sheets_cache.get(key)
+            marker = self.sheet_versions.get(key)
+            sheet_hash = version.get('hash')
+            
+            if previous and marker and sheet_hash and marker['hash'] == sheet_hash and previous['nome'] == version.get('name'):
+                # Guia sem alteração
+                continue
+            if previous and marker and version['rows'] > marker['linhas']:
+                # Pode ter só ganhado linhas no final: baixa apenas as novas
+                appends[key] = {'gid': version.get('gid', 0), 'offset': marker['linhas']}
+            else:
+                full[key] = {'gid': version.get('gid', 0)}
+        
+        updated = {}
+        downloaded_rows = 0
+        
+        for key, part in self._fetch_sheets(appends):
+            if part is None:
+                return None
+            marker = self.sheet_versions[key]
+            if part.get('prefixHash') != marker['hash']:
+                # Linhas anteriores também mudaram: baixa a guia inteira
+                full[key] = {'gid': versions[key].get('gid', 0)}
+                continue
+            previous = self.sheets_cache[key]
+            new_rows = part.get('data', [])
+            appended, parsed = self._build_sheet(versions[key].get('name', 'Unknown'), versions[key].get('gid', 0), new_rows, part.get('columns', []))
+            entry = dict(previous, nome=versions[key].get('name', 'Unknown'))
+            entry['dados'] = previous['dados'].append(appended['dados'])
+            entry['colunas'] = entry['dados'].columns + ['guia', 'ultima_atualizacao']
+            entry['total_registros'] = len(entry['dados'])
+            updated[key] = (entry, self._append_parsed(key, parsed, marker['linhas']))
+            downloaded_rows += len(new_rows)
+            print(f"➕ {entry['nome']}: {len(new_rows)} novos registros")
+        
+        for key, part in self._fetch_sheets(full):
+            if part is None:
+                return None
+            sheet_rows = part.get('data', [])
+            if not sheet_rows or not part.get('columns'):
+                continue
+            entry, parsed = self._build_sheet(versions[key].get('name', 'Unknown'), versions[key].get('gid', 0), sheet_rows, part.get('columns', []))
+            updated[key] = (entry, parsed)
+            downloaded_rows += len(sheet_rows)
+            print(f"✅ {entry['nome']}: {entry['total_registros']} registros (guia completa)")
+        
+        # Monta o resultado na ordem da planilha
+        all_sheets = {}
+        for key, version in versions.items():
+            if key in updated:
+                entry, parsed = updated[key]
+                all_sheets[key] = entry
+                self._remember(key, entry, version['rows'], version.get('hash'), parsed)
+            elif key in self.sheets_cache and key not in full:
+                all_sheets[key] = self.sheets_cache[key]
+        
+        # Remove guias que deixaram de existir
+        for key in set(self.sheets_cache) - set(all_sheets):
+            self.sheets_cache.pop(key, None)
+            self.sheet_versions.pop(key, None)
+            self.typed_sheets.pop(key, None)
+        
+        if not updated and list(all_sheets) == list(self.last_result or {}):
+            print("✅ Nenhuma guia alterada desde a última sincronização")
+            return self.last_result
+        
+        total_records = sum(sheet['total_registros'] for sheet in all_sheets.values())
+        print(f"📈 Sincronização incremental: {len(updated)} guias alteradas, {downloaded_rows} registros baixados")
+        print(f"📈 Total: {total_records} registros em {len(all_sheets)} guias")
+        self._log_memory(all_sheets)
+        self.last_result = all_sheets if all_sheets else None
+        return self.last_result
+    
     def test_connection(self):
         """
         Testa a conexão com o Apps Script
@@ -0,0 +1,120 @@
+"""
+Substituto local do Apps Script para os benchmarks: responde ao protocolo do doGet
+do README (resposta única, ?mode=list, ?mode=versions e ?gid=&offset=) a partir
+de uma planilha sintética em memória, por HTTP de verdade em 127.0.0.1
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import json
+import threading
+
+# Caminho do controle usado pelo benchmark para acrescentar linhas entre sincronizações
+APPEND_PATH = '/_bench/append'
+
+def _json(obj):
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+def do_get(workbook, params):
+    """
+    Corpo JSON da resposta do doGet para os parâmetros da URL
+    """
+    if params.get('mode') == 'versions':
+        return _json({
+            'success': True,
+            'totalSheets': len(workbook.sheets),
+            'versions': [
+                {'name': sheet.name, 'gid': sheet.gid, 'rows': len(sheet), 'hash': sheet.hash}
+                for sheet in workbook.sheets
+            ],
+        })
+
+    if params.get('mode') == 'list':
+        return _json({
+            'success': True,
+            'totalSheets': len(workbook.sheets),
+            'list': [{'name': sheet.name, 'gid': sheet.gid, 'rows': len(sheet)} for sheet in workbook.sheets],
+        })
+
+    if 'gid' in params:
+        sheet = workbook.sheet(params['gid'])
+        if sheet is None:
+            return _json({'success': False, 'error': f"Guia não encontrada: {params['gid']}"})
+        return sheet.sheet_json(int(params.get('offset') or 0))
+
+    partes = []
+    for sheet in workbook.sheets:
+        corpo, sheet_hash = sheet.body()
+        partes.append(corpo + b',"hash":' + _json(sheet_hash) + b'}')
+    return b'{"success":true,"totalSheets":' + str(len(partes)).encode() + b',"sheets":[' + b','.join(partes) + b']}'
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, body, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats['requisicoes'] += 1
+        self.server.stats['bytes'] += len(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self._send(do_get(self.server.workbook, params))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != APPEND_PATH:
+            self._send(_json({'success': False, 'error': 'caminho desconhecido'}), 404)
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        with self.server.lock:
+            sheet = self.server.workbook.append(int(params.get('rows', 1)), params.get('gid'))
+            sheet.body()
+        self._send(_json({'success': True, 'name': sheet.name, 'rows': len(sheet)}))
+
+    def log_message(self, format, *args):
+        pass
+
+class AppsScriptStandIn:
+    """
+    Servidor HTTP em segundo plano com a planilha sintética
+    """
+    def __init__(self, workbook, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.workbook = workbook
+        self.server.lock = threading.Lock()
+        self.server.stats = {'requisicoes': 0, 'bytes': 0}
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/macros/s/benchmark/exec"
+
+    @property
+    def append_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{APPEND_PATH}"
+
+    @property
+    def stats(self):
+        return dict(self.server.stats)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
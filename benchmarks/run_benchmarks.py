@@ -0,0 +1,381 @@
+"""
+Benchmarks reproduzíveis do dashboard com planilhas sintéticas
+
+Para cada tamanho (10k, 100k e 1m linhas por padrão) gera a planilha, serve pelo
+substituto local do Apps Script e, em um processo separado (memória de pico
+isolada), mede:
+- atualização completa, sem alteração e incremental (linhas novas no último mês)
+- memória de pico (RSS) depois da importação, da atualização e no fim
+- latência de /api/data, /api/analysis e /api/chat (IA simulada, sem rede)
+
+O resultado vai para benchmarks/results/<data>-<commit>.json (local, fora do git;
+'-alterado' quando há mudanças não commitadas) e é comparado com o resultado
+anterior, destacando as métricas que pioraram.
+
+Uso:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 10k,100k --repeat 30
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<arquivo>.json
+"""
+from contextlib import redirect_stdout
+from datetime import datetime
+from types import SimpleNamespace
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+# Guias mensais da planilha sintética
+DEFAULT_SHEETS = 12
+
+# Linhas acrescentadas ao último mês na medição incremental (fração do total)
+APPEND_FRACTION = 0.01
+
+# Perguntas do chat (o cache de respostas é limpo antes de cada uma)
+PERGUNTAS = (
+    'Quais produtos venderam mais?',
+    'Como foi a receita por região nos últimos 3 meses?',
+    'Qual categoria teve o maior ticket médio em março?',
+    'Compare as vendas de janeiro e fevereiro',
+    'Quais são as tendências de vendas?',
+)
+
+# Variação relativa a partir da qual uma métrica é apontada como regressão
+DEFAULT_THRESHOLD = 0.2
+
+# Diferenças absolutas menores que isto são ruído (ms, s e MB)
+MIN_DIFF = {'ms': 1.0, 's': 0.01, 'mb': 5.0}
+
+def peak_rss_mb():
+    """
+    Memória residente de pico do processo (None sem o módulo resource, ex.: Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def timings(samples):
+    """
+    Durações em segundos -> primeira, mediana, p95 e máximo em ms
+    """
+    ms = [sample * 1000 for sample in samples]
+    ordenadas = sorted(ms)
+    return {
+        'primeira_ms': round(ms[0], 2),
+        'p50_ms': round(statistics.median(ms), 2),
+        'p95_ms': round(ordenadas[max(0, math.ceil(len(ordenadas) * 0.95) - 1)], 2),
+        'max_ms': round(ordenadas[-1], 2),
+        'amostras': len(ms),
+    }
+
+# --- IA simulada ---------------------------------------------------------------
+
+RESPOSTA_SIMULADA = "## Resumo\n\nResposta simulada do benchmark."
+
+class StubCompletions:
+    """
+    Substitui client.chat.completions do OpenRouter: com ferramentas, pede uma
+    consulta de ranking na primeira rodada e responde na segunda; sem ferramentas,
+    responde na hora. Tokens estimados em ~4 caracteres por token.
+    """
+    def __init__(self):
+        self.chamadas = 0
+
+    def create(self, model, messages, tools=None, **kwargs):
+        self.chamadas += 1
+        caracteres = sum(len(message.get('content') or '') for message in messages)
+        usage = SimpleNamespace(prompt_tokens=caracteres // 4, completion_tokens=len(RESPOSTA_SIMULADA) // 4)
+
+        if tools and messages[-1]['role'] == 'user':
+            chamada = SimpleNamespace(
+                id='bench-1',
+                type='function',
+                function=SimpleNamespace(
+                    name='consultar_vendas',
+                    arguments=json.dumps({'agrupar_por': 'produto', 'limite': 10}),
+                ),
+            )
+            message = SimpleNamespace(content=None, tool_calls=[chamada])
+        else:
+            message = SimpleNamespace(content=RESPOSTA_SIMULADA, tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+# --- Medição (processo filho) ----------------------------------------------------
+
+def _check(response, endpoint):
+    if response.status_code != 200:
+        raise RuntimeError(f"{endpoint} respondeu {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+def _time_endpoint(call, repeat, before=None):
+    samples, size = [], 0
+    for indice in range(repeat):
+        if before is not None:
+            before(indice)
+        inicio = time.perf_counter()
+        response = call(indice)
+        samples.append(time.perf_counter() - inicio)
+        size = len(response.get_data())
+    return dict(timings(samples), bytes=size)
+
+def measure(args):
+    """
+    Roda no processo filho: importa o app, sincroniza com o substituto do Apps
+    Script e mede os endpoints. Devolve o dict de resultados do tamanho.
+    """
+    import requests
+
+    resultado = {'memoria_mb': {'antes_importacao': peak_rss_mb()}}
+
+    inicio = time.perf_counter()
+    import dashboard_app
+    import api_openrouter
+    resultado['importacao_s'] = round(time.perf_counter() - inicio, 3)
+    resultado['memoria_mb']['importacao'] = peak_rss_mb()
+
+    stub = StubCompletions()
+    api_openrouter.client = SimpleNamespace(chat=SimpleNamespace(completions=stub))
+    service = dashboard_app.apps_script_service
+    service.script_url = args.url
+    client = dashboard_app.app.test_client()
+
+    resultado['config'] = {
+        'apps_script_workers': service.max_workers,
+        'incremental': service.incremental,
+        'chat_tools': dashboard_app.CHAT_TOOLS,
+        'chat_context_tokens': dashboard_app.CONTEXT_MAX_TOKENS,
+    }
+
+    atualizacao = {}
+
+    def refresh(nome):
+        inicio = time.perf_counter()
+        _check(client.post('/api/update'), '/api/update')
+        atualizacao[nome] = round(time.perf_counter() - inicio, 3)
+
+    refresh('completa_s')
+    resultado['memoria_mb']['atualizacao'] = peak_rss_mb()
+    resultado['registros'] = dashboard_app.snapshot.total_records
+    refresh('sem_alteracao_s')
+
+    novas = max(1, int(args.rows * APPEND_FRACTION))
+    requests.post(args.append_url, params={'rows': novas}, timeout=600).raise_for_status()
+    refresh('incremental_s')
+    atualizacao['linhas_acrescentadas'] = novas
+    resultado['atualizacao'] = atualizacao
+
+    endpoints = {}
+    endpoints['/api/data'] = _time_endpoint(
+        lambda i: _check(client.get('/api/data', headers={'Accept-Encoding': 'gzip'}), '/api/data'),
+        args.repeat,
+    )
+    endpoints['/api/analysis'] = _time_endpoint(
+        lambda i: _check(client.get('/api/analysis'), '/api/analysis'),
+        args.repeat,
+    )
+    endpoints['/api/chat'] = _time_endpoint(
+        lambda i: _check(client.post('/api/chat', json={'message': PERGUNTAS[i % len(PERGUNTAS)]}), '/api/chat'),
+        args.chat_repeat,
+        before=lambda i: dashboard_app.response_cache.invalidate(),
+    )
+    endpoints['/api/chat']['chamadas_ia'] = stub.chamadas
+    resultado['endpoints'] = endpoints
+    resultado['memoria_mb']['pico'] = peak_rss_mb()
+    return resultado
+
+def run_worker(args):
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        resultado = measure(args)
+    with open(args.result, 'w') as f:
+        json.dump(resultado, f, ensure_ascii=False)
+
+# --- Orquestração ----------------------------------------------------------------
+
+def git_info():
+    def git(*argv):
+        try:
+            return subprocess.run(['git', *argv], cwd=ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+    return {
+        'commit': git('rev-parse', '--short', 'HEAD') or None,
+        'alterado': bool(git('status', '--porcelain', '--untracked-files=no')),
+    }
+
+def run_size(nome, rows, args):
+    """
+    Gera a planilha, sobe o substituto do Apps Script e mede em um processo filho
+    """
+    from fake_apps_script import AppsScriptStandIn
+    from synthetic_sheets import SyntheticWorkbook
+
+    inicio = time.perf_counter()
+    workbook = SyntheticWorkbook(rows, sheets=args.sheets, seed=args.seed)
+    workbook.encode()
+    print(f"📊 {nome}: {workbook.total_rows} linhas em {len(workbook.sheets)} guias geradas em {time.perf_counter() - inicio:.1f}s")
+
+    with AppsScriptStandIn(workbook) as stand_in, tempfile.TemporaryDirectory() as tmp:
+        result_path = os.path.join(tmp, 'resultado.json')
+        env = dict(
+            os.environ,
+            METRICS_JSON_LOGS='0',
+            SNAPSHOT_CACHE_PATH=os.path.join(tmp, 'snapshot.pkl'),
+            OPENROUTER_API_KEY=os.environ.get('OPENROUTER_API_KEY') or 'benchmark',
+        )
+        command = [
+            sys.executable, os.path.abspath(__file__), '--worker',
+            '--url', stand_in.url, '--append-url', stand_in.append_url,
+            '--rows', str(rows), '--repeat', str(args.repeat), '--chat-repeat', str(args.chat_repeat),
+            '--result', result_path,
+        ]
+        subprocess.run(command, cwd=ROOT, env=env, check=True)
+        with open(result_path) as f:
+            resultado = json.load(f)
+        resultado['apps_script'] = stand_in.stats
+
+    resultado['linhas'] = rows
+    resultado['guias'] = args.sheets
+    return resultado
+
+def flatten(resultados):
+    """
+    {tamanho: resultado} -> {'tamanho.caminho.métrica': valor} só com durações e memória
+    """
+    plano = {}
+
+    def visit(prefixo, valor, unidade=None):
+        if isinstance(valor, dict):
+            for chave, item in valor.items():
+                visit(f"{prefixo}.{chave}", item, 'mb' if chave == 'memoria_mb' else unidade)
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            chave = prefixo.rsplit('.', 1)[-1]
+            if chave.endswith('_ms'):
+                plano[prefixo] = (valor, 'ms')
+            elif chave.endswith('_s'):
+                plano[prefixo] = (valor, 's')
+            elif unidade == 'mb':
+                plano[prefixo] = (valor, 'mb')
+
+    for tamanho, resultado in resultados.items():
+        visit(tamanho, resultado)
+    return plano
+
+def compare(atual, anterior, threshold):
+    """
+    Lista as métricas em comum que variaram; retorna as regressões (mais lentas ou maiores)
+    """
+    antes = flatten(anterior['resultados'])
+    depois = flatten(atual['resultados'])
+    regressoes = []
+
+    print(f"\n📈 Comparação com {anterior['meta'].get('commit')} ({anterior['meta'].get('data')})")
+    for chave, (valor, unidade) in depois.items():
+        if chave not in antes or not antes[chave][0]:
+            continue
+        base = antes[chave][0]
+        variacao = (valor - base) / base
+        if abs(valor - base) < MIN_DIFF[unidade] or abs(variacao) < threshold:
+            continue
+        marcador = '🔴' if variacao > 0 else '🟢'
+        print(f"{marcador} {chave}: {base} -> {valor} {unidade} ({variacao:+.0%})")
+        if variacao > 0:
+            regressoes.append(chave)
+
+    if not regressoes:
+        print(f"✅ Nenhuma regressão acima de {threshold:.0%}")
+    return regressoes
+
+def latest_result(exclude=None):
+    arquivos = sorted(path for path in glob.glob(os.path.join(RESULTS_DIR, '*.json')) if path != exclude)
+    return arquivos[-1] if arquivos else None
+
+def summary(nome, resultado):
+    atualizacao = resultado['atualizacao']
+    memoria = resultado['memoria_mb']
+    print(f"✅ {nome}: atualização {atualizacao['completa_s']}s (sem alteração {atualizacao['sem_alteracao_s']}s, "
+          f"incremental {atualizacao['incremental_s']}s), memória de pico {memoria['pico']} MB")
+    for endpoint, valores in resultado['endpoints'].items():
+        print(f"   {endpoint}: p50 {valores['p50_ms']} ms, p95 {valores['p95_ms']} ms, primeira {valores['primeira_ms']} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks do dashboard com planilhas sintéticas')
+    parser.add_argument('--sizes', default='10k,100k,1m', help='tamanhos separados por vírgula (ex.: 10k,100k,1m,250000)')
+    parser.add_argument('--sheets', type=int, default=DEFAULT_SHEETS, help='guias mensais da planilha')
+    parser.add_argument('--seed', type=int, default=42, help='semente da planilha sintética')
+    parser.add_argument('--repeat', type=int, default=20, help='requisições medidas por endpoint')
+    parser.add_argument('--chat-repeat', type=int, default=10, help='perguntas medidas no chat')
+    parser.add_argument('--output', help='arquivo do resultado (padrão: benchmarks/results/<data>-<commit>.json)')
+    parser.add_argument('--compare', help='resultado anterior para comparar (padrão: o mais recente em benchmarks/results)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='variação relativa apontada como regressão')
+    parser.add_argument('--fail-on-regression', action='store_true', help='sai com código 1 se houver regressão')
+    # Processo filho (uso interno)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--append-url', help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    from synthetic_sheets import parse_size
+
+    git = git_info()
+    meta = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': git['commit'],
+        'alterado': git['alterado'],
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'guias': args.sheets,
+        'semente': args.seed,
+        'repeticoes': args.repeat,
+        'repeticoes_chat': args.chat_repeat,
+    }
+
+    resultados = {}
+    for nome in [item.strip() for item in args.sizes.split(',') if item.strip()]:
+        resultados[nome] = run_size(nome, parse_size(nome), args)
+        summary(nome, resultados[nome])
+
+    atual = {'meta': meta, 'resultados': resultados}
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{datetime.now():%Y%m%d-%H%M%S}-{git['commit'] or 'sem-commit'}{'-alterado' if git['alterado'] else ''}.json"
+    )
+    anterior_path = args.compare or latest_result(exclude=os.path.abspath(output))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(atual, f, ensure_ascii=False, indent=2)
+    print(f"💾 Resultado salvo em {os.path.relpath(output)}")
+
+    regressoes = []
+    if anterior_path:
+        with open(anterior_path) as f:
+            regressoes = compare(atual, json.load(f), args.threshold)
+    return 1 if regressoes and args.fail_on_regression else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Planilha de vendas sintética para os benchmarks: guias mensais com as colunas da
+planilha real (Data, Produto, Categoria, Região, Quantidade, Preço Unitário,
+Receita Total), geradas de forma determinística a partir de uma semente e
+serializadas no formato JSON do doGet do Apps Script (ver README)
+"""
+import base64
+import hashlib
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fast_json import dumps
+
+COLUNAS = ['Data', 'Produto', 'Categoria', 'Região', 'Quantidade', 'Preço Unitário', 'Receita Total']
+
+CATEGORIAS = ('Eletrônicos', 'Informática', 'Casa', 'Escritório', 'Acessórios', 'Games')
+
+# Regiões e peso de cada uma nas vendas
+REGIOES = {'Sudeste': 0.42, 'Sul': 0.18, 'Nordeste': 0.2, 'Centro-Oeste': 0.1, 'Norte': 0.1}
+
+PRODUTOS_POR_CATEGORIA = 40
+
+NOMES_MESES = ('Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 'Julho',
+               'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro')
+
+# Primeiro mês da primeira guia; as guias seguintes avançam um mês cada
+ANO_INICIAL = 2024
+
+# Tamanhos nomeados aceitos em parse_size
+TAMANHOS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+def parse_size(texto):
+    """
+    '10k', '100k', '1m' ou um número de linhas -> int
+    """
+    texto = texto.strip().lower()
+    if texto in TAMANHOS:
+        return TAMANHOS[texto]
+    if texto[-1:] in ('k', 'm'):
+        return int(float(texto[:-1]) * (1_000 if texto[-1] == 'k' else 1_000_000))
+    return int(texto)
+
+def _md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+class Catalog:
+    """
+    Produtos com categoria e preço base fixos; a popularidade segue uma curva de
+    Zipf para que os rankings tenham cauda longa como em um catálogo real
+    """
+    def __init__(self, rng):
+        self.produtos = np.array([
+            f"{categoria} {indice + 1:02d}"
+            for categoria in CATEGORIAS
+            for indice in range(PRODUTOS_POR_CATEGORIA)
+        ], dtype=object)
+        self.categorias = np.repeat(np.array(CATEGORIAS, dtype=object), PRODUTOS_POR_CATEGORIA)
+        self.precos = np.round(rng.uniform(10, 2500, len(self.produtos)), 2)
+
+        pesos = 1 / np.arange(1, len(self.produtos) + 1) ** 0.8
+        self.pesos = rng.permutation(pesos / pesos.sum())
+        self.regioes = np.array(list(REGIOES), dtype=object)
+        self.pesos_regioes = np.array(list(REGIOES.values()))
+
+class SyntheticSheet:
+    """
+    Uma guia mensal em colunas NumPy; o JSON da guia inteira é montado uma vez e guardado
+    """
+    def __init__(self, name, gid, ano, mes):
+        self.name = name
+        self.gid = gid
+        self.ano = ano
+        self.mes = mes
+        self.columns = {coluna: np.empty(0, dtype=object) for coluna in COLUNAS}
+        self._body = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns['Data'])
+
+    def add_rows(self, rng, catalog, rows):
+        """
+        Acrescenta `rows` vendas no fim da guia (como novas linhas na planilha)
+        """
+        produto = rng.choice(len(catalog.produtos), size=rows, p=catalog.pesos)
+        quantidade = rng.integers(1, 11, size=rows)
+        preco = np.round(catalog.precos[produto] * rng.uniform(0.9, 1.1, size=rows), 2)
+        # Datas do Apps Script: meia-noite de Brasília serializada em UTC
+        dias = np.array([f"{self.ano}-{self.mes:02d}-{dia:02d}T03:00:00.000Z" for dia in range(1, 29)], dtype=object)
+
+        novas = {
+            'Data': dias[rng.integers(0, 28, size=rows)],
+            'Produto': catalog.produtos[produto],
+            'Categoria': catalog.categorias[produto],
+            'Região': rng.choice(catalog.regioes, size=rows, p=catalog.pesos_regioes),
+            'Quantidade': quantidade,
+            'Preço Unitário': preco,
+            'Receita Total': np.round(quantidade * preco, 2),
+        }
+        for coluna in COLUNAS:
+            self.columns[coluna] = np.concatenate([self.columns[coluna], novas[coluna]]) if len(self) else novas[coluna]
+        with self._lock:
+            self._body = None
+
+    def records(self, offset=0, stop=None):
+        """
+        Linhas [offset, stop) no formato de sheetToJson (um objeto por linha)
+        """
+        valores = [self.columns[coluna][offset:stop].tolist() for coluna in COLUNAS]
+        return [dict(zip(COLUNAS, linha)) for linha in zip(*valores)]
+
+    def _encode(self, offset=0):
+        data = dumps(self.records(offset))
+        prefixo = dumps({'name': self.name, 'gid': self.gid, 'columns': COLUNAS})[:-1]
+        return prefixo + b',"data":' + data, data
+
+    def body(self):
+        """
+        (JSON da guia inteira sem o fechamento, hash) guardados até a próxima alteração
+        """
+        with self._lock:
+            if self._body is None:
+                corpo, data = self._encode()
+                self._body = (corpo, _md5(data))
+            return self._body
+
+    @property
+    def hash(self):
+        return self.body()[1]
+
+    def sheet_json(self, offset=0):
+        """
+        Resposta de ?gid= (com prefixHash das linhas anteriores quando há offset)
+        """
+        corpo, sheet_hash = self.body()
+        extra = {'hash': sheet_hash, 'success': True}
+        if offset > 0:
+            corpo = self._encode(offset)[0]
+            extra['prefixHash'] = _md5(dumps(self.records(0, offset)))
+        return corpo + b',' + dumps(extra)[1:]
+
+class SyntheticWorkbook:
+    """
+    Planilha com `rows` vendas distribuídas em `sheets` guias mensais consecutivas
+    """
+    def __init__(self, rows, sheets=12, seed=42):
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.catalog = Catalog(self.rng)
+        self.sheets = []
+        for indice in range(sheets):
+            ano, mes = ANO_INICIAL + indice // 12, indice % 12 + 1
+            sheet = SyntheticSheet(f"{NOMES_MESES[mes - 1]} {ano}", 1000 + indice, ano, mes)
+            sheet.add_rows(self.rng, self.catalog, rows // sheets + (1 if indice < rows % sheets else 0))
+            self.sheets.append(sheet)
+
+    @property
+    def total_rows(self):
+        return sum(len(sheet) for sheet in self.sheets)
+
+    def sheet(self, gid):
+        for sheet in self.sheets:
+            if str(sheet.gid) == str(gid):
+                return sheet
+        return None
+
+    def append(self, rows, gid=None):
+        """
+        Novas vendas no fim de uma guia (padrão: a última, o mês corrente)
+        """
+        sheet = self.sheet(gid) if gid is not None else self.sheets[-1]
+        sheet.add_rows(self.rng, self.catalog, rows)
+        return sheet
+
+    def encode(self):
+        """
+        Monta o JSON de todas as guias (fora da medição)
+        """
+        for sheet in self.sheets:
+            sheet.body()
@@ -0,0 +1,279 @@
+"""
+Contexto da IA montado a partir da pergunta: só os recortes e rankings relevantes,
+dentro de um limite de tokens
+"""
+import re
+
+from text_utils import normalize_question
+from sales_aggregates import DIMENSOES, aggregate
+
+# Nomes dos meses (sem acento, como na pergunta normalizada)
+MESES = {
+    'janeiro': 1, 'fevereiro': 2, 'marco': 3, 'abril': 4, 'maio': 5, 'junho': 6,
+    'julho': 7, 'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12,
+}
+
+# Períodos relativos ('último trimestre', 'últimos 3 meses') -> quantidade de meses
+PERIODOS = {'mes': 1, 'bimestre': 2, 'trimestre': 3, 'semestre': 6, 'ano': 12}
+NUMEROS = {'um': 1, 'dois': 2, 'tres': 3, 'quatro': 4, 'cinco': 5, 'seis': 6, 'doze': 12}
+
+_NOMES_MESES = '|'.join(MESES)
+
+# Prefixos de palavras da pergunta que pedem cada ranking
+INTENCOES = {
+    'produtos': ('produto', 'item', 'itens', 'mix'),
+    'categorias': ('categoria', 'segmento'),
+    'regioes': ('regiao', 'regioes', 'geografic', 'onde', 'local'),
+    'meses': ('mes', 'meses', 'mensa', 'tendencia', 'sazonal', 'evolucao', 'periodo', 'crescimento', 'temporal'),
+    'faixas_preco': ('preco', 'faixa'),
+}
+
+# Palavras que pedem também os piores colocados
+PIORES = ('pior', 'menos', 'menor', 'baixo', 'fraco', 'caiu', 'queda')
+
+TITULOS = {
+    'produtos': 'PRODUTOS',
+    'categorias': 'CATEGORIAS',
+    'regioes': 'REGIÕES',
+    'meses': 'MESES',
+    'faixas_preco': 'FAIXAS DE PREÇO',
+}
+
+# Itens por ranking (top e, quando pedido, bottom)
+TOP_N = 10
+
+def estimate_tokens(text):
+    """
+    Estimativa simples de tokens (~4 caracteres por token)
+    """
+    return len(text) // 4 + 1
+
+def _ngrams(palavras, tamanho):
+    """
+    Sequências de 1 a `tamanho` palavras seguidas da pergunta
+    """
+    return {' '.join(palavras[i:i + n]) for n in range(1, tamanho + 1) for i in range(len(palavras) - n + 1)}
+
+def find_entities(index, question):
+    """
+    Valores de produto, categoria, região e mês citados na pergunta
+    (procurados nos nomes normalizados do FrameIndex do snapshot)
+    """
+    pergunta = f" {normalize_question(question)} "
+    palavras = pergunta.split()
+    found = {}
+
+    for key in DIMENSOES:
+        names = index.names[key]
+        matches = [(nome, label) for nome in _ngrams(palavras, index.name_words[key]) & names.keys()
+                   for label in names[nome]]
+        # Mesma ordem das categorias
+        matches.sort(key=lambda match: index.postings[key][2][match[1]])
+        # 'Mouse' não conta se 'Mouse Gamer' também foi citado
+        found[key] = [label for nome, label in matches
+                      if not any(nome != outro and f" {nome} " in f" {outro} " for outro, _ in matches)]
+
+    # Meses: por nome, intervalo ('de janeiro a março'), 'MM/AAAA' ou 'AAAA-MM',
+    # opcionalmente restritos a um ano, ou os últimos N meses com dados
+    labels = list(index.frame['mes'].cat.categories)
+    relativo = re.search(rf" ultim[oa]s? (?:(\d+|{'|'.join(NUMEROS)}) )?({'|'.join(PERIODOS)}|meses)\b", pergunta)
+    if relativo:
+        quantidade, periodo = relativo.groups()
+        meses = PERIODOS.get(periodo, 1)
+        if quantidade:
+            meses *= int(quantidade) if quantidade.isdigit() else NUMEROS[quantidade]
+        found['mes'] = labels[-meses:] if meses > 0 else []
+        return found
+
+    anos = set(re.findall(r'\b(20\d{2})\b', pergunta))
+    numeros = {numero for nome, numero in MESES.items() if f" {nome} " in pergunta}
+    for inicio, fim in re.findall(rf"\b({_NOMES_MESES})(?: de 20\d{{2}})? (?:a|ate) ({_NOMES_MESES})\b", pergunta):
+        if MESES[inicio] <= MESES[fim]:
+            numeros.update(range(MESES[inicio], MESES[fim] + 1))
+    explicitos = set()
+    for mes, ano in re.findall(r'\b(\d{1,2})/(20\d{2})\b', question):
+        explicitos.add((ano, int(mes)))
+    for ano, mes in re.findall(r'\b(20\d{2})-(\d{1,2})\b', question):
+        explicitos.add((ano, int(mes)))
+
+    meses = []
+    for label in labels:
+        ano, mes = label.split('-')
+        if (ano, int(mes)) in explicitos:
+            meses.append(label)
+        elif numeros and int(mes) in numeros and (not anos or ano in anos):
+            meses.append(label)
+        elif not numeros and not explicitos and ano in anos:
+            meses.append(label)
+    found['mes'] = meses
+
+    return found
+
+def find_intents(question, entities=None, index=None):
+    """
+    Rankings pedidos pela pergunta e se ela quer também os piores
+    (palavras que fazem parte de um nome citado, como 'Produto 17', não contam;
+    com o FrameIndex, os nomes normalizados vêm dele)
+    """
+    pergunta = f" {normalize_question(question)} "
+    for key, labels in (entities or {}).items():
+        normalized = index.normalized[key] if index is not None else {}
+        for label in labels:
+            nome = normalized.get(label)
+            pergunta = pergunta.replace(f" {nome if nome is not None else normalize_question(label)} ", " ")
+    palavras = pergunta.split()
+    intents = [key for key, prefixos in INTENCOES.items()
+               if any(p.startswith(prefixos) for p in palavras)]
+    piores = any(p.startswith(PIORES) for p in palavras)
+    return intents, piores
+
+def _linha(i, item, total_revenue):
+    percentage = (item['receita'] / total_revenue * 100) if total_revenue > 0 else 0
+    extra = f" [{item['categoria']}]" if 'categoria' in item else ''
+    return (f"{i}. {item['nome']}{extra}: R$ {item['receita']:,.2f} ({percentage:.1f}%) | "
+            f"{item['vendas']:,} vendas | {item['quantidade']:,} un.")
+
+def _ranking(key, items, total_revenue, piores):
+    linhas = [f"=== {TITULOS[key]} (TOP {min(TOP_N, len(items))} de {len(items)}) ==="]
+    if key == 'meses':
+        # Meses em ordem cronológica
+        linhas = [f"=== {TITULOS[key]} ({len(items)}) ==="]
+        return linhas + [_linha(i, item, total_revenue) for i, item in enumerate(items, 1)]
+
+    linhas += [_linha(i, item, total_revenue) for i, item in enumerate(items[:TOP_N], 1)]
+    if piores and len(items) > TOP_N:
+        linhas.append(f"--- {TITULOS[key]} (PIORES {min(TOP_N, len(items) - TOP_N)}) ---")
+        inicio = max(TOP_N, len(items) - TOP_N)
+        linhas += [_linha(i, item, total_revenue) for i, item in enumerate(items[inicio:], inicio + 1)]
+    return linhas
+
+def _resumo(aggregates, last_update, total_sheets):
+    meses = aggregates['meses']
+    periodo = f"{meses[0]['nome']} a {meses[-1]['nome']}" if meses else 'sem datas válidas'
+    return [
+        "=== RESUMO ===",
+        f"- Transações: {aggregates['total_registros']:,}",
+        f"- Receita total: R$ {aggregates['receita_total']:,.2f}",
+        f"- Quantidade total: {aggregates['quantidade_total']:,} unidades",
+        f"- Ticket médio: R$ {aggregates['ticket_medio']:,.2f}",
+        f"- Período: {periodo} (atualizado em {last_update or 'dados mais recentes'}, {total_sheets} guias)",
+        f"- Produtos: {len(aggregates['produtos'])} | Categorias: {len(aggregates['categorias'])} | "
+        f"Regiões: {len(aggregates['regioes'])}",
+    ]
+
+def slice_frame(frame, entities, index=None):
+    """
+    Linhas do recorte citado (mesma dimensão = OU, dimensões diferentes = E).
+    Com o índice do snapshot, só as linhas do recorte são visitadas.
+    """
+    if index is not None:
+        return index.select(entities)
+
+    mask = None
+    for key, labels in entities.items():
+        if not labels:
+            continue
+        cond = frame[key].isin(labels)
+        mask = cond if mask is None else (mask & cond)
+    return frame if mask is None else frame[mask]
+
+def describe_entities(entities):
+    """
+    Descrição curta do recorte, ex.: 'regiao = Norte, Sul E mes = 2025-01 a 2025-06'
+    """
+    descricao = []
+    for key, labels in entities.items():
+        if not labels:
+            continue
+        if key == 'mes' and len(labels) > 3:
+            descricao.append(f"mes = {labels[0]} a {labels[-1]}")
+        else:
+            descricao.append(f"{key} = {', '.join(labels)}")
+    return ' E '.join(descricao)
+
+def _recorte(frame, entities, total_revenue, index=None):
+    """
+    Agregados do recorte citado
+    """
+    slice_aggregates = aggregate(slice_frame(frame, entities, index))
+    receita = slice_aggregates['receita_total']
+    percentage = (receita / total_revenue * 100) if total_revenue > 0 else 0
+
+    linhas = [
+        f"=== RECORTE: {describe_entities(entities)} ===",
+        f"- Transações: {slice_aggregates['total_registros']:,}",
+        f"- Receita: R$ {receita:,.2f} ({percentage:.1f}% do total)",
+        f"- Quantidade: {slice_aggregates['quantidade_total']:,} unidades",
+        f"- Ticket médio: R$ {slice_aggregates['ticket_medio']:,.2f}",
+    ]
+
+    # Quebras do recorte pelas dimensões que não foram fixadas
+    for key, group in (('produto', 'produtos'), ('categoria', 'categorias'), ('regiao', 'regioes'), ('mes', 'meses')):
+        items = slice_aggregates[group]
+        if len(entities.get(key) or []) == 1 or len(items) < 2:
+            continue
+        if group != 'meses':
+            items = items[:5]
+        linhas.append(f"--- Recorte por {TITULOS[group].lower()} ---")
+        linhas += [_linha(i, item, receita) for i, item in enumerate(items, 1)]
+
+    return linhas
+
+def _posicoes(aggregates, entities):
+    """
+    Posição de cada produto, categoria ou região citado no ranking geral de receita
+    """
+    linhas = []
+    for key, group in (('produto', 'produtos'), ('categoria', 'categorias'), ('regiao', 'regioes')):
+        items = aggregates[group]
+        posicao = {item['nome']: i for i, item in enumerate(items, 1)}
+        for label in entities.get(key) or []:
+            if label in posicao:
+                linhas.append(f"- {label}: {posicao[label]}º de {len(items)} {group} em receita "
+                              f"(R$ {items[posicao[label] - 1]['receita']:,.2f} no período todo)")
+    if not linhas:
+        return []
+    return ["=== POSIÇÃO NO RANKING GERAL ==="] + linhas
+
+def build_question_context(snapshot, question, max_tokens=1500):
+    """
+    Contexto compacto para a pergunta: resumo, recorte das entidades citadas e
+    os rankings pedidos, acrescentados por prioridade até o limite de tokens
+    """
+    aggregates = snapshot.aggregates
+    if not aggregates or aggregates['total_registros'] == 0 or snapshot.frame is None:
+        return "Nenhum dado disponível para análise."
+
+    total_revenue = aggregates['receita_total']
+    entities = find_entities(snapshot.index, question)
+    intents, piores = find_intents(question, entities, snapshot.index)
+
+    secoes = [_resumo(aggregates, snapshot.last_update, snapshot.total_sheets)]
+
+    if any(entities.values()):
+        secoes.append(_recorte(snapshot.frame, entities, total_revenue, snapshot.index))
+        secoes.append(_posicoes(aggregates, entities))
+
+    if not intents and not any(entities.values()):
+        # Pergunta genérica: visão geral de todas as dimensões
+        intents = ['produtos', 'regioes', 'categorias', 'meses']
+
+    for key in intents:
+        secoes.append(_ranking(key, aggregates[key], total_revenue, piores))
+
+    linhas = []
+    usados = 0
+    for numero, secao in enumerate(secoes):
+        if not secao:
+            continue
+        for linha in secao:
+            custo = estimate_tokens(linha)
+            # O resumo sempre vai inteiro; o resto entra enquanto couber
+            if numero > 0 and usados + custo > max_tokens:
+                linhas.append("(contexto truncado pelo limite de tokens)")
+                return "\n".join(linhas)
+            linhas.append(linha)
+            usados += custo
+        linhas.append("")
+
+    return "\n".join(linhas).strip()
@@ -1,11 +1,28 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
+import base64
+import dataclasses
+import itertools
 import json
 from datetime import datetime
 import threading
 import time
 import os
 from apps_script_service import apps_script_service
-from api_openrouter import consultar_ia
+from api_openrouter import consultar_ia, consultar_ia_stream, consultar_ia_ferramentas, model_health, AVISO_INTERROMPIDA
+from data_snapshot import build_snapshot, save_snapshot, load_snapshot, EMPTY_SNAPSHOT
+from sheet_store import materialize, SheetRows
+from refresh_coordinator import RefreshCoordinator
+from response_cache import ResponseCache
+from context_builder import build_question_context
+from query_engine import TOOLS, execute_tool
+from local_analyst import answer_locally
+from sales_aggregates import empty_aggregates, FILTROS_MESES
+from time_cube import GRANULARIDADES
+from group_table import ORDENACOES
+from http_cache import conditional, compress_response, precompress, precompressed_response
+from fast_json import FastJSONProvider, dumps
+from update_events import UpdateBroadcaster, MAX_POLL_SECONDS
+from metrics import metrics, start_request, finish_request
 
 app = Flask(__name__)
 
@@ -13,110 +30,295 @@ app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
 app.config['JSON_SORT_KEYS'] = False
 
-# Cache para os dados
-cached_data = None
-last_update = None
-update_lock = threading.Lock()
+# jsonify com o encoder rápido (orjson quando instalado)
+app.json = FastJSONProvider(app)
+
+# Duração de cada requisição (registrada antes da compressão para que o tempo dela entre na conta)
+app.before_request(start_request)
+app.after_request(finish_request)
+
+# Compressão gzip/brotli das respostas JSON e HTML
+app.after_request(compress_response)
+
+# Agrupamentos disponíveis em /api/aggregates (parâmetro -> chave dos agregados)
+AGGREGATE_GROUPS = {
+    'categoria': 'categorias',
+    'regiao': 'regioes',
+    'produto': 'produtos',
+}
+
+# Maior janela da média móvel em /api/timeseries (em períodos)
+MAX_MOVING_WINDOW = 52
+
+# Paginação de /api/groups (tabelas virtualizadas do dashboard)
+DEFAULT_GROUP_PAGE = 50
+MAX_GROUP_PAGE = 500
+
+# Paginação de /api/data
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# Cache para os dados: snapshot imutável trocado por inteiro a cada atualização.
+# Leitores só pegam a referência atual, sem lock; quem escreve é o coordenador.
+snapshot = EMPTY_SNAPSHOT
+disk_cache_checked = False
+# Primeira leitura do snapshot em disco: pedidos simultâneos esperam a mesma leitura
+disk_cache_lock = threading.Lock()
+# Só para trocar a referência com segurança fora do coordenador (corpo de /api/data montado depois)
+snapshot_lock = threading.Lock()
+
+# Limite (tokens estimados) do contexto montado para cada pergunta do chat
+CONTEXT_MAX_TOKENS = int(os.getenv('CHAT_CONTEXT_TOKENS', '1500'))
+
+# Chat com ferramentas de consulta (function calling); '0' usa só o contexto pré-montado
+CHAT_TOOLS = os.getenv('CHAT_TOOLS', '1') != '0'
+
+# Avisos de nova versão para os dashboards abertos (/api/updates)
+update_events = UpdateBroadcaster()
+
+# Respostas do chat por pergunta + versão dos dados (invalidadas a cada atualização)
+response_cache = ResponseCache(
+    max_size=int(os.getenv('CHAT_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('CHAT_CACHE_TTL', '3600')),
+    similarity=float(os.getenv('CHAT_CACHE_SIMILARITY', '0.92')),
+)
+
+@metrics.timed('refresh')
+def refresh_snapshot():
+    """Busca a planilha e publica um novo snapshot (executado só pelo coordenador)"""
+    global snapshot
+    
+    print("Atualizando dados da planilha...")
+    with metrics.span('fetch', mode='sync'):
+        data = apps_script_service.get_latest_data()
+    
+    if data is None:
+        print("Nenhum dado encontrado na planilha.")
+        raise RuntimeError("Nenhum dado encontrado na planilha.")
+    
+    if data is snapshot.data:
+        # Sincronização incremental sem alterações: mantém o snapshot atual
+        print("Nenhuma alteração na planilha desde a última atualização.")
+        metrics.inc('refresh_total', result='unchanged')
+        return {'changed': False, 'version': snapshot.version}
+    
+    if not isinstance(data, dict):
+        # Uma única guia (compatibilidade)
+        data = data.to_dict('records')
+    
+    # Monta o snapshot completo (agregados e contexto da IA) antes de publicar
+    last_update = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # Colunas já convertidas na sincronização (só as guias alteradas foram convertidas de novo)
+    typed = apps_script_service.typed_data(data)
+    if typed is not None:
+        new_snapshot = build_snapshot(data, last_update, snapshot.version + 1, typed=typed[0], parse_report=typed[1])
+    else:
+        new_snapshot = build_snapshot(data, last_update, snapshot.version + 1)
+    
+    # /api/data completo serializado e comprimido uma vez por atualização
+    new_snapshot = with_data_payload(new_snapshot)
+    with snapshot_lock:
+        previous = snapshot
+        snapshot = new_snapshot
+    
+    # Respostas calculadas sobre os dados antigos não valem mais
+    response_cache.invalidate(new_snapshot.version)
+    
+    # Avisa os dashboards conectados (KPIs e diferença dos totais, sem as linhas)
+    update_events.publish(build_update_event(previous, new_snapshot))
+    
+    # Persiste para que o próximo cold start não precise esperar o Apps Script
+    try:
+        save_snapshot(new_snapshot)
+    except Exception as e:
+        print(f"⚠️ Não foi possível gravar o snapshot em disco: {e}")
+    
+    if isinstance(data, dict):
+        print(f"Dados atualizados com sucesso! {new_snapshot.total_sheets} guias com {new_snapshot.total_records} registros totais.")
+    else:
+        print(f"Dados atualizados com sucesso! {new_snapshot.total_records} registros encontrados.")
+    
+    metrics.inc('refresh_total', result='changed')
+    return {
+        'changed': True,
+        'version': new_snapshot.version,
+        'total_records': new_snapshot.total_records,
+        'parse_failures': new_snapshot.parse_report['falhas'] if new_snapshot.parse_report else {},
+    }
+
+def with_data_payload(snap):
+    """Cópia do snapshot com o corpo de /api/data serializado e comprimido"""
+    with metrics.span('serialize', target='data_payload') as info:
+        payload = build_data_payload(snap)
+        snap = dataclasses.replace(snap, data_payload=precompress(payload))
+        info.update(bytes=len(payload), linhas=snap.total_records)
+    metrics.inc('rows_processed_total', snap.total_records, stage='serialize')
+    return snap
+
+def ensure_data_payload(snap):
+    """Snapshot lido do disco chega sem o corpo de /api/data: monta uma vez e publica
+    
+    Pedidos simultâneos esperam o primeiro montar; se uma atualização já publicou
+    outro snapshot nesse meio tempo, só esta resposta usa a cópia montada.
+    """
+    global snapshot
+    
+    with snapshot_lock:
+        current = snapshot
+        if current.version == snap.version and current.data_payload is not None:
+            return current
+        built = with_data_payload(snap)
+        if current is snap:
+            snapshot = built
+        return built
+
+def build_data_payload(snap):
+    """Corpo de /api/data sem parâmetros, em bytes
+    
+    As linhas de cada guia são serializadas em blocos direto das colunas,
+    sem montar todos os dicts de uma vez.
+    """
+    if not isinstance(snap.data, dict):
+        # Uma única guia (compatibilidade)
+        return dumps({
+            'data': snap.data or [],
+            'last_update': snap.last_update,
+            'count': snap.total_records
+        })
+    
+    parts = [b'{"data":{']
+    for i, (key, sheet) in enumerate(snap.data.items()):
+        meta = {k: v for k, v in sheet.items() if k != 'dados'}
+        rows = sheet['dados']
+        blocks = rows.blocks() if isinstance(rows, SheetRows) else [rows]
+        parts.append((b',' if i else b'') + dumps(key) + b':' + dumps(meta)[:-1] + (b',' if meta else b'') + b'"dados":[')
+        parts.append(b','.join(dumps(block)[1:-1] for block in blocks if block))
+        parts.append(b']}')
+    parts.append(b'},')
+    parts.append(dumps({
+        'last_update': snap.last_update,
+        'total_sheets': snap.total_sheets,
+        'total_records': snap.total_records,
+        'sheets_info': snap.sheets_info
+    })[1:])
+    return b''.join(parts)
+
+def build_kpis(aggregates):
+    """KPIs do dashboard a partir dos agregados de um período"""
+    return {
+        'receita_total': aggregates['receita_total'],
+        'total_vendas': aggregates['total_registros'],
+        'quantidade_total': aggregates['quantidade_total'],
+        'ticket_medio': aggregates['ticket_medio'],
+        'produtos_unicos': len(aggregates['produtos']),
+        'regioes_ativas': len(aggregates['regioes'])
+    }
+
+def build_update_event(previous, current):
+    """Evento de nova versão: KPIs de cada filtro do dashboard, tendências,
+    diferença dos totais e guias alteradas em relação à versão anterior"""
+    before = previous.aggregates or empty_aggregates()
+    after = current.aggregates or empty_aggregates()
+    previous_sheets = previous.sheets_info or {}
+    
+    return {
+        'version': current.version,
+        'previous_version': previous.version,
+        'last_update': current.last_update,
+        'total_records': current.total_records,
+        'delta': {
+            'registros': current.total_records - previous.total_records,
+            'receita': round(after['receita_total'] - before['receita_total'], 2),
+            'quantidade': after['quantidade_total'] - before['quantidade_total'],
+        },
+        'guias_alteradas': [
+            key for key, info in (current.sheets_info or {}).items()
+            if previous_sheets.get(key) != info
+        ],
+        # Chaves em texto: meses do filtro (0 = todo o período)
+        'kpis': {str(months): build_kpis(current.aggregates_for_months(months)) for months in (0, *FILTROS_MESES)},
+        'tendencias': current.cube.trends() if current.cube is not None else None,
+    }
+
+# Uma atualização por vez; pedidos simultâneos esperam a mesma atualização
+refresh_coordinator = RefreshCoordinator(refresh_snapshot)
 
 def update_data():
-    """Atualiza os dados da planilha"""
-    global cached_data, last_update
+    """Atualiza os dados da planilha (ou espera a atualização que já está em andamento)"""
+    job = refresh_coordinator.refresh()
+    if job.status == 'erro':
+        print(f"Erro ao atualizar dados: {job.error}")
+    return job
+
+def ensure_data():
+    """Garante que há um snapshot para responder
     
-    with update_lock:
-        try:
-            print("Atualizando dados da planilha...")
-            data = apps_script_service.get_latest_data()
-         
-            if data is not None:
-                if isinstance(data, dict):
-                    # Múltiplas guias
-                    cached_data = data
-                    total_records = sum(sheet['total_registros'] for sheet in data.values())
-                    last_update = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    print(f"Dados atualizados com sucesso! {len(data)} guias com {total_records} registros totais.")
-                else:
-                    # Uma única guia (compatibilidade)
-                    cached_data = data.to_dict('records')
-                    last_update = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    print(f"Dados atualizados com sucesso! {len(cached_data)} registros encontrados.")
-            else:
-                print("Nenhum dado encontrado na planilha.")
-                
-        except Exception as e:
-            print(f"Erro ao atualizar dados: {e}")
+    No primeiro acesso tenta o snapshot gravado em disco: se existir, responde
+    com ele (mesmo desatualizado) e atualiza a planilha em segundo plano.
+    Pedidos simultâneos nesse primeiro acesso esperam a mesma leitura do disco.
+    Sem snapshot em disco, faz a carga completa antes de responder.
+    """
+    global snapshot, disk_cache_checked
+    
+    if not snapshot.is_empty:
+        return
+    
+    with disk_cache_lock:
+        if not disk_cache_checked:
+            try:
+                cached = load_snapshot()
+            except Exception as e:
+                print(f"⚠️ Snapshot em disco inválido: {e}")
+                cached = None
+            
+            with snapshot_lock:
+                if cached is not None and snapshot.is_empty:
+                    snapshot = cached
+            disk_cache_checked = True
+            
+            if snapshot is cached:
+                print(f"⚡ Snapshot carregado do disco ({cached.total_records} registros de {cached.last_update}), atualizando em segundo plano...")
+                refresh_coordinator.request()
+    
+    if snapshot.is_empty:
+        update_data()
+
+# GETs que só dependem do snapshot: ETag/Last-Modified pela versão e 304 sem montar o corpo
+snapshot_cached = conditional(lambda: snapshot, prepare=ensure_data)
+# Idem para respostas com o filtro "últimos N meses", cujo corte muda na virada do dia
+snapshot_cached_daily = conditional(lambda: snapshot, prepare=ensure_data, dated=True)
 
 def get_analysis():
     """Obtém análise dos dados usando IA"""
     try:
-        if cached_data is None:
+        snap = snapshot
+        if snap.is_empty:
             return "Nenhum dado disponível para análise."
         
-        # Processa todos os dados para análise detalhada
-        all_data = []
-        if isinstance(cached_data, dict):
-            # Múltiplas guias
-            for sheet_data in cached_data.values():
-                if 'dados' in sheet_data and isinstance(sheet_data['dados'], list):
-                    all_data.extend(sheet_data['dados'])
-        else:
-            # Uma única guia (compatibilidade)
-            all_data = cached_data
+        # Agregados pré-calculados na atualização
+        aggregates = snap.aggregates
         
-        if not all_data:
+        if not aggregates or aggregates['total_registros'] == 0:
             return "Nenhum dado disponível para análise."
         
         # Análise detalhada dos dados
-        analysis_results = analyze_sales_data_detailed(all_data)
+        analysis_results = analyze_sales_data_detailed(aggregates, snap.last_update)
         
         return analysis_results
         
     except Exception as e:
         return f"Erro ao gerar análise: {e}"
 
-def analyze_sales_data_detailed(data):
+def analyze_sales_data_detailed(aggregates, last_update=None):
     """Faz análise detalhada dos dados de vendas"""
     try:
-        # Análise simples sem pandas para reduzir tamanho
-        total_records = len(data)
-        total_revenue = 0
-        categories = {}
-        regions = {}
-        products = {}
+        total_records = aggregates['total_registros']
+        total_revenue = aggregates['receita_total']
         
-        # Análise básica dos dados
-        for row in data:
-            # Receita
-            try:
-                revenue = float(str(row.get('Receita Total', '0')).replace(',', '.').replace('R$', '').strip()) or 0
-                total_revenue += revenue
-            except (ValueError, TypeError):
-                pass
-            
-            # Categorias
-            category = row.get('Categoria', 'Outros')
-            if category not in categories:
-                categories[category] = {'count': 0, 'revenue': 0}
-            categories[category]['count'] += 1
-            categories[category]['revenue'] += revenue
-            
-            # Regiões
-            region = row.get('Região', 'Outros')
-            if region not in regions:
-                regions[region] = {'count': 0, 'revenue': 0}
-            regions[region]['count'] += 1
-            regions[region]['revenue'] += revenue
-            
-            # Produtos
-            product = row.get('Produto', 'Outros')
-            if product not in products:
-                products[product] = {'count': 0, 'revenue': 0}
-            products[product]['count'] += 1
-            products[product]['revenue'] += revenue
-        
-        # Top performers
-        top_categories = sorted(categories.items(), key=lambda x: x[1]['revenue'], reverse=True)[:3]
-        top_regions = sorted(regions.items(), key=lambda x: x[1]['revenue'], reverse=True)[:3]
-        top_products = sorted(products.items(), key=lambda x: x[1]['revenue'], reverse=True)[:5]
+        # Top performers (grupos já ordenados por receita)
+        top_categories = aggregates['categorias'][:3]
+        top_regions = aggregates['regioes'][:3]
+        top_products = aggregates['produtos'][:5]
         
         # Gera análise estruturada simplificada
         analysis = f"""# Principais Insights de Vendas - Análise Detalhada
@@ -129,25 +331,25 @@ def analyze_sales_data_detailed(data):
 ## Top 3 Categorias por Receita:
 """
         
-        for i, (category, data) in enumerate(top_categories, 1):
-            percentage = (data['revenue'] / total_revenue * 100) if total_revenue > 0 else 0
-            analysis += f"{i}. **{category}**: R$ {data['revenue']:,.2f} ({percentage:.1f}% do total) - {data['count']} vendas\n"
+        for i, data in enumerate(top_categories, 1):
+            percentage = (data['receita'] / total_revenue * 100) if total_revenue > 0 else 0
+            analysis += f"{i}. **{data['nome']}**: R$ {data['receita']:,.2f} ({percentage:.1f}% do total) - {data['vendas']} vendas\n"
         
         analysis += f"""
 ## Top 3 Regiões por Receita:
 """
         
-        for i, (region, data) in enumerate(top_regions, 1):
-            percentage = (data['revenue'] / total_revenue * 100) if total_revenue > 0 else 0
-            analysis += f"{i}. **{region}**: R$ {data['revenue']:,.2f} ({percentage:.1f}% do total) - {data['count']} vendas\n"
+        for i, data in enumerate(top_regions, 1):
+            percentage = (data['receita'] / total_revenue * 100) if total_revenue > 0 else 0
+            analysis += f"{i}. **{data['nome']}**: R$ {data['receita']:,.2f} ({percentage:.1f}% do total) - {data['vendas']} vendas\n"
         
         analysis += f"""
 ## Top 5 Produtos por Receita:
 """
         
-        for i, (product, data) in enumerate(top_products, 1):
-            avg_ticket = data['revenue'] / data['count'] if data['count'] > 0 else 0
-            analysis += f"{i}. **{product}**: R$ {data['revenue']:,.2f} ({data['count']} vendas, ticket médio R$ {avg_ticket:,.2f})\n"
+        for i, data in enumerate(top_products, 1):
+            avg_ticket = data['receita'] / data['vendas'] if data['vendas'] > 0 else 0
+            analysis += f"{i}. **{data['nome']}**: R$ {data['receita']:,.2f} ({data['vendas']} vendas, ticket médio R$ {avg_ticket:,.2f})\n"
         
         analysis += f"""
 ## Resumo Executivo dos Dados
@@ -171,6 +373,8 @@ def get_analysis_with_data(data):
         if not data:
             return "Nenhum dado disponível para análise."
         
+        snap = snapshot
+        
         # Prepara resumo dos dados
         total_revenue = data.get('totalRevenue', 0)
         total_sales = data.get('totalSales', 0)
@@ -212,8 +416,8 @@ def get_analysis_with_data(data):
 ## Identificação de tendências de vendas
 Analisar variações sazonais, picos de demanda, períodos de baixa e crescimento ao longo do ano permite ajustar estoque, campanhas e metas.
 
-**Dados analisados**: {len(cached_data) if isinstance(cached_data, dict) else len(cached_data) if cached_data else 0:,} transações processadas
-**Período**: {last_update if last_update else 'Dados mais recentes disponíveis'}
+**Dados analisados**: {snap.total_records:,} transações processadas
+**Período**: {snap.last_update if snap.last_update else 'Dados mais recentes disponíveis'}
 
 ## Segmentação de clientes
 Separar clientes em grupos por comportamento, localização, ticket médio ou frequência de compra ajuda a personalizar ofertas e comunicação.
@@ -253,8 +457,8 @@ Detectar sazonalidade ou padrões inesperados, aproveitando momentos de pico e m
 ---
 
 ### Resumo dos Dados Analisados
-- **Total de Transações**: {len(cached_data) if isinstance(cached_data, dict) else len(cached_data) if cached_data else 0:,}
-- **Período de Análise**: {last_update if last_update else 'Dados mais recentes'}
+- **Total de Transações**: {snap.total_records:,}
+- **Período de Análise**: {snap.last_update if snap.last_update else 'Dados mais recentes'}
 - **Fonte**: Planilha de vendas integrada
 
 *Análise gerada em {datetime.now().strftime('%d/%m/%Y às %H:%M')}*
@@ -269,54 +473,290 @@ def index():
     """Página principal do dashboard"""
     return render_template('modern_dashboard.html')
 
+def encode_cursor(version, offset):
+    """Cursor opaco com a versão do snapshot e a posição da próxima linha"""
+    return base64.urlsafe_b64encode(f"{version}:{offset}".encode()).decode()
+
+def decode_cursor(cursor):
+    """Lê um cursor gerado por encode_cursor; retorna (versão, posição)"""
+    try:
+        version, offset = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return int(version), int(offset)
+    except Exception:
+        raise ValueError(f"Cursor inválido: {cursor}")
+
 @app.route('/api/data')
+@snapshot_cached
 def get_data():
-    """API para obter dados da planilha"""
-    global cached_data, last_update
+    """API para obter dados da planilha
     
-    if cached_data is None:
-        update_data()
+    Sem parâmetros retorna todas as guias de uma vez (formato original).
+    Parâmetros opcionais:
+    - sheet: chaves ou nomes das guias, separados por vírgula
+    - fields: colunas a retornar, separadas por vírgula
+    - limit / cursor: paginação por cursor (next_cursor na resposta)
+    - format=ndjson: envia uma linha JSON por registro, em streaming
+    """
+    ensure_data()
+    
+    snap = snapshot
+    args = request.args
+    
+    if not any(param in args for param in ('sheet', 'fields', 'limit', 'cursor', 'format')):
+        if snap.data_payload is None and not snap.is_empty:
+            snap = ensure_data_payload(snap)
+        if snap.data_payload is not None:
+            # Bytes prontos da atualização: nada a serializar nem comprimir
+            return precompressed_response(snap.data_payload)
+        if isinstance(snap.data, dict):
+            # Múltiplas guias (linhas montadas a partir das colunas só aqui)
+            return jsonify({
+                'data': materialize(snap.data),
+                'last_update': snap.last_update,
+                'total_sheets': snap.total_sheets,
+                'total_records': snap.total_records,
+                'sheets_info': snap.sheets_info
+            })
+        else:
+            # Uma única guia (compatibilidade)
+            return jsonify({
+                'data': snap.data or [],
+                'last_update': snap.last_update,
+                'count': snap.total_records
+            })
+    
+    def split_param(name):
+        return [item.strip() for item in args.get(name, '').split(',') if item.strip()]
+    
+    try:
+        sheets = snap.resolve_sheets(split_param('sheet'))
+    except KeyError as e:
+        return jsonify({'error': f'Guia não encontrada: {e.args[0]}'}), 404
+    
+    fields = split_param('fields') or None
+    output_format = args.get('format', 'json')
+    
+    start = 0
+    if args.get('cursor'):
+        try:
+            version, start = decode_cursor(args['cursor'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if version != snap.version:
+            return jsonify({'error': 'Os dados foram atualizados; reinicie a paginação sem cursor'}), 409
+    
+    limit = args.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit deve estar entre 1 e {MAX_PAGE_SIZE}'}), 400
+    
+    total = snap.count_rows(sheets)
+    
+    if output_format == 'ndjson':
+        # Streaming: gera uma linha por registro sem montar a resposta inteira em memória
+        rows = snap.iter_rows(sheets, start, fields)
+        if limit is not None:
+            rows = itertools.islice(rows, limit)
+        
+        def generate():
+            for row in rows:
+                yield dumps(row) + b'\n'
+        
+        headers = {
+            'X-Data-Version': str(snap.version),
+            'X-Total-Records': str(total),
+        }
+        if limit is not None and start + limit < total:
+            headers['X-Next-Cursor'] = encode_cursor(snap.version, start + limit)
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
     
-    if isinstance(cached_data, dict):
-        # Múltiplas guias
+    if output_format != 'json':
+        return jsonify({'error': f'Formato não suportado: {output_format}'}), 400
+    
+    page_size = limit or DEFAULT_PAGE_SIZE
+    page = list(itertools.islice(snap.iter_rows(sheets, start, fields), page_size))
+    next_offset = start + len(page)
+    
+    return jsonify({
+        'rows': page,
+        'count': len(page),
+        'total_records': total,
+        'sheets': sheets,
+        'fields': fields,
+        'next_cursor': encode_cursor(snap.version, next_offset) if next_offset < total else None,
+        'version': snap.version,
+        'last_update': snap.last_update
+    })
+
+@app.route('/api/aggregates')
+@snapshot_cached_daily
+def get_aggregates_endpoint():
+    """API com KPIs, série mensal e tabelas agrupadas calculados no servidor"""
+    try:
+        months = request.args.get('months', default=0, type=int)
+        limit = request.args.get('limit', default=20, type=int)
+        groups = [g.strip() for g in request.args.get('group', ','.join(AGGREGATE_GROUPS)).split(',') if g.strip()]
+        
+        invalid = [g for g in groups if g not in AGGREGATE_GROUPS]
+        if months < 0 or limit < 1 or invalid:
+            return jsonify({
+                'error': f'Parâmetros inválidos (months >= 0, limit >= 1, group em {", ".join(AGGREGATE_GROUPS)})'
+            }), 400
+        
+        ensure_data()
+        
+        snap = snapshot
+        aggregates = snap.aggregates_for_months(months) or empty_aggregates()
+        
         return jsonify({
-            'data': cached_data,
-            'last_update': last_update,
-            'total_sheets': len(cached_data),
-            'total_records': sum(sheet['total_registros'] for sheet in cached_data.values()),
-            'sheets_info': {k: {'nome': v['nome'], 'registros': v['total_registros']} for k, v in cached_data.items()}
+            'months': months,
+            'last_update': snap.last_update,
+            'version': snap.version,
+            'total_records': snap.total_records,
+            'kpis': build_kpis(aggregates),
+            # Último mês com dados contra o anterior e o mesmo mês do ano anterior (cubo temporal)
+            'tendencias': snap.cube.trends() if snap.cube is not None else None,
+            'serie_mensal': aggregates['meses'],
+            'grupos': {g: aggregates[AGGREGATE_GROUPS[g]][:limit] for g in groups}
         })
-    else:
-        # Uma única guia (compatibilidade)
+    except Exception as e:
         return jsonify({
-            'data': cached_data or [],
-            'last_update': last_update,
-            'count': len(cached_data) if cached_data else 0
-        })
+            'error': f'Erro ao obter agregados: {str(e)}'
+        }), 500
+
+@app.route('/api/groups')
+@snapshot_cached_daily
+def get_groups_endpoint():
+    """API paginada dos agrupamentos pré-calculados (tabelas virtualizadas do dashboard)
+    
+    Parâmetros:
+    - group: categoria, regiao ou produto
+    - months: últimos N meses (0 = todo o período)
+    - sort: receita (padrão), vendas, quantidade, media ou nome; order: desc (padrão) ou asc
+    - top: só os N primeiros grupos por receita
+    - offset / limit: janela de linhas
+    """
+    args = request.args
+    group = args.get('group')
+    sort = args.get('sort', 'receita')
+    order = args.get('order', 'desc')
+    months = args.get('months', default=0, type=int)
+    offset = args.get('offset', default=0, type=int)
+    limit = args.get('limit', default=DEFAULT_GROUP_PAGE, type=int)
+    top = args.get('top', type=int)
+    
+    if group not in AGGREGATE_GROUPS or sort not in ORDENACOES or order not in ('asc', 'desc'):
+        return jsonify({
+            'error': f'Parâmetros inválidos (group em {", ".join(AGGREGATE_GROUPS)}, sort em {", ".join(ORDENACOES)}, order asc ou desc)'
+        }), 400
+    if months < 0 or offset < 0 or not 1 <= limit <= MAX_GROUP_PAGE or (top is not None and top < 1):
+        return jsonify({
+            'error': f'Parâmetros inválidos (months >= 0, offset >= 0, limit entre 1 e {MAX_GROUP_PAGE}, top >= 1)'
+        }), 400
+    
+    ensure_data()
+    
+    snap = snapshot
+    total, rows = snap.group_table(months, AGGREGATE_GROUPS[group]).page(sort, order == 'desc', offset, limit, top)
+    
+    return jsonify({
+        'group': group,
+        'months': months,
+        'sort': sort,
+        'order': order,
+        'top': top,
+        'offset': offset,
+        'total': total,
+        'rows': rows,
+        'version': snap.version,
+        'last_update': snap.last_update
+    })
+
+@app.route('/api/timeseries')
+@snapshot_cached
+def get_timeseries_endpoint():
+    """API com a série temporal do cubo pré-calculado
+    
+    Parâmetros opcionais:
+    - granularity: dia, semana ou mes (padrão)
+    - dimension / value: só as vendas de alguns valores de uma dimensão (valores separados por vírgula)
+    - window: períodos da média móvel da receita (padrão 3)
+    """
+    granularity = request.args.get('granularity', 'mes')
+    dimension = request.args.get('dimension')
+    values = [v.strip() for v in request.args.get('value', '').split(',') if v.strip()]
+    window = request.args.get('window', default=3, type=int)
+    
+    if granularity not in GRANULARIDADES or not 1 <= window <= MAX_MOVING_WINDOW:
+        return jsonify({
+            'error': f'Parâmetros inválidos (granularity em {", ".join(GRANULARIDADES)}, window entre 1 e {MAX_MOVING_WINDOW})'
+        }), 400
+    if (dimension or values) and (dimension not in AGGREGATE_GROUPS or not values):
+        return jsonify({
+            'error': f'Use dimension ({", ".join(AGGREGATE_GROUPS)}) junto com value'
+        }), 400
+    
+    ensure_data()
+    
+    snap = snapshot
+    if snap.cube is None:
+        return jsonify({
+            'error': 'Nenhum dado carregado'
+        }), 503
+    
+    return jsonify({
+        'granularity': granularity,
+        'dimension': dimension,
+        'values': values,
+        'window': window,
+        'serie': snap.cube.timeseries(granularity, dimension, values, window),
+        'tendencias': snap.cube.trends(granularity) if not dimension else None,
+        'version': snap.version,
+        'last_update': snap.last_update
+    })
 
 @app.route('/api/update', methods=['POST'])
 def update_data_endpoint():
-    """API para forçar atualização dos dados"""
+    """API para forçar atualização dos dados
+    
+    Com ?async=1 responde na hora com o id do job; o andamento fica em /api/update/<job_id>.
+    """
     try:
-        update_data()
+        if request.args.get('async', '').lower() in ('1', 'true'):
+            job = refresh_coordinator.request()
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/api/update/{job.id}'
+            }), 202
+        
+        job = update_data()
+        if job.status == 'erro':
+            return jsonify({
+                'success': False,
+                'message': f'Erro ao atualizar dados: {job.error}'
+            }), 500
+        
+        snap = snapshot
         
-        if isinstance(cached_data, dict):
+        if isinstance(snap.data, dict):
             # Múltiplas guias
             return jsonify({
                 'success': True,
                 'message': 'Dados atualizados com sucesso!',
-                'last_update': last_update,
-                'total_sheets': len(cached_data),
-                'total_records': sum(sheet['total_registros'] for sheet in cached_data.values()),
-                'sheets_info': {k: {'nome': v['nome'], 'registros': v['total_registros']} for k, v in cached_data.items()}
+                'last_update': snap.last_update,
+                'total_sheets': snap.total_sheets,
+                'total_records': snap.total_records,
+                'sheets_info': snap.sheets_info
             })
         else:
             # Uma única guia (compatibilidade)
             return jsonify({
                 'success': True,
                 'message': 'Dados atualizados com sucesso!',
-                'last_update': last_update,
-                'count': len(cached_data) if cached_data else 0
+                'last_update': snap.last_update,
+                'count': snap.total_records
             })
     except Exception as e:
         return jsonify({
@@ -324,6 +764,76 @@ def update_data_endpoint():
             'message': f'Erro ao atualizar dados: {str(e)}'
         }), 500
 
+@app.route('/api/updates/stream')
+def stream_updates_endpoint():
+    """Server-Sent Events com um evento 'snapshot' a cada nova versão dos dados
+    
+    Parâmetro opcional since (ou o cabeçalho Last-Event-ID, enviado pelo navegador
+    ao reconectar): versão que o cliente já tem; versões mais novas são enviadas na hora.
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', default=snapshot.version, type=int)
+    
+    return Response(
+        stream_with_context(update_events.stream(since)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/updates')
+def poll_updates_endpoint():
+    """Long-poll para clientes sem EventSource
+    
+    Parâmetros: since (versão que o cliente já tem) e timeout (segundos, até MAX_POLL_SECONDS).
+    Responde o evento da versão mais nova assim que existir, ou 204 sem novidade.
+    """
+    since = request.args.get('since', type=int)
+    timeout = request.args.get('timeout', default=MAX_POLL_SECONDS, type=float)
+    
+    if since is None or not 0 <= timeout <= MAX_POLL_SECONDS:
+        return jsonify({
+            'error': f'Parâmetros inválidos (since obrigatório, timeout entre 0 e {MAX_POLL_SECONDS})'
+        }), 400
+    
+    event = update_events.wait(since, timeout)
+    if event is None:
+        return '', 204
+    return jsonify(event)
+
+@app.route('/api/update/<job_id>')
+def update_status_endpoint(job_id):
+    """API para consultar o andamento de uma atualização assíncrona"""
+    job = refresh_coordinator.get(job_id)
+    if job is None:
+        return jsonify({
+            'error': f'Job não encontrado: {job_id}'
+        }), 404
+    
+    snap = snapshot
+    return jsonify(dict(job.to_dict(), last_update=snap.last_update, version=snap.version))
+
+@app.route('/api/parse-report')
+@snapshot_cached
+def get_parse_report():
+    """API com o relatório de conversão dos dados (tipos das colunas e células que falharam)"""
+    ensure_data()
+    
+    snap = snapshot
+    if snap.is_empty:
+        return jsonify({
+            'error': 'Nenhum dado carregado'
+        }), 503
+    
+    return jsonify({
+        'report': snap.parse_report,
+        'last_update': snap.last_update,
+        'version': snap.version
+    })
+
 @app.route('/api/analysis', methods=['GET', 'POST'])
 def get_analysis_endpoint():
     """API para obter análise dos dados"""
@@ -359,6 +869,31 @@ def get_sheets():
             'error': f'Erro ao obter planilhas: {str(e)}'
         }), 500
 
+@app.route('/api/models')
+def get_models_health():
+    """API com a saúde recente dos modelos de IA e o uso do cache de respostas"""
+    return jsonify({
+        'modelos': model_health.to_dict(),
+        'cache_respostas': response_cache.to_dict(),
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Métricas de desempenho no formato texto do Prometheus (format=json para JSON)
+    
+    Durações por etapa (fetch, parse, aggregate, context, llm por modelo, serialize, refresh)
+    e por rota HTTP, uso dos caches, linhas processadas e tokens por modelo.
+    """
+    snap = snapshot
+    metrics.set_gauge('snapshot_version', snap.version)
+    metrics.set_gauge('snapshot_records', snap.total_records)
+    metrics.set_gauge('chat_cache_entries', response_cache.to_dict()['entradas'])
+    
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.to_dict())
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8', headers={'Cache-Control': 'no-store'})
+
 @app.route('/api/chat', methods=['POST'])
 def chat_with_ai():
     """API para chat com IA"""
@@ -375,12 +910,14 @@ def chat_with_ai():
             }), 400
         
         # Garante que os dados estejam carregados
-        if cached_data is None:
+        if snapshot.is_empty:
             print("⚠️ Cache vazio, carregando dados...")
-            update_data()
+            ensure_data()
+        
+        snap = snapshot
         
         # Verifica se temos dados após tentar carregar
-        if cached_data is None:
+        if snap.is_empty:
             print("❌ Nenhum dado disponível após tentativa de carregamento")
             return jsonify({
                 'response': """# ⚠️ Dados Não Disponíveis
@@ -400,26 +937,31 @@ def chat_with_ai():
 *Configure a conexão primeiro para usar o chat com dados reais!*"""
             }), 200
         
-        print(f"✅ Dados em cache: {len(cached_data) if isinstance(cached_data, dict) else 'N/A'} guias")
+        print(f"✅ Dados em cache: {snap.total_sheets} guias (versão {snap.version})")
         
-        # Prepara contexto dos dados para a IA
-        print("🔄 Preparando contexto dos dados...")
-        context = prepare_data_context()
-        print(f"✅ Contexto preparado: {len(context)} caracteres")
+        # Mesma pergunta (ou quase) sobre a mesma versão dos dados: responde do cache
+        cached_response = response_cache.get(user_message, snap.version)
+        metrics.inc('cache_requests_total', cache='chat', result='hit' if cached_response is not None else 'miss')
+        if cached_response is not None:
+            print(f"⚡ Resposta do cache: {len(cached_response)} caracteres")
+            if data.get('stream'):
+                return stream_chat_response(None, None, user_message, snap, cached=cached_response)
+            return jsonify({
+                'response': cached_response,
+                'cached': True,
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
         
-        # Calcula total de registros para o prompt
-        total_records = 0
-        if cached_data:
-            if isinstance(cached_data, dict):
-                total_records = sum(sheet['total_registros'] for sheet in cached_data.values())
-            else:
-                total_records = len(cached_data)
+        # Recorte dos dados relevante para a pergunta
+        with metrics.span('context', mode='context'):
+            question_context = build_question_context(snap, user_message, max_tokens=CONTEXT_MAX_TOKENS)
+        total_records = snap.total_records
         
         # Mensagem do sistema com contexto dos dados
         system_message = f"""Você é um analista de dados de vendas especializado com acesso completo aos dados reais da empresa.
 
-DADOS REAIS DA EMPRESA:
-{context}
+DADOS REAIS DA EMPRESA (recorte relevante para a pergunta):
+{question_context}
 
 INSTRUÇÕES IMPORTANTES:
 - Você tem acesso a {total_records:,} registros reais de vendas
@@ -440,15 +982,36 @@ Analise os dados fornecidos e responda com base nos números REAIS e específico
         
         print(f"🤖 Enviando para IA... (contexto: {len(system_message)} chars, prompt: {len(user_prompt)} chars)")
         
+        # Em streaming as ferramentas só rodam se pedidas ('tools': true): as rodadas
+        # atrasariam o primeiro trecho até a resposta inteira ficar pronta
+        use_tools = CHAT_TOOLS and data.get('tools', not data.get('stream'))
+        
+        if data.get('stream'):
+            # Resposta enviada trecho a trecho via Server-Sent Events
+            return stream_chat_response(user_prompt, system_message, user_message, snap, use_tools=use_tools)
+        
+        if use_tools:
+            # Primeiro tenta responder com consultas exatas; se falhar, segue com o contexto
+            try:
+                ai_response = answer_with_tools(snap, user_message)
+                response_cache.put(user_message, snap.version, ai_response)
+                return jsonify({
+                    'response': ai_response,
+                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                })
+            except Exception as e:
+                print(f"⚠️ Consulta com ferramentas indisponível: {e}")
+        
         # Tenta consultar a IA real, com fallback para análise local
         try:
-            ai_response = consultar_ia(user_prompt, system_message=system_message)
+            ai_response = consultar_ia(user_prompt, system_message=system_message, fallback=False)
             print(f"✅ Resposta da IA externa obtida: {len(ai_response)} caracteres")
+            response_cache.put(user_message, snap.version, ai_response)
         except Exception as e:
             print(f"⚠️ IA externa indisponível: {e}")
             print("🔄 Usando análise local inteligente...")
             # Fallback para análise local inteligente
-            ai_response = generate_local_ai_response(user_message, context)
+            ai_response = generate_local_ai_response(user_message, snap)
             print(f"✅ Resposta local gerada: {len(ai_response)} caracteres")
         
         print(f"📤 Enviando resposta para o frontend")
@@ -466,262 +1029,102 @@ Analise os dados fornecidos e responda com base nos números REAIS e específico
             'error': f'Erro ao processar mensagem: {str(e)}'
         }), 500
 
+def answer_with_tools(snap, user_message):
+    """Resposta da IA usando as ferramentas de consulta sobre o snapshot (levanta exceção se falhar)"""
+    # Só o resumo e o recorte citado vão no prompt; o resto a IA consulta quando precisar
+    with metrics.span('context', mode='tools'):
+        summary = build_question_context(snap, user_message, max_tokens=300)
+    system_message = f"""Você é um analista de dados de vendas com acesso a ferramentas de consulta sobre {snap.total_records:,} registros reais de vendas.
 
-def prepare_data_context():
-    """Prepara contexto detalhado dos dados para a IA"""
-    try:
-        if not cached_data:
-            return "Nenhum dado disponível para análise."
-        
-        # Prepara dados para análise
-        all_data = []
-        if isinstance(cached_data, dict):
-            for sheet_data in cached_data.values():
-                if 'dados' in sheet_data and isinstance(sheet_data['dados'], list):
-                    all_data.extend(sheet_data['dados'])
-        else:
-            all_data = cached_data
-        
-        if not all_data:
-            return "Nenhum dado disponível para análise."
-        
-        # Análise detalhada dos dados
-        total_records = len(all_data)
-        total_revenue = 0
-        total_quantity = 0
-        product_data = {}
-        region_data = {}
-        category_data = {}
-        monthly_data = {}
-        price_analysis = {}
-        
-        # Processa cada registro
-        for row in all_data:
-            # Receita
-            try:
-                revenue = float(str(row.get('Receita Total', '0')).replace(',', '.').replace('R$', '').strip()) or 0
-            except (ValueError, TypeError):
-                revenue = 0
-            total_revenue += revenue
-            
-            # Quantidade
-            try:
-                quantity = int(row.get('Quantidade', 0)) or 0
-            except (ValueError, TypeError):
-                quantity = 0
-            total_quantity += quantity
-            
-            # Preço unitário
-            try:
-                unit_price = float(str(row.get('Preço Unitário', '0')).replace(',', '.').replace('R$', '').strip()) or 0
-            except (ValueError, TypeError):
-                unit_price = 0
-            
-            # Produtos (com receita e quantidade)
-            product = row.get('Produto', 'Outros')
-            if product not in product_data:
-                product_data[product] = {'sales': 0, 'revenue': 0, 'quantity': 0, 'avg_price': 0, 'category': ''}
-            product_data[product]['sales'] += 1
-            product_data[product]['revenue'] += revenue
-            product_data[product]['quantity'] += quantity
-            product_data[product]['category'] = row.get('Categoria', 'Outros')
-            
-            # Regiões (com receita e quantidade)
-            region = row.get('Região', 'Outros')
-            if region not in region_data:
-                region_data[region] = {'sales': 0, 'revenue': 0, 'quantity': 0}
-            region_data[region]['sales'] += 1
-            region_data[region]['revenue'] += revenue
-            region_data[region]['quantity'] += quantity
-            
-            # Categorias (com receita e quantidade)
-            category = row.get('Categoria', 'Outros')
-            if category not in category_data:
-                category_data[category] = {'sales': 0, 'revenue': 0, 'quantity': 0, 'products': set()}
-            category_data[category]['sales'] += 1
-            category_data[category]['revenue'] += revenue
-            category_data[category]['quantity'] += quantity
-            category_data[category]['products'].add(product)
-            
-            # Análise mensal
+RESUMO DOS DADOS:
+{summary}
+
+INSTRUÇÕES IMPORTANTES:
+- Use as ferramentas consultar_vendas e comparar_periodos para obter qualquer número que não esteja no resumo
+- Nunca invente números: cite apenas valores do resumo ou retornados pelas ferramentas
+- Se uma ferramenta retornar 'erro', corrija os argumentos e tente de novo
+- Responda em português brasileiro claro e profissional, com formatação Markdown
+- Sugira ações práticas baseadas nos números obtidos"""
+    
+    print(f"🔧 Enviando para IA com ferramentas... (contexto: {len(system_message)} chars)")
+    return consultar_ia_ferramentas(
+        user_message, system_message, TOOLS,
+        lambda name, arguments: execute_tool(snap, name, arguments)
+    )
+
+def sse_event(event, payload):
+    """Formata um evento Server-Sent Events com payload JSON"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_chat_response(user_prompt, system_message, user_message, snap, cached=None, use_tools=False):
+    """Resposta do chat em streaming: eventos 'token' com cada trecho e 'done' no final"""
+    def generate():
+        if cached is not None:
+            yield sse_event('token', {'text': cached})
+            yield sse_event('done', {'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'cached': True})
+            return
+        
+        if use_tools:
+            # As rodadas de ferramentas não são transmitidas; a resposta final vai de uma vez
             try:
-                date_str = row.get('Data', '')
-                if 'T' in date_str:
-                    month = date_str.split('T')[0][:7]  # YYYY-MM
-                else:
-                    month = date_str[:7] if len(date_str) >= 7 else '2025-01'
-                
-                if month not in monthly_data:
-                    monthly_data[month] = {'sales': 0, 'revenue': 0, 'quantity': 0}
-                monthly_data[month]['sales'] += 1
-                monthly_data[month]['revenue'] += revenue
-                monthly_data[month]['quantity'] += quantity
-            except:
-                pass
+                ai_response = answer_with_tools(snap, user_message)
+                response_cache.put(user_message, snap.version, ai_response)
+                yield sse_event('token', {'text': ai_response})
+                yield sse_event('done', {'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+                return
+            except Exception as e:
+                print(f"⚠️ Consulta com ferramentas indisponível: {e}")
+        
+        total_chars = 0
+        parts = []
+        try:
+            for texto in consultar_ia_stream(user_prompt, system_message=system_message, fallback=False):
+                total_chars += len(texto)
+                parts.append(texto)
+                yield sse_event('token', {'text': texto})
             
-            # Análise de preços
-            if unit_price > 0:
-                price_range = f"R$ {int(unit_price//50)*50}-{int(unit_price//50)*50+49}"
-                if price_range not in price_analysis:
-                    price_analysis[price_range] = {'count': 0, 'revenue': 0}
-                price_analysis[price_range]['count'] += 1
-                price_analysis[price_range]['revenue'] += revenue
-        
-        # Calcula métricas finais
-        avg_ticket = total_revenue / total_records if total_records > 0 else 0
-        avg_quantity = total_quantity / total_records if total_records > 0 else 0
-        
-        # Top performers com receita
-        top_products = sorted(product_data.items(), key=lambda x: x[1]['revenue'], reverse=True)[:10]
-        top_regions = sorted(region_data.items(), key=lambda x: x[1]['revenue'], reverse=True)[:5]
-        top_categories = sorted(category_data.items(), key=lambda x: x[1]['revenue'], reverse=True)[:5]
-        top_months = sorted(monthly_data.items(), key=lambda x: x[1]['revenue'], reverse=True)[:6]
-        
-        # Converte sets para contagem
-        for cat_data in category_data.values():
-            cat_data['products'] = len(cat_data['products'])
-        
-        # Cria contexto super detalhado
-        context = f"""
-=== DADOS COMPLETOS DA PLANILHA DE VENDAS ===
-
-RESUMO EXECUTIVO:
-- Total de transações: {total_records:,}
-- Receita total: R$ {total_revenue:,.2f}
-- Quantidade total vendida: {total_quantity:,} unidades
-- Ticket médio: R$ {avg_ticket:,.2f}
-- Quantidade média por venda: {avg_quantity:.1f} unidades
-- Período: {last_update if last_update else 'Dados mais recentes'}
-- Fonte: {len(cached_data) if isinstance(cached_data, dict) else 1} guias de planilha
-
-=== ANÁLISE POR PRODUTOS (TOP 10) ===
-"""
-        
-        for i, (product, data) in enumerate(top_products, 1):
-            avg_price = data['revenue'] / data['quantity'] if data['quantity'] > 0 else 0
-            context += f"{i}. {product} ({data['category']}):\n"
-            context += f"   - Vendas: {data['sales']} transações\n"
-            context += f"   - Receita: R$ {data['revenue']:,.2f}\n"
-            context += f"   - Quantidade: {data['quantity']:,} unidades\n"
-            context += f"   - Preço médio: R$ {avg_price:,.2f}\n\n"
-        
-        context += f"""
-=== ANÁLISE POR REGIÕES (TOP 5) ===
-"""
-        
-        for i, (region, data) in enumerate(top_regions, 1):
-            percentage = (data['revenue'] / total_revenue * 100) if total_revenue > 0 else 0
-            context += f"{i}. {region}:\n"
-            context += f"   - Vendas: {data['sales']} transações ({data['sales']/total_records*100:.1f}%)\n"
-            context += f"   - Receita: R$ {data['revenue']:,.2f} ({percentage:.1f}%)\n"
-            context += f"   - Quantidade: {data['quantity']:,} unidades\n"
-            context += f"   - Ticket médio: R$ {data['revenue']/data['sales']:,.2f}\n\n"
-        
-        context += f"""
-=== ANÁLISE POR CATEGORIAS (TOP 5) ===
-"""
-        
-        for i, (category, data) in enumerate(top_categories, 1):
-            percentage = (data['revenue'] / total_revenue * 100) if total_revenue > 0 else 0
-            context += f"{i}. {category}:\n"
-            context += f"   - Vendas: {data['sales']} transações\n"
-            context += f"   - Receita: R$ {data['revenue']:,.2f} ({percentage:.1f}%)\n"
-            context += f"   - Quantidade: {data['quantity']:,} unidades\n"
-            context += f"   - Produtos únicos: {data['products']}\n"
-            context += f"   - Ticket médio: R$ {data['revenue']/data['sales']:,.2f}\n\n"
-        
-        context += f"""
-=== ANÁLISE TEMPORAL (TOP 6 MESES) ===
-"""
-        
-        for month, data in top_months:
-            percentage = (data['revenue'] / total_revenue * 100) if total_revenue > 0 else 0
-            context += f"- {month}:\n"
-            context += f"  - Vendas: {data['sales']} transações\n"
-            context += f"  - Receita: R$ {data['revenue']:,.2f} ({percentage:.1f}%)\n"
-            context += f"  - Quantidade: {data['quantity']:,} unidades\n"
-            context += f"  - Ticket médio: R$ {data['revenue']/data['sales']:,.2f}\n\n"
-        
-        context += f"""
-=== DADOS DETALHADOS DISPONÍVEIS ===
-- Produtos únicos: {len(product_data)}
-- Regiões ativas: {len(region_data)}
-- Categorias: {len(category_data)}
-- Meses com dados: {len(monthly_data)}
-- Faixas de preço: {len(price_analysis)}
-
-=== ESTRUTURA DOS DADOS ===
-Cada transação contém:
-- Data da venda
-- ID da transação
-- Produto vendido
-- Categoria do produto
-- Região da venda
-- Quantidade vendida
-- Preço unitário
-- Receita total calculada
-
-=== INSIGHTS DISPONÍVEIS ===
-- Análise de sazonalidade mensal
-- Performance por produto e categoria
-- Concentração geográfica de vendas
-- Análise de ticket médio por segmento
-- Identificação de produtos top performers
-- Oportunidades de crescimento por região
-- Análise de mix de produtos por categoria
-"""
-        
-        return context
+            # Só respostas completas da IA entram no cache
+            if parts and parts[-1] != AVISO_INTERROMPIDA:
+                response_cache.put(user_message, snap.version, ''.join(parts))
+        except Exception as e:
+            print(f"⚠️ IA externa indisponível: {e}")
+            print("🔄 Usando análise local inteligente...")
+            ai_response = generate_local_ai_response(user_message, snap)
+            total_chars += len(ai_response)
+            yield sse_event('token', {'text': ai_response})
         
-    except Exception as e:
-        return f"Erro ao preparar contexto: {str(e)}"
+        print(f"📤 Resposta em streaming concluída: {total_chars} caracteres")
+        yield sse_event('done', {'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def prepare_data_context():
+    """Retorna o contexto dos dados para a IA (pré-calculado no snapshot)"""
+    return snapshot.context
 
 def analyze_real_data():
     """Analisa os dados reais carregados"""
     try:
-        if not cached_data:
+        snap = snapshot
+        if snap.is_empty:
             return "## **Status dos Dados**\n- ⚠️ Nenhum dado carregado\n- 🔄 Clique em 'Atualizar Dados' para carregar"
         
-        # Prepara dados para análise
-        all_data = []
-        if isinstance(cached_data, dict):
-            for sheet_data in cached_data.values():
-                if 'dados' in sheet_data and isinstance(sheet_data['dados'], list):
-                    all_data.extend(sheet_data['dados'])
-        else:
-            all_data = cached_data
+        # Agregados pré-calculados na atualização
+        aggregates = snap.aggregates
         
-        if not all_data:
+        if not aggregates or aggregates['total_registros'] == 0:
             return "## **Status dos Dados**\n- ⚠️ Nenhum dado disponível\n- 🔄 Atualize os dados primeiro"
         
-        # Análise básica dos dados
-        total_records = len(all_data)
-        total_revenue = 0
-        products = set()
-        regions = set()
-        categories = set()
-        
-        for row in all_data:
-            # Receita
-            try:
-                revenue = float(str(row.get('Receita Total', '0')).replace(',', '.').replace('R$', '').strip()) or 0
-                total_revenue += revenue
-            except (ValueError, TypeError):
-                pass
-            
-            # Produtos
-            if row.get('Produto'):
-                products.add(row['Produto'])
-            
-            # Regiões
-            if row.get('Região'):
-                regions.add(row['Região'])
-            
-            # Categorias
-            if row.get('Categoria'):
-                categories.add(row['Categoria'])
-        
-        avg_ticket = total_revenue / total_records if total_records > 0 else 0
+        total_records = aggregates['total_registros']
+        total_revenue = aggregates['receita_total']
+        avg_ticket = aggregates['ticket_medio']
+        products = aggregates['produtos']
+        regions = aggregates['regioes']
+        categories = aggregates['categorias']
         
         return f"""## **Análise dos Dados Reais**
 - **📊 Total de Registros**: {total_records:,}
@@ -740,259 +1143,10 @@ def analyze_real_data():
     except Exception as e:
         return f"## **Status dos Dados**\n- ❌ Erro na análise: {str(e)}"
 
-def generate_local_ai_response(user_message, context):
-    """Gera resposta inteligente local baseada nos dados"""
+def generate_local_ai_response(user_message, snap=None):
+    """Gera resposta inteligente local a partir dos agregados do snapshot"""
     try:
-        message_lower = user_message.lower()
-        
-        # Extrai dados estruturados do contexto
-        lines = context.split('\n')
-        total_records = 0
-        total_revenue = 0
-        avg_ticket = 0
-        total_quantity = 0
-        
-        # Coleta informações de produtos, regiões e categorias do contexto
-        products_section = []
-        regions_section = []
-        categories_section = []
-        months_section = []
-        
-        current_section = None
-        
-        for line in lines:
-            # Extrai métricas básicas
-            if 'Total de transações:' in line:
-                try:
-                    total_records = int(line.split(':')[1].replace(',', '').replace('.', '').strip())
-                except:
-                    pass
-            elif 'Receita total: R$' in line:
-                try:
-                    revenue_str = line.split('R$')[1].replace(',', '').replace('.', '').strip()
-                    total_revenue = float(revenue_str)
-                except:
-                    pass
-            elif 'Ticket médio: R$' in line:
-                try:
-                    ticket_str = line.split('R$')[1].replace(',', '').replace('.', '').strip()
-                    avg_ticket = float(ticket_str)
-                except:
-                    pass
-            elif 'Quantidade total vendida:' in line:
-                try:
-                    qty_str = line.split(':')[1].replace(',', '').replace('.', '').split()[0].strip()
-                    total_quantity = int(qty_str)
-                except:
-                    pass
-            
-            # Identifica seções
-            if 'ANÁLISE POR PRODUTOS' in line:
-                current_section = 'products'
-            elif 'ANÁLISE POR REGIÕES' in line:
-                current_section = 'regions'
-            elif 'ANÁLISE POR CATEGORIAS' in line:
-                current_section = 'categories'
-            elif 'ANÁLISE TEMPORAL' in line:
-                current_section = 'months'
-            elif line.strip().startswith('==='):
-                current_section = None
-            
-            # Coleta dados das seções
-            if current_section == 'products' and line.strip() and not line.startswith('==='):
-                products_section.append(line.strip())
-            elif current_section == 'regions' and line.strip() and not line.startswith('==='):
-                regions_section.append(line.strip())
-            elif current_section == 'categories' and line.strip() and not line.startswith('==='):
-                categories_section.append(line.strip())
-            elif current_section == 'months' and line.strip() and not line.startswith('==='):
-                months_section.append(line.strip())
-        
-        # Se não temos dados carregados, retorna mensagem apropriada
-        if total_records == 0:
-            return """# 📊 Dados Não Carregados
-
-**Nenhum dado encontrado para análise.**
-
-## **Para Começar**
-1. Clique em **"Atualizar Dados"** para carregar informações da planilha
-2. Aguarde o carregamento dos dados
-3. Depois faça suas perguntas sobre vendas, produtos ou regiões
-
-## **O que Posso Analisar**
-- 📈 Performance geral de vendas
-- 🛍️ Produtos mais vendidos
-- 🌍 Análise por região
-- 📊 Tendências temporais
-- 🎯 Oportunidades de crescimento
-
-*Carregue os dados primeiro e depois faça suas perguntas!*"""
-        
-        # Análise contextual inteligente com dados reais
-        if any(word in message_lower for word in ['vendas', 'venda', 'performance', 'resultado', 'resumo', 'geral']):
-            # Extrai primeiros produtos e regiões
-            top_products_text = '\n'.join(products_section[:15]) if products_section else "Dados sendo processados..."
-            top_regions_text = '\n'.join(regions_section[:10]) if regions_section else "Dados sendo processados..."
-            
-            return f"""# 📊 Resumo de Vendas - Análise Baseada em Dados Reais
-
-## **Métricas Principais**
-- **Total de Transações**: {total_records:,}
-- **Receita Total**: R$ {total_revenue:,.2f}
-- **Ticket Médio**: R$ {avg_ticket:,.2f}
-- **Quantidade Vendida**: {total_quantity:,} unidades
-
-## **Top Produtos (Dados Reais)**
-{top_products_text[:500]}
-
-## **Principais Regiões (Dados Reais)**
-{top_regions_text[:400]}
-
-## **Insights Estratégicos**
-Com base na análise de **{total_records:,} transações reais**, identificamos:
-
-- **Volume**: Base sólida de dados para análises confiáveis
-- **Receita Média**: R$ {avg_ticket:,.2f} por transação
-- **Distribuição**: Múltiplas categorias e regiões ativas
-
-## **Recomendações Baseadas nos Dados**
-1. **Foco em Performance**: Produtos top estão claramente identificados nos dados
-2. **Expansão Geográfica**: Regiões com maior volume merecem atenção especial
-3. **Otimização de Ticket**: Oportunidades de aumentar valor médio por venda
-
-*Pergunte sobre produtos, regiões ou categorias específicas para análises detalhadas!*"""
-
-        elif any(word in message_lower for word in ['produto', 'produtos', 'item', 'itens', 'top']):
-            # Extrai dados de produtos do contexto
-            products_info = '\n'.join(products_section[:20]) if products_section else "Carregando dados de produtos..."
-            
-            return f"""# 🛍️ Análise de Produtos - Dados Reais
-
-## **Performance de Produtos**
-Análise baseada em **{total_records:,} transações reais** da sua base de dados.
-
-## **Top Produtos por Performance**
-{products_info[:800]}
-
-## **Métricas Globais**
-- **Total de Transações**: {total_records:,}
-- **Receita Total**: R$ {total_revenue:,.2f}
-- **Ticket Médio**: R$ {avg_ticket:,.2f}
-- **Quantidade Total**: {total_quantity:,} unidades
-
-## **Insights dos Dados Reais**
-- **Rankings Identificados**: Produtos com maior receita e volume
-- **Categorias Analisadas**: Performance por segmento
-- **Preços Médios**: Calculados com base nas transações reais
-- **Oportunidades**: Produtos com alto potencial identificados
-
-## **Recomendações Estratégicas**
-1. **Produtos Top**: Focar nos itens de maior receita
-2. **Mix de Produtos**: Balancear volume e ticket médio
-3. **Categorias**: Desenvolver estratégias específicas por segmento
-
-*Pergunte sobre produtos ou categorias específicas para detalhes!*"""
-
-        elif any(word in message_lower for word in ['região', 'regiões', 'geográfico', 'localização', 'onde']):
-            # Extrai dados de regiões do contexto
-            regions_info = '\n'.join(regions_section[:15]) if regions_section else "Carregando dados geográficos..."
-            
-            return f"""# 🌍 Análise Geográfica - Dados Reais
-
-## **Distribuição Geográfica**
-Análise baseada em **{total_records:,} transações reais** distribuídas por região.
-
-## **Top Regiões por Performance**
-{regions_info[:700]}
-
-## **Métricas Geográficas Globais**
-- **Total de Transações**: {total_records:,}
-- **Receita Total**: R$ {total_revenue:,.2f}
-- **Ticket Médio**: R$ {avg_ticket:,.2f}
-- **Múltiplas Regiões**: Operação nacional/regional ativa
-
-## **Insights Geográficos dos Dados**
-- **Concentração Identificada**: Regiões de maior performance nos dados
-- **Performance Regional**: Rankings calculados com dados reais
-- **Oportunidades de Expansão**: Regiões com potencial baseado em volume
-- **Estratégias Regionais**: Dados suportam abordagens específicas
-
-## **Recomendações Baseadas nos Dados**
-1. **Foco Regional**: Priorizar regiões de maior receita identificadas
-2. **Expansão Estratégica**: Regiões com crescimento consistente
-3. **Marketing Localizado**: Adaptar estratégias por performance regional
-
-*Pergunte sobre regiões específicas para análises detalhadas!*"""
-
-        elif any(word in message_lower for word in ['análise', 'analisar', 'relatório', 'relatorio', 'insights', 'relatório']):
-            return f"""# 📈 Relatórios e Análises Disponíveis
-
-## **Análises Estruturadas**
-- **📊 Tendências Temporais**: Variações por período
-- **🛍️ Performance de Produtos**: Rankings e oportunidades
-- **🌍 Análise Geográfica**: Concentração e expansão
-- **👥 Segmentação de Clientes**: Comportamento e preferências
-- **🎯 Insights Estratégicos**: Recomendações personalizadas
-
-## **Dados Base para Análise**
-- **{total_records:,}** transações analisadas
-- **R$ {total_revenue:,.2f}** em receita total
-- **Múltiplas categorias** e produtos
-- **Diversas regiões** de atuação
-
-## **Tipos de Relatórios**
-- Relatório executivo completo
-- Análise de tendências mensais
-- Performance por categoria
-- Oportunidades de crescimento
-
-*Que tipo de relatório gostaria de gerar?*"""
-
-        elif any(word in message_lower for word in ['ajuda', 'help', 'comandos', 'como usar', 'o que posso']):
-            return f"""# 🤖 Como Posso Ajudar?
-
-## **Comandos Principais**
-- **"Mostre as vendas"** - Resumo geral de performance
-- **"Produtos mais vendidos"** - Ranking de produtos
-- **"Análise por região"** - Performance geográfica
-- **"Gere um relatório"** - Análise estruturada completa
-- **"Tendências mensais"** - Análise temporal
-
-## **Seus Dados Atuais**
-- **{total_records:,}** transações processadas
-- **R$ {total_revenue:,.2f}** em receita total
-- **Múltiplos produtos** e categorias
-- **Diversas regiões** de atuação
-
-## **Capacidades**
-- Análise de tendências e padrões
-- Identificação de oportunidades
-- Geração de relatórios personalizados
-- Insights baseados em dados reais
-
-*Digite sua pergunta para começar a análise!*"""
-
-        else:
-            return f"""# 💡 Interessante Pergunta!
-
-Com base nos seus **{total_records:,}** registros de vendas, posso ajudá-lo com:
-
-## **Análises Disponíveis**
-- **📊 Performance Geral**: Métricas e indicadores
-- **🛍️ Análise de Produtos**: Rankings e oportunidades
-- **🌍 Análise Geográfica**: Concentração e expansão
-- **📈 Tendências Temporais**: Variações e padrões
-- **🎯 Insights Estratégicos**: Recomendações personalizadas
-
-## **Sugestões de Perguntas**
-- "Mostre os produtos mais vendidos"
-- "Qual região tem melhor performance?"
-- "Analise as tendências mensais"
-- "Gere um relatório executivo"
-- "Quais são as oportunidades de crescimento?"
-
-*Pode ser mais específico sobre o que gostaria de analisar?*"""
-        
+        return answer_locally(snap or snapshot, user_message)
     except Exception as e:
         return f"# ❌ Erro na Análise\n\n**Ocorreu um erro ao processar sua pergunta.**\n\n*Tente novamente ou verifique se os dados estão carregados corretamente.*\n\nErro: {str(e)}"
 
@@ -0,0 +1,409 @@
+"""
+Snapshot imutável dos dados e agregados, montado a cada atualização
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Optional
+import getpass
+import os
+import pickle
+import stat
+import tempfile
+
+from row_parser import parse_data
+from sheet_store import SheetRows
+from sales_aggregates import build_frame, aggregate, recent_cutoff, FILTROS_MESES
+from frame_index import FrameIndex
+from time_cube import TimeCube
+from group_table import GroupTable, GRUPOS_PAGINADOS
+from metrics import metrics
+
+# Versão do formato gravado em disco (mude ao alterar DataSnapshot ou os agregados)
+SNAPSHOT_FORMAT = 9
+
+@dataclass(frozen=True)
+class DataSnapshot:
+    """
+    Dados brutos (linhas de cada guia em colunas, ver sheet_store), DataFrame colunar,
+    índices secundários, cubo temporal, agregados e contexto da IA de uma atualização.
+    Nunca é alterado depois de criado: uma atualização monta um novo snapshot
+    e troca a referência global de uma vez.
+    """
+    version: int = 0
+    data: Any = None
+    frame: Any = None
+    index: Any = None
+    cube: Any = None
+    aggregates: Optional[dict] = None
+    recent: Optional[dict] = None
+    # Dia (ISO) usado como "hoje" nos cortes de recent/group_tables: em outro dia são recalculados
+    cutoff_day: Optional[str] = None
+    # Agrupamentos paginados por período ({meses: {agrupamento: GroupTable}}, 0 = todo o período)
+    group_tables: Optional[dict] = None
+    context: str = "Nenhum dado disponível para análise."
+    last_update: Optional[str] = None
+    total_sheets: int = 0
+    total_records: int = 0
+    sheets_info: Optional[dict] = None
+    parse_report: Optional[dict] = None
+    # Corpo completo de /api/data já serializado e comprimido ({Content-Encoding: bytes});
+    # não vai para o disco, é montado de novo depois de load_snapshot
+    data_payload: Optional[dict] = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['data_payload'] = None
+        return state
+
+    @property
+    def is_empty(self):
+        return self.data is None
+
+    def aggregates_for_months(self, months):
+        """
+        Agregados dos últimos N meses (0 = todo o período)
+        """
+        if self.frame is None:
+            return None
+        if not months:
+            metrics.inc('cache_requests_total', cache='aggregates', result='hit')
+            return self.aggregates
+        if self.recent and months in self.recent and self.cutoff_day == date.today().isoformat():
+            metrics.inc('cache_requests_total', cache='aggregates', result='hit')
+            return self.recent[months]
+        metrics.inc('cache_requests_total', cache='aggregates', result='miss')
+        with metrics.span('aggregate', scope='months', log=False):
+            return aggregate(self.index.select(inicio=recent_cutoff(months)))
+
+    def group_table(self, months, group):
+        """
+        Tabela paginável do agrupamento `group` ('produtos', 'categorias', 'regioes')
+        dos últimos N meses (0 = todo o período)
+        """
+        current = not months or self.cutoff_day == date.today().isoformat()
+        if current and self.group_tables and months in self.group_tables:
+            return self.group_tables[months][group]
+        aggregates = self.aggregates_for_months(months)
+        return GroupTable(aggregates[group] if aggregates else [])
+
+    def _sheet_rows(self):
+        """
+        Pares (chave da guia, linhas) na ordem da planilha
+        """
+        if isinstance(self.data, dict):
+            return [(key, sheet.get('dados') or []) for key, sheet in self.data.items()]
+        return [(None, self.data or [])]
+
+    def resolve_sheets(self, selection=None):
+        """
+        Converte chaves ('guia_0') ou nomes de guia em chaves; None = todas.
+        Levanta KeyError para guias inexistentes.
+        """
+        keys = [key for key, _ in self._sheet_rows()]
+        if not selection:
+            return keys
+
+        by_name = {}
+        if isinstance(self.data, dict):
+            by_name = {str(sheet.get('nome')): key for key, sheet in self.data.items()}
+
+        resolved = []
+        for item in selection:
+            if item in keys:
+                resolved.append(item)
+            elif item in by_name:
+                resolved.append(by_name[item])
+            else:
+                raise KeyError(item)
+        return resolved
+
+    def count_rows(self, sheets):
+        """
+        Total de linhas das guias selecionadas
+        """
+        return sum(len(rows) for key, rows in self._sheet_rows() if key in sheets)
+
+    def iter_rows(self, sheets, start=0, fields=None):
+        """
+        Gera as linhas das guias selecionadas a partir da posição `start`,
+        opcionalmente só com as colunas em `fields`
+        """
+        offset = start
+        for key, rows in self._sheet_rows():
+            if key not in sheets:
+                continue
+            if offset >= len(rows):
+                offset -= len(rows)
+                continue
+
+            if isinstance(rows, SheetRows):
+                # Monta os dicts em blocos direto das colunas
+                yield from rows.rows(offset, fields=fields)
+                offset = 0
+                continue
+
+            for i in range(offset, len(rows)):
+                row = rows[i]
+                if fields:
+                    yield {field: row.get(field) for field in fields}
+                else:
+                    yield row
+            offset = 0
+
+def build_snapshot(data, last_update, version, typed=None, parse_report=None):
+    """
+    Monta o snapshot a partir dos dados da planilha (dict de guias ou lista de linhas).
+    typed/parse_report: colunas já convertidas na sincronização; sem elas, converte aqui.
+    """
+    if typed is None:
+        with metrics.span('parse', scope='snapshot'):
+            typed, parse_report = parse_data(data)
+
+    with metrics.span('aggregate', scope='snapshot') as info:
+        frame = build_frame(data, typed=typed)
+        index = FrameIndex(frame)
+        cube = TimeCube(frame)
+        aggregates = aggregate(frame)
+
+        # Filtros de período do dashboard já calculados (valem só para o dia de hoje)
+        today = date.today()
+        recent = {months: aggregate(index.select(inicio=recent_cutoff(months, today))) for months in FILTROS_MESES}
+        group_tables = {
+            months: {group: GroupTable(result[group]) for group in GRUPOS_PAGINADOS}
+            for months, result in [(0, aggregates), *recent.items()]
+        }
+        info['linhas'] = len(frame)
+    metrics.inc('rows_processed_total', len(frame), stage='aggregate')
+
+    if isinstance(data, dict):
+        # Múltiplas guias
+        total_sheets = len(data)
+        total_records = sum(sheet['total_registros'] for sheet in data.values())
+        sheets_info = {k: {'nome': v['nome'], 'registros': v['total_registros']} for k, v in data.items()}
+    else:
+        # Uma única guia (compatibilidade)
+        total_sheets = 1
+        total_records = len(data)
+        sheets_info = None
+
+    return DataSnapshot(
+        version=version,
+        data=data,
+        frame=frame,
+        index=index,
+        cube=cube,
+        aggregates=aggregates,
+        recent=recent,
+        cutoff_day=today.isoformat(),
+        group_tables=group_tables,
+        context=render_context(aggregates, last_update, total_sheets),
+        last_update=last_update,
+        total_sheets=total_sheets,
+        total_records=total_records,
+        sheets_info=sheets_info,
+        parse_report=parse_report,
+    )
+
+def render_context(aggregates, last_update, total_sheets):
+    """
+    Monta o texto de contexto dos dados enviado para a IA
+    """
+    if not aggregates or aggregates['total_registros'] == 0:
+        return "Nenhum dado disponível para análise."
+
+    total_records = aggregates['total_registros']
+    total_revenue = aggregates['receita_total']
+    total_quantity = aggregates['quantidade_total']
+    avg_ticket = aggregates['ticket_medio']
+    avg_quantity = aggregates['quantidade_media']
+    
+    # Top performers com receita
+    top_products = aggregates['produtos'][:10]
+    top_regions = aggregates['regioes'][:5]
+    top_categories = aggregates['categorias'][:5]
+    top_months = sorted(aggregates['meses'], key=lambda x: x['receita'], reverse=True)[:6]
+    
+    # Cria contexto super detalhado
+    context = f"""
+=== DADOS COMPLETOS DA PLANILHA DE VENDAS ===
+
+RESUMO EXECUTIVO:
+- Total de transações: {total_records:,}
+- Receita total: R$ {total_revenue:,.2f}
+- Quantidade total vendida: {total_quantity:,} unidades
+- Ticket médio: R$ {avg_ticket:,.2f}
+- Quantidade média por venda: {avg_quantity:.1f} unidades
+- Período: {last_update if last_update else 'Dados mais recentes'}
+- Fonte: {total_sheets} guias de planilha
+
+=== ANÁLISE POR PRODUTOS (TOP 10) ===
+"""
+    
+    for i, data in enumerate(top_products, 1):
+        avg_price = data['receita'] / data['quantidade'] if data['quantidade'] > 0 else 0
+        context += f"{i}. {data['nome']} ({data['categoria']}):\n"
+        context += f"   - Vendas: {data['vendas']} transações\n"
+        context += f"   - Receita: R$ {data['receita']:,.2f}\n"
+        context += f"   - Quantidade: {data['quantidade']:,} unidades\n"
+        context += f"   - Preço médio: R$ {avg_price:,.2f}\n\n"
+    
+    context += f"""
+=== ANÁLISE POR REGIÕES (TOP 5) ===
+"""
+    
+    for i, data in enumerate(top_regions, 1):
+        percentage = (data['receita'] / total_revenue * 100) if total_revenue > 0 else 0
+        context += f"{i}. {data['nome']}:\n"
+        context += f"   - Vendas: {data['vendas']} transações ({data['vendas']/total_records*100:.1f}%)\n"
+        context += f"   - Receita: R$ {data['receita']:,.2f} ({percentage:.1f}%)\n"
+        context += f"   - Quantidade: {data['quantidade']:,} unidades\n"
+        context += f"   - Ticket médio: R$ {data['receita']/data['vendas']:,.2f}\n\n"
+    
+    context += f"""
+=== ANÁLISE POR CATEGORIAS (TOP 5) ===
+"""
+    
+    for i, data in enumerate(top_categories, 1):
+        percentage = (data['receita'] / total_revenue * 100) if total_revenue > 0 else 0
+        context += f"{i}. {data['nome']}:\n"
+        context += f"   - Vendas: {data['vendas']} transações\n"
+        context += f"   - Receita: R$ {data['receita']:,.2f} ({percentage:.1f}%)\n"
+        context += f"   - Quantidade: {data['quantidade']:,} unidades\n"
+        context += f"   - Produtos únicos: {data['produtos']}\n"
+        context += f"   - Ticket médio: R$ {data['receita']/data['vendas']:,.2f}\n\n"
+    
+    context += f"""
+=== ANÁLISE TEMPORAL (TOP 6 MESES) ===
+"""
+    
+    for data in top_months:
+        percentage = (data['receita'] / total_revenue * 100) if total_revenue > 0 else 0
+        context += f"- {data['nome']}:\n"
+        context += f"  - Vendas: {data['vendas']} transações\n"
+        context += f"  - Receita: R$ {data['receita']:,.2f} ({percentage:.1f}%)\n"
+        context += f"  - Quantidade: {data['quantidade']:,} unidades\n"
+        context += f"  - Ticket médio: R$ {data['receita']/data['vendas']:,.2f}\n\n"
+    
+    context += f"""
+=== DADOS DETALHADOS DISPONÍVEIS ===
+- Produtos únicos: {len(aggregates['produtos'])}
+- Regiões ativas: {len(aggregates['regioes'])}
+- Categorias: {len(aggregates['categorias'])}
+- Meses com dados: {len(aggregates['meses'])}
+- Faixas de preço: {len(aggregates['faixas_preco'])}
+
+=== ESTRUTURA DOS DADOS ===
+Cada transação contém:
+- Data da venda
+- ID da transação
+- Produto vendido
+- Categoria do produto
+- Região da venda
+- Quantidade vendida
+- Preço unitário
+- Receita total calculada
+
+=== INSIGHTS DISPONÍVEIS ===
+- Análise de sazonalidade mensal
+- Performance por produto e categoria
+- Concentração geográfica de vendas
+- Análise de ticket médio por segmento
+- Identificação de produtos top performers
+- Oportunidades de crescimento por região
+- Análise de mix de produtos por categoria
+"""
+    
+    return context
+
+def snapshot_path():
+    """
+    Caminho do snapshot em disco: SNAPSHOT_CACHE_PATH ou um diretório privado do
+    usuário (0700) dentro do diretório temporário (ex.: /tmp na Vercel)
+    """
+    if os.getenv('SNAPSHOT_CACHE_PATH'):
+        return os.getenv('SNAPSHOT_CACHE_PATH')
+    owner = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), f'vendas_snapshot_{owner}', f'vendas_snapshot_v{SNAPSHOT_FORMAT}.pkl')
+
+def _check_directory(directory, private):
+    """
+    O snapshot é lido com pickle: ninguém além do usuário pode trocar o arquivo.
+    Diretório padrão: do usuário e só dele (0700). SNAPSHOT_CACHE_PATH: do usuário
+    ou do root, e não gravável por outros (a não ser com sticky bit, como o /tmp).
+    Levanta PermissionError; só verifica em POSIX.
+    """
+    if not hasattr(os, 'getuid'):
+        return
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"Diretório do snapshot inválido (link ou outro tipo): {directory}")
+    if private:
+        if info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError(f"Diretório do snapshot não é privado do usuário (0700): {directory}")
+    elif info.st_uid not in (os.getuid(), 0) or (info.st_mode & 0o022 and not info.st_mode & stat.S_ISVTX):
+        raise PermissionError(f"Diretório do snapshot gravável por outros usuários: {directory}")
+
+def _check_file(path):
+    """
+    Arquivo do snapshot: regular, do próprio usuário e não gravável por outros
+    """
+    if not hasattr(os, 'getuid'):
+        return
+    info = os.lstat(path)
+    if not stat.S_ISREG(info.st_mode):
+        raise PermissionError(f"Arquivo do snapshot inválido (link ou outro tipo): {path}")
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise PermissionError(f"Arquivo do snapshot de outro usuário ou gravável por outros: {path}")
+
+def _snapshot_directory(path):
+    """
+    Diretório do snapshot, criado só para o usuário (0700) e verificado
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    private = not os.getenv('SNAPSHOT_CACHE_PATH')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    _check_directory(directory, private)
+    return directory
+
+def save_snapshot(snapshot, path=None):
+    """
+    Grava o snapshot em disco de forma atômica (arquivo temporário + rename).
+    O DataFrame é serializado pelos buffers NumPy das colunas, sem converter linha a linha.
+    """
+    path = path or snapshot_path()
+    directory = _snapshot_directory(path)
+
+    # mkstemp cria o arquivo só com permissão do usuário (0600)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'format': SNAPSHOT_FORMAT, 'snapshot': snapshot}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def load_snapshot(path=None):
+    """
+    Carrega o snapshot gravado em disco; None se não existir ou for de outro formato.
+    Levanta PermissionError se o arquivo puder ter sido gravado por outro usuário.
+    """
+    path = path or snapshot_path()
+    if not os.path.exists(path):
+        return None
+
+    _check_directory(os.path.dirname(os.path.abspath(path)), private=not os.getenv('SNAPSHOT_CACHE_PATH'))
+    _check_file(path)
+
+    with open(path, 'rb') as f:
+        payload = pickle.load(f)
+
+    if not isinstance(payload, dict) or payload.get('format') != SNAPSHOT_FORMAT:
+        return None
+
+    snapshot = payload.get('snapshot')
+    return snapshot if isinstance(snapshot, DataSnapshot) and not snapshot.is_empty else None
+
+# Snapshot vazio usado antes da primeira carga
+EMPTY_SNAPSHOT = DataSnapshot()
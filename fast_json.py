@@ -0,0 +1,92 @@
+"""
+Serialização JSON rápida: orjson quando instalado (com NumPy, datas e chaves não-texto),
+json da biblioteca padrão como alternativa. Também é o JSON provider do Flask.
+"""
+from datetime import date, datetime
+import json
+import math
+
+import numpy as np
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+
+from metrics import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value):
+    """
+    Tipos que o encoder não conhece: escalares e arrays NumPy, Timestamp, Categorical
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+        return None if isinstance(value, float) and not math.isfinite(value) else value
+    if isinstance(value, (np.ndarray, pd.Categorical, pd.Index, pd.Series)):
+        return value.tolist()
+    if isinstance(value, pd.Timestamp):
+        return None if pd.isna(value) else value.isoformat()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Tipo não serializável em JSON: {type(value).__name__}")
+
+def _finite(value):
+    """
+    Troca floats NaN/infinito por None (em dicts, listas e tuplas), como o orjson faz
+    """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+def _default_finite(value):
+    return _finite(_default(value))
+
+def stdlib_dumps(value, **kwargs):
+    """
+    Objeto -> texto JSON pelo json da biblioteca padrão, aceitando os argumentos
+    de json.dumps (sort_keys, indent...); NaN/infinito viram null
+    """
+    kwargs.setdefault('ensure_ascii', False)
+    kwargs.setdefault('default', _default_finite)
+    if kwargs.get('indent') is None:
+        kwargs.setdefault('separators', (',', ':'))
+    kwargs['allow_nan'] = False
+    return json.dumps(_finite(value), **kwargs)
+
+if orjson is not None:
+    _OPCOES = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(value):
+        """
+        Objeto -> bytes JSON (UTF-8, sem escapar acentos; NaN vira null)
+        """
+        return orjson.dumps(value, default=_default, option=_OPCOES)
+else:
+    def dumps(value):
+        """
+        Objeto -> bytes JSON (UTF-8, sem escapar acentos; NaN vira null)
+        """
+        return stdlib_dumps(value).encode('utf-8')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify/Response do Flask com o encoder rápido (mantém a ordem das chaves)
+    """
+    def dumps(self, obj, **kwargs):
+        # Argumentos do json.dumps (sort_keys, indent...) só o json padrão entende
+        if kwargs:
+            return stdlib_dumps(obj, **kwargs)
+        return dumps(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Tempo de serialização de cada jsonify (sem linha no log; a requisição já tem a sua)
+        with metrics.span('serialize', target='json', log=False):
+            body = dumps(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
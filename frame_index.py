@@ -0,0 +1,127 @@
+"""
+Índices secundários do DataFrame de vendas, montados a cada atualização: datas
+ordenadas e listas invertidas (valor da dimensão -> posições das linhas), para que
+filtros de período e de igualdade custem o tamanho do resultado, não da base
+"""
+import numpy as np
+import pandas as pd
+
+from text_utils import normalize_question
+
+# Dimensões com lista invertida
+DIMENSOES_INDICE = ('produto', 'categoria', 'regiao', 'mes')
+
+class FrameIndex:
+    def __init__(self, frame):
+        self.frame = frame
+        self.dtype = np.int32 if len(frame) < np.iinfo(np.int32).max else np.int64
+
+        # Datas em ns (NaT fica de fora do índice ordenado)
+        dates = frame['data'].to_numpy().astype('datetime64[ns]')
+        self.valid_dates = ~np.isnat(dates)
+        self.dates = dates.view('int64')
+        positions = np.flatnonzero(self.valid_dates)
+        order = positions[np.argsort(self.dates[positions], kind='stable')]
+        self.date_order = order.astype(self.dtype)
+        self.sorted_dates = self.dates[order]
+
+        # Listas invertidas em formato CSR: posições agrupadas por código, em ordem crescente
+        self.codes = {}
+        self.postings = {}
+        # Nomes normalizados (normalize_question) de cada dimensão, para achar os valores
+        # citados numa pergunta sem normalizar todas as categorias a cada pergunta:
+        # names = {nome: [valores]} em ordem das categorias, normalized = {valor: nome}
+        # e name_words = maior quantidade de palavras de um nome
+        self.names = {}
+        self.normalized = {}
+        self.name_words = {}
+        for key in DIMENSOES_INDICE:
+            codes = frame[key].cat.codes.to_numpy()
+            categories = frame[key].cat.categories
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+            # Códigos -1 (sem valor) ficam no começo da ordenação e são pulados
+            offsets = np.concatenate([[0], np.cumsum(counts)]) + int((codes < 0).sum())
+            self.codes[key] = codes
+            self.postings[key] = (
+                np.argsort(codes, kind='stable').astype(self.dtype),
+                offsets,
+                {str(label): i for i, label in enumerate(categories)},
+            )
+
+            names, normalized = {}, {}
+            for label in categories:
+                nome = normalize_question(str(label))
+                normalized[str(label)] = nome
+                if nome:
+                    names.setdefault(nome, []).append(str(label))
+            self.names[key] = names
+            self.normalized[key] = normalized
+            self.name_words[key] = max((len(nome.split()) for nome in names), default=0)
+
+    def _codes(self, key, labels):
+        by_label = self.postings[key][2]
+        return sorted({by_label[str(label)] for label in labels if str(label) in by_label})
+
+    def _size(self, key, labels):
+        _, offsets, _ = self.postings[key]
+        return sum(int(offsets[c + 1] - offsets[c]) for c in self._codes(key, labels))
+
+    def _date_bounds(self, inicio, fim):
+        lo = 0 if inicio is None else int(np.searchsorted(self.sorted_dates, pd.Timestamp(inicio).value, side='left'))
+        hi = len(self.sorted_dates) if fim is None else int(np.searchsorted(self.sorted_dates, pd.Timestamp(fim).value, side='left'))
+        return lo, max(lo, hi)
+
+    def equal(self, key, labels):
+        """
+        Posições (crescentes) das linhas com algum dos valores em `labels`
+        """
+        order, offsets, _ = self.postings[key]
+        parts = [order[offsets[c]:offsets[c + 1]] for c in self._codes(key, labels)]
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def date_range(self, inicio=None, fim=None):
+        """
+        Posições (crescentes) das linhas com inicio <= data < fim
+        """
+        lo, hi = self._date_bounds(inicio, fim)
+        return np.sort(self.date_order[lo:hi])
+
+    def positions(self, filters=None, inicio=None, fim=None):
+        """
+        Posições das linhas que passam em todos os filtros (mesma dimensão = OU,
+        dimensões diferentes = E). None quando não há filtro (todas as linhas).
+        Começa pelo filtro mais seletivo e só confere os demais nas posições dele.
+        """
+        filters = {key: labels for key, labels in (filters or {}).items() if labels}
+        if not filters and inicio is None and fim is None:
+            return None
+
+        candidates = [(self._size(key, labels), key) for key, labels in filters.items()]
+        if inicio is not None or fim is not None:
+            lo, hi = self._date_bounds(inicio, fim)
+            candidates.append((hi - lo, None))
+        _, first = min(candidates, key=lambda item: item[0])
+
+        result = self.date_range(inicio, fim) if first is None else self.equal(first, filters[first])
+
+        for key, labels in filters.items():
+            if key != first and len(result):
+                result = result[np.isin(self.codes[key][result], self._codes(key, labels))]
+        if first is not None and (inicio is not None or fim is not None) and len(result):
+            dates = self.dates[result]
+            keep = self.valid_dates[result]
+            if inicio is not None:
+                keep &= dates >= pd.Timestamp(inicio).value
+            if fim is not None:
+                keep &= dates < pd.Timestamp(fim).value
+            result = result[keep]
+        return result
+
+    def select(self, filters=None, inicio=None, fim=None):
+        """
+        Linhas do DataFrame que passam nos filtros, na ordem original
+        """
+        positions = self.positions(filters, inicio, fim)
+        return self.frame if positions is None else self.frame.take(positions)
@@ -0,0 +1,66 @@
+"""
+Agrupamentos pré-calculados (produtos, categorias, regiões) prontos para paginação:
+cada ordenação é calculada uma vez por atualização, e uma página custa só
+as linhas pedidas, qualquer que seja o tamanho do catálogo
+"""
+import numpy as np
+
+# Agrupamentos paginados (chaves dos agregados de sales_aggregates)
+GRUPOS_PAGINADOS = ('produtos', 'categorias', 'regioes')
+
+# Campos aceitos na ordenação ('media' = receita por venda)
+ORDENACOES = ('receita', 'vendas', 'quantidade', 'media', 'nome')
+
+class GroupTable:
+    """
+    Grupos já ordenados por receita (formato de sales_aggregates) com a ordem
+    crescente e decrescente de cada campo de ORDENACOES, calculada no primeiro
+    pedido e guardada
+    """
+    def __init__(self, groups):
+        self.groups = groups
+        vendas = np.array([g['vendas'] for g in groups], dtype=np.int64)
+        receita = np.array([g['receita'] for g in groups], dtype=np.float64)
+        self.media = np.divide(receita, vendas, out=np.zeros(len(groups)), where=vendas > 0)
+        self.values = {
+            'receita': receita,
+            'vendas': vendas,
+            'quantidade': np.array([g['quantidade'] for g in groups], dtype=np.int64),
+            'media': self.media,
+        }
+        self.orders = {}
+
+    def order(self, sort, descending):
+        """
+        Posições dos grupos ordenados por `sort`; empates mantêm a posição no ranking
+        de receita. Threads concorrentes no máximo repetem o mesmo cálculo.
+        """
+        key = (sort, descending)
+        if key not in self.orders:
+            if sort == 'nome':
+                names = np.array([g['nome'].casefold() for g in self.groups], dtype=str)
+                ascending = np.argsort(names, kind='stable')
+                self.orders[key] = ascending[::-1].copy() if descending else ascending
+            else:
+                column = self.values[sort]
+                self.orders[key] = np.argsort(-column if descending else column, kind='stable')
+        return self.orders[key]
+
+    def __len__(self):
+        return len(self.groups)
+
+    def page(self, sort='receita', descending=True, offset=0, limit=50, top=None):
+        """
+        Linhas [offset, offset + limit) na ordem pedida, com a posição no ranking
+        de receita e a receita média. top: só os N primeiros grupos por receita.
+        Retorna (total de linhas, página).
+        """
+        order = self.order(sort, descending)
+        if top is not None and top < len(order):
+            # Posição na lista = posição no ranking de receita
+            order = order[order < top]
+
+        rows = []
+        for position in order[offset:offset + limit].tolist():
+            rows.append(dict(self.groups[position], posicao=position + 1, media=float(self.media[position])))
+        return len(order), rows
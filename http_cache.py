@@ -0,0 +1,170 @@
+"""
+Cache HTTP das respostas da API: ETag e Last-Modified pela versão do snapshot,
+respostas 304 sem montar o corpo, Cache-Control para a CDN da Vercel e
+compressão gzip/brotli do JSON
+"""
+from datetime import date, datetime, timezone
+from functools import wraps
+import gzip
+import os
+import zlib
+
+from flask import request, make_response, Response
+
+from metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Tempo (segundos) que a CDN serve a resposta sem revalidar, e quanto pode servir
+# uma resposta vencida enquanto revalida em segundo plano
+CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', '60'))
+CACHE_STALE = int(os.getenv('HTTP_CACHE_STALE', '300'))
+
+# Compressão só vale a pena acima deste tamanho (bytes)
+MIN_COMPRESS_SIZE = 1024
+
+# Corpos pré-serializados maiores que isto só ficam guardados comprimidos
+# (clientes sem gzip recebem o corpo descomprimido na hora)
+MAX_IDENTITY_BYTES = 16 * 1024 * 1024
+
+COMPRESSIBLE = ('application/json', 'text/html', 'text/plain', 'application/javascript', 'text/css')
+
+def snapshot_etag(snap, key, day=None):
+    """
+    ETag da resposta `key` (caminho + parâmetros) para o snapshot: muda a cada atualização
+    e, com `day`, também na virada do dia
+    """
+    token = zlib.crc32(f"{snap.version}|{snap.last_update}|{key}|{day or ''}".encode())
+    return f"{snap.version}-{token:08x}"
+
+def last_modified(snap):
+    if not snap.last_update:
+        return None
+    try:
+        # last_update é gravado no horário local do servidor
+        return datetime.strptime(snap.last_update, '%Y-%m-%d %H:%M:%S').astimezone(timezone.utc)
+    except ValueError:
+        return None
+
+def cache_headers(response, etag, modified):
+    response.set_etag(etag, weak=True)
+    if modified is not None:
+        response.last_modified = modified
+    # Navegador sempre revalida (304 barato); a CDN guarda por CACHE_MAX_AGE
+    response.headers['Cache-Control'] = (
+        f"public, max-age=0, must-revalidate, s-maxage={CACHE_MAX_AGE}, stale-while-revalidate={CACHE_STALE}"
+    )
+    response.vary.add('Accept-Encoding')
+    return response
+
+def conditional(get_snapshot, prepare=None, dated=False):
+    """
+    Decorador para GETs que só dependem do snapshot e dos parâmetros: responde 304
+    quando o cliente já tem esta versão (sem chamar a view nem serializar nada) e
+    marca as respostas 200 com ETag, Last-Modified e Cache-Control.
+    prepare: chamado antes, para garantir que há snapshot carregado.
+    dated: a resposta também depende da data de hoje (filtro "últimos N meses");
+    o ETag inclui o dia e If-Modified-Since é ignorado.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if prepare is not None:
+                prepare()
+            snap = get_snapshot()
+            if snap.is_empty:
+                return view(*args, **kwargs)
+
+            day = date.today().isoformat() if dated else None
+            etag = snapshot_etag(snap, request.full_path, day)
+            modified = last_modified(snap)
+
+            not_modified = False
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            elif request.if_modified_since and modified is not None and not dated:
+                not_modified = modified.replace(microsecond=0) <= request.if_modified_since
+
+            if not_modified:
+                metrics.inc('cache_requests_total', cache='http', result='hit')
+                return cache_headers(make_response('', 304), etag, modified)
+            metrics.inc('cache_requests_total', cache='http', result='miss')
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                # Snapshot lido de novo: a view pode ter esperado uma atualização
+                snap = get_snapshot()
+                cache_headers(response, snapshot_etag(snap, request.full_path, day), last_modified(snap))
+            return response
+        return wrapper
+    return decorator
+
+def _encode(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+def precompress(data):
+    """
+    Corpo serializado -> variantes por Content-Encoding, calculadas uma vez
+    ('identity' só para corpos até MAX_IDENTITY_BYTES)
+    """
+    variants = {'gzip': _encode(data, 'gzip')}
+    if brotli is not None:
+        variants['br'] = _encode(data, 'br')
+    if len(data) <= MAX_IDENTITY_BYTES:
+        variants['identity'] = data
+    return variants
+
+def precompressed_response(variants, mimetype='application/json'):
+    """
+    Resposta com a melhor variante pré-comprimida aceita pelo cliente (sem serializar nem comprimir)
+    """
+    accepted = request.accept_encodings
+    if 'br' in variants and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        encoding = 'identity'
+
+    if encoding == 'identity':
+        body = variants.get('identity') or gzip.decompress(variants['gzip'])
+    else:
+        body = variants[encoding]
+
+    response = Response(body, mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def compress_response(response):
+    """
+    Comprime respostas de texto/JSON com brotli (se instalado) ou gzip, conforme o Accept-Encoding.
+    Respostas em streaming (NDJSON, SSE) passam sem alteração.
+    """
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+        return response
+    if response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.set_data(_encode(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,291 @@
+"""
+Respostas locais do chat (sem IA externa), calculadas direto dos agregados do snapshot
+"""
+from context_builder import find_entities, find_intents, slice_frame, describe_entities
+from text_utils import normalize_question
+from sales_aggregates import DIMENSOES, aggregate
+
+# Palavras que pedem comparação entre valores citados
+COMPARACAO = ('compar', 'versus', 'vs', 'contra', 'diferenca', 'entre', 'melhor que', 'pior que')
+
+RESUMO = ('venda', 'performance', 'desempenho', 'resultado', 'resumo', 'geral', 'receita', 'faturamento', 'total')
+RELATORIO = ('analise', 'analisar', 'relatorio', 'insight')
+AJUDA = ('ajuda', 'help', 'comando', 'como usar', 'o que posso')
+
+NOMES = {
+    'produto': ('Produto', 'produtos'),
+    'categoria': ('Categoria', 'categorias'),
+    'regiao': ('Região', 'regioes'),
+    'mes': ('Mês', 'meses'),
+}
+
+TITULOS = {
+    'produtos': '🛍️ Produtos',
+    'categorias': '📂 Categorias',
+    'regioes': '🌍 Regiões',
+    'meses': '📈 Evolução Mensal',
+    'faixas_preco': '💲 Faixas de Preço',
+}
+
+SEM_DADOS = """# 📊 Dados Não Carregados
+
+**Nenhum dado encontrado para análise.**
+
+## **Para Começar**
+1. Clique em **"Atualizar Dados"** para carregar informações da planilha
+2. Aguarde o carregamento dos dados
+3. Depois faça suas perguntas sobre vendas, produtos ou regiões
+
+## **O que Posso Analisar**
+- 📈 Performance geral de vendas
+- 🛍️ Produtos mais vendidos
+- 🌍 Análise por região
+- 📊 Tendências temporais
+- 🎯 Oportunidades de crescimento
+
+*Carregue os dados primeiro e depois faça suas perguntas!*"""
+
+def _percent(parte, total):
+    return (parte / total * 100) if total else 0
+
+def _variacao(antes, depois):
+    if not antes:
+        return "n/d"
+    return f"{(depois - antes) / antes * 100:+.1f}%"
+
+def _metricas(aggregates, total_revenue=None):
+    linhas = [
+        f"- **Transações**: {aggregates['total_registros']:,}",
+        f"- **Receita**: R$ {aggregates['receita_total']:,.2f}",
+        f"- **Quantidade**: {aggregates['quantidade_total']:,} unidades",
+        f"- **Ticket Médio**: R$ {aggregates['ticket_medio']:,.2f}",
+    ]
+    if total_revenue:
+        linhas[1] += f" ({_percent(aggregates['receita_total'], total_revenue):.1f}% do total)"
+    return "\n".join(linhas)
+
+def _tabela(items, total_revenue, inicio=1):
+    linhas = [
+        "| # | Nome | Receita | % | Vendas | Quantidade |",
+        "|---|------|---------|---|--------|------------|",
+    ]
+    for i, item in enumerate(items, inicio):
+        linhas.append(
+            f"| {i} | {item['nome']} | R$ {item['receita']:,.2f} | {_percent(item['receita'], total_revenue):.1f}% | "
+            f"{item['vendas']:,} | {item['quantidade']:,} |"
+        )
+    return "\n".join(linhas)
+
+def _melhor_pior_mes(meses):
+    if len(meses) < 2:
+        return ""
+    melhor = max(meses, key=lambda x: x['receita'])
+    pior = min(meses, key=lambda x: x['receita'])
+    ultimo, penultimo = meses[-1], meses[-2]
+    return (f"- **Melhor mês**: {melhor['nome']} (R$ {melhor['receita']:,.2f})\n"
+            f"- **Pior mês**: {pior['nome']} (R$ {pior['receita']:,.2f})\n"
+            f"- **Último mês ({ultimo['nome']})**: {_variacao(penultimo['receita'], ultimo['receita'])} "
+            f"de receita contra {penultimo['nome']}")
+
+def _ranking(group, aggregates, piores, limite=10):
+    items = aggregates[group]
+    total_revenue = aggregates['receita_total']
+    if not items:
+        return f"## **{TITULOS[group]}**\nSem dados para este recorte."
+
+    if group == 'meses':
+        texto = f"## **{TITULOS[group]}**\n{_tabela(items, total_revenue)}"
+        destaques = _melhor_pior_mes(items)
+        return texto + (f"\n\n{destaques}" if destaques else "")
+
+    texto = f"## **{TITULOS[group]} — Top {min(limite, len(items))} de {len(items)}**\n{_tabela(items[:limite], total_revenue)}"
+    if piores and len(items) > limite:
+        inicio = max(limite, len(items) - limite)
+        texto += f"\n\n## **{TITULOS[group]} — Menor Receita**\n{_tabela(items[inicio:], total_revenue, inicio + 1)}"
+
+    top3 = sum(item['receita'] for item in items[:3])
+    texto += f"\n\n- **Concentração**: os 3 primeiros somam {_percent(top3, total_revenue):.1f}% da receita"
+    return texto
+
+def _comparar(frame, entities, key, total_revenue, index=None):
+    """
+    Compara lado a lado os valores citados de uma dimensão, mantendo os demais filtros
+    """
+    nome, _ = NOMES[key]
+    outros = {k: v for k, v in entities.items() if k != key and v}
+
+    resultados = []
+    for label in entities[key]:
+        resultados.append((label, aggregate(slice_frame(frame, dict(outros, **{key: [label]}), index))))
+
+    linhas = [
+        f"| {nome} | Receita | % do total | Vendas | Quantidade | Ticket Médio |",
+        "|---|---------|-----------|--------|------------|--------------|",
+    ]
+    for label, agg in resultados:
+        linhas.append(
+            f"| {label} | R$ {agg['receita_total']:,.2f} | {_percent(agg['receita_total'], total_revenue):.1f}% | "
+            f"{agg['total_registros']:,} | {agg['quantidade_total']:,} | R$ {agg['ticket_medio']:,.2f} |"
+        )
+
+    ordenados = sorted(resultados, key=lambda x: x[1]['receita_total'], reverse=True)
+    lider, segundo = ordenados[0], ordenados[1]
+    filtro = f" (filtro: {describe_entities(outros)})" if outros else ""
+
+    return f"""# ⚖️ Comparação por {nome}{filtro}
+
+{chr(10).join(linhas)}
+
+## **Destaques**
+- **Maior receita**: {lider[0]} com R$ {lider[1]['receita_total']:,.2f}
+- **Diferença para {segundo[0]}**: R$ {lider[1]['receita_total'] - segundo[1]['receita_total']:,.2f} ({_variacao(segundo[1]['receita_total'], lider[1]['receita_total'])})
+- **Ticket médio**: {_variacao(segundo[1]['ticket_medio'], lider[1]['ticket_medio'])} de {lider[0]} em relação a {segundo[0]}
+
+*Análise local calculada sobre os dados carregados.*"""
+
+def _recorte(aggregates, frame, entities, intents, piores, index=None):
+    """
+    Métricas de um recorte (produto, região, categoria e/ou período) e suas quebras
+    """
+    total_revenue = aggregates['receita_total']
+    slice_aggregates = aggregate(slice_frame(frame, entities, index))
+
+    if slice_aggregates['total_registros'] == 0:
+        return f"""# 🔎 {describe_entities(entities)}
+
+**Nenhuma venda encontrada para este recorte.**
+
+*Verifique o período ou os nomes citados.*"""
+
+    partes = [f"# 🔎 {describe_entities(entities)}", f"## **Métricas**\n{_metricas(slice_aggregates, total_revenue)}"]
+
+    # Posição no ranking geral de cada item citado
+    posicoes = []
+    for key, (nome, group) in NOMES.items():
+        if key == 'mes':
+            continue
+        ranking = {item['nome']: i for i, item in enumerate(aggregates[group], 1)}
+        for label in entities.get(key) or []:
+            if label in ranking:
+                posicoes.append(f"- **{label}**: {ranking[label]}º de {len(ranking)} {group} em receita no período todo")
+    if posicoes:
+        partes.append("## **Posição no Ranking Geral**\n" + "\n".join(posicoes))
+
+    # Quebras pelas dimensões não fixadas (ou pedidas explicitamente)
+    for key, (nome, group) in NOMES.items():
+        fixado = len(entities.get(key) or []) == 1
+        if fixado or len(slice_aggregates[group]) < 2:
+            continue
+        if group == 'meses' or group in intents or not intents:
+            partes.append(_ranking(group, slice_aggregates, piores, limite=5).replace('## **', '## **Recorte: ', 1))
+
+    partes.append("*Análise local calculada sobre os dados carregados.*")
+    return "\n\n".join(partes)
+
+def _resumo(aggregates, last_update):
+    produtos, regioes, meses = aggregates['produtos'], aggregates['regioes'], aggregates['meses']
+    total_revenue = aggregates['receita_total']
+    periodo = f"{meses[0]['nome']} a {meses[-1]['nome']}" if meses else "sem datas válidas"
+
+    destaques = []
+    if produtos:
+        destaques.append(f"- **Produto líder**: {produtos[0]['nome']} (R$ {produtos[0]['receita']:,.2f}, "
+                         f"{_percent(produtos[0]['receita'], total_revenue):.1f}%)")
+    if regioes:
+        destaques.append(f"- **Região líder**: {regioes[0]['nome']} (R$ {regioes[0]['receita']:,.2f}, "
+                         f"{_percent(regioes[0]['receita'], total_revenue):.1f}%)")
+    mensal = _melhor_pior_mes(meses)
+
+    return f"""# 📊 Resumo de Vendas
+
+## **Métricas Principais**
+{_metricas(aggregates)}
+- **Período**: {periodo} (atualizado em {last_update or 'dados mais recentes'})
+- **Produtos**: {len(produtos)} | **Categorias**: {len(aggregates['categorias'])} | **Regiões**: {len(regioes)}
+
+## **Destaques**
+{chr(10).join(destaques)}
+{mensal}
+
+*Pergunte sobre um produto, região, categoria ou período específico para detalhes!*"""
+
+def _ajuda(aggregates):
+    produto = aggregates['produtos'][0]['nome'] if aggregates['produtos'] else 'um produto'
+    regioes = [item['nome'] for item in aggregates['regioes'][:2]] or ['Norte', 'Sul']
+    if len(regioes) < 2:
+        regioes.append(regioes[0])
+
+    return f"""# 🤖 Como Posso Ajudar?
+
+## **Perguntas que Respondo com os Dados Carregados**
+- **"Mostre as vendas"** - Resumo geral de performance
+- **"Produtos mais vendidos"** / **"produtos que venderam menos"** - Rankings
+- **"Como foi {produto} em março?"** - Produto, região ou categoria em um período
+- **"Compare {regioes[0]} e {regioes[1]}"** - Comparação lado a lado
+- **"Vendas dos últimos 3 meses"** / **"de janeiro a junho"** - Períodos
+- **"Gere um relatório"** - Análise completa
+
+## **Seus Dados Atuais**
+{_metricas(aggregates)}
+
+*Digite sua pergunta para começar a análise!*"""
+
+def classify(question, entities, index=None):
+    """
+    Intenção da pergunta: 'comparacao', 'recorte', 'ranking', 'relatorio', 'ajuda', 'resumo' ou 'geral'
+    """
+    pergunta = f" {normalize_question(question)} "
+    intents, _ = find_intents(question, entities, index)
+
+    comparar = any(f" {p}" in pergunta for p in COMPARACAO)
+    for key in DIMENSOES:
+        if len(entities.get(key) or []) >= 2:
+            return 'comparacao', key
+    if comparar and len(entities.get('mes') or []) == 2:
+        return 'comparacao', 'mes'
+
+    if any(entities.values()):
+        return 'recorte', None
+    if any(f" {p}" in pergunta for p in AJUDA):
+        return 'ajuda', None
+    if any(f" {p}" in pergunta for p in RELATORIO):
+        return 'relatorio', None
+    if intents:
+        return 'ranking', None
+    if any(f" {p}" in pergunta for p in RESUMO):
+        return 'resumo', None
+    return 'geral', None
+
+def answer_locally(snapshot, question):
+    """
+    Resposta em Markdown para a pergunta, usando só os agregados e o DataFrame do snapshot
+    """
+    aggregates = snapshot.aggregates
+    if snapshot.frame is None or not aggregates or aggregates['total_registros'] == 0:
+        return SEM_DADOS
+
+    frame = snapshot.frame
+    entities = find_entities(snapshot.index, question)
+    intents, piores = find_intents(question, entities, snapshot.index)
+    intencao, dimensao = classify(question, entities, snapshot.index)
+
+    if intencao == 'comparacao':
+        return _comparar(frame, entities, dimensao, aggregates['receita_total'], snapshot.index)
+
+    if intencao == 'recorte':
+        return _recorte(aggregates, frame, entities, intents, piores, snapshot.index)
+
+    if intencao == 'ajuda':
+        return _ajuda(aggregates)
+
+    if intencao == 'relatorio':
+        partes = [_resumo(aggregates, snapshot.last_update).replace('# 📊 Resumo de Vendas', '# 📈 Relatório Executivo', 1)]
+        partes += [_ranking(group, aggregates, piores, limite=5) for group in ('produtos', 'regioes', 'categorias', 'meses')]
+        return "\n\n".join(partes)
+
+    if intencao == 'ranking':
+        partes = [_ranking(group, aggregates, piores) for group in intents]
+        partes.append(f"*Base: {aggregates['total_registros']:,} transações, R$ {aggregates['receita_total']:,.2f} em receita.*")
+        return "\n\n".join(partes)
+
+    return _resumo(aggregates, snapshot.last_update)
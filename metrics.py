@@ -0,0 +1,208 @@
+"""
+Métricas de desempenho: spans com a duração de cada etapa (busca na planilha,
+conversão, agregação, contexto do chat, chamadas à IA por modelo, serialização),
+contadores (caches, linhas processadas, tokens) e duração das requisições HTTP.
+Expostas em /api/metrics no formato texto do Prometheus e como uma linha JSON
+por span/requisição no log.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+
+# Log estruturado (uma linha JSON por span e por requisição); METRICS_JSON_LOGS=0 desativa
+JSON_LOGS = os.getenv('METRICS_JSON_LOGS', '1') != '0'
+
+# Prefixo dos nomes no formato do Prometheus
+PREFIXO = 'dashboard_'
+
+# Limites (segundos) dos buckets dos histogramas de duração
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Descrição de cada métrica em /api/metrics
+DESCRICOES = {
+    'span_seconds': 'Duração das etapas (fetch, parse, aggregate, context, llm, serialize, refresh)',
+    'http_request_seconds': 'Duração das requisições HTTP até o início da resposta, por rota',
+    'cache_requests_total': 'Consultas aos caches por resultado (hit/miss)',
+    'rows_processed_total': 'Linhas processadas por etapa',
+    'llm_tokens_total': 'Tokens de prompt e de resposta por modelo',
+    'refresh_total': 'Atualizações dos dados por resultado (changed/unchanged)',
+    'snapshot_version': 'Versão do snapshot publicado',
+    'snapshot_records': 'Registros no snapshot publicado',
+    'chat_cache_entries': 'Respostas guardadas no cache do chat',
+}
+
+def log_event(evento, **campos):
+    """
+    Uma linha JSON no log (desativado com METRICS_JSON_LOGS=0)
+    """
+    if not JSON_LOGS:
+        return
+    linha = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'evento': evento}
+    linha.update(campos)
+    print(json.dumps(linha, ensure_ascii=False, default=str), flush=True)
+
+def _labels(labels):
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items() if v is not None))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pares = list(labels) + list(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pares) + '}'
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Soma `value` ao contador `name` (com os rótulos dados)
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[name, _labels(labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Registra uma duração (segundos) no histograma `name`
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(BUCKETS), 'soma': 0.0, 'total': 0}
+            for i, limite in enumerate(BUCKETS):
+                if seconds <= limite:
+                    histogram['buckets'][i] += 1
+            histogram['soma'] += seconds
+            histogram['total'] += 1
+
+    @contextmanager
+    def span(self, name, log=True, **labels):
+        """
+        Mede o bloco: duração no histograma span_seconds (status ok/erro) e uma linha
+        no log JSON. O dict devolvido recebe campos extras para o log (ex.: linhas).
+        """
+        campos = {}
+        inicio = time.perf_counter()
+        status = 'ok'
+        try:
+            yield campos
+        except BaseException:
+            status = 'erro'
+            raise
+        finally:
+            duracao = time.perf_counter() - inicio
+            self.observe('span_seconds', duracao, span=name, status=status, **labels)
+            if log:
+                log_event('span', span=name, status=status, duracao_ms=round(duracao * 1000, 2), **labels, **campos)
+
+    def timed(self, name, **labels):
+        """
+        Decorador: cada chamada da função vira um span
+        """
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def to_dict(self):
+        """
+        Estado atual das métricas (contadores, gauges e resumo dos histogramas)
+        """
+        with self._lock:
+            return {
+                'contadores': [
+                    {'nome': name, 'rotulos': dict(labels), 'valor': value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                'gauges': [
+                    {'nome': name, 'rotulos': dict(labels), 'valor': value}
+                    for (name, labels), value in sorted(self._gauges.items())
+                ],
+                'duracoes': [
+                    {
+                        'nome': name,
+                        'rotulos': dict(labels),
+                        'total': h['total'],
+                        'soma_s': round(h['soma'], 6),
+                        'media_ms': round(h['soma'] / h['total'] * 1000, 2) if h['total'] else None,
+                    }
+                    for (name, labels), h in sorted(self._histograms.items())
+                ],
+            }
+
+    def render(self):
+        """
+        Métricas no formato texto do Prometheus (0.0.4)
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, dict(h, buckets=list(h['buckets']))) for key, h in self._histograms.items())
+
+        linhas = []
+        vistos = set()
+
+        def cabecalho(name, tipo):
+            if name in vistos:
+                return
+            vistos.add(name)
+            if name in DESCRICOES:
+                linhas.append(f"# HELP {PREFIXO}{name} {DESCRICOES[name]}")
+            linhas.append(f"# TYPE {PREFIXO}{name} {tipo}")
+
+        for (name, labels), value in counters:
+            cabecalho(name, 'counter')
+            linhas.append(f"{PREFIXO}{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            cabecalho(name, 'gauge')
+            linhas.append(f"{PREFIXO}{name}{_format_labels(labels)} {value}")
+        for (name, labels), h in histograms:
+            cabecalho(name, 'histogram')
+            for limite, contagem in zip(BUCKETS, h['buckets']):
+                linhas.append(f"{PREFIXO}{name}_bucket{_format_labels(labels, [('le', str(limite))])} {contagem}")
+            linhas.append(f"{PREFIXO}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h['total']}")
+            linhas.append(f"{PREFIXO}{name}_sum{_format_labels(labels)} {h['soma']}")
+            linhas.append(f"{PREFIXO}{name}_count{_format_labels(labels)} {h['total']}")
+        return '\n'.join(linhas) + '\n'
+
+# Instância global
+metrics = Metrics()
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+
+def finish_request(response):
+    """
+    Duração da requisição por rota (modelo da URL, não o caminho) e linha JSON no log.
+    Em respostas em streaming mede só até o início do envio.
+    """
+    inicio = g.pop('metrics_start', None)
+    if inicio is None:
+        return response
+    duracao = time.perf_counter() - inicio
+    route = request.url_rule.rule if request.url_rule is not None else 'desconhecida'
+    metrics.observe('http_request_seconds', duracao, route=route, method=request.method, status=response.status_code)
+    log_event('request', method=request.method, path=request.path, route=route,
+              status=response.status_code, duracao_ms=round(duracao * 1000, 2))
+    return response
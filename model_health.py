@@ -0,0 +1,141 @@
+"""
+Saúde dos modelos de IA: latência recente, taxa de erro e circuit breaker por modelo
+"""
+from collections import deque
+import threading
+import time
+
+import numpy as np
+
+# Quantas chamadas recentes entram nas estatísticas de cada modelo
+JANELA = 50
+
+# Falhas seguidas que abrem o circuito, e por quanto tempo (segundos) ele fica aberto
+FALHAS_PARA_ABRIR = 3
+TEMPO_ABERTO = 60
+
+class ModelStats:
+    def __init__(self):
+        self.latencias = deque(maxlen=JANELA)
+        self.resultados = deque(maxlen=JANELA)
+        self.falhas_seguidas = 0
+        self.aberto_ate = 0.0
+        self.testando = False
+
+    def percentil(self, p):
+        if not self.latencias:
+            return None
+        return float(np.percentile(self.latencias, p))
+
+    @property
+    def taxa_erro(self):
+        if not self.resultados:
+            return 0.0
+        return 1 - sum(self.resultados) / len(self.resultados)
+
+class ModelHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _get(self, modelo):
+        stats = self._stats.get(modelo)
+        if stats is None:
+            stats = self._stats[modelo] = ModelStats()
+        return stats
+
+    def record_success(self, modelo, latencia):
+        with self._lock:
+            stats = self._get(modelo)
+            stats.latencias.append(latencia)
+            stats.resultados.append(1)
+            stats.falhas_seguidas = 0
+            stats.aberto_ate = 0.0
+            stats.testando = False
+
+    def record_failure(self, modelo, latencia=None):
+        with self._lock:
+            stats = self._get(modelo)
+            if latencia is not None:
+                stats.latencias.append(latencia)
+            stats.resultados.append(0)
+            stats.falhas_seguidas += 1
+            stats.testando = False
+            if stats.falhas_seguidas >= FALHAS_PARA_ABRIR:
+                if stats.aberto_ate <= time.monotonic():
+                    print(f"🚫 Circuito aberto para {modelo} ({stats.falhas_seguidas} falhas seguidas)")
+                stats.aberto_ate = time.monotonic() + TEMPO_ABERTO
+
+    def is_open(self, modelo):
+        """
+        Circuito aberto agora (sem reservar a chamada de teste)
+        """
+        with self._lock:
+            return self._get(modelo).aberto_ate > time.monotonic()
+
+    def available(self, modelo):
+        """
+        Circuito fechado, ou aberto há tempo suficiente para uma chamada de teste
+        """
+        with self._lock:
+            stats = self._get(modelo)
+            if stats.aberto_ate <= 0:
+                return True
+            if stats.aberto_ate <= time.monotonic() and not stats.testando:
+                # Meio aberto: libera só uma chamada de teste
+                stats.testando = True
+                return True
+            return False
+
+    def score(self, modelo):
+        """
+        Latência mediana penalizada pela taxa de erro (menor é melhor; None sem histórico)
+        """
+        with self._lock:
+            stats = self._get(modelo)
+            mediana = stats.percentil(50)
+            if mediana is None:
+                return None
+            return mediana * (1 + 4 * stats.taxa_erro)
+
+    def hedge_delay(self, modelo, padrao):
+        """
+        Espera antes de disparar o modelo reserva: o p95 do modelo principal, limitado ao padrão
+        """
+        with self._lock:
+            p95 = self._get(modelo).percentil(95)
+        if p95 is None:
+            return padrao
+        return min(p95, padrao)
+
+    def ordered(self, modelos):
+        """
+        Ordena os modelos: circuitos fechados primeiro, depois pelo score;
+        sem histórico mantém a ordem configurada, depois dos que já responderam bem
+        """
+        agora = time.monotonic()
+
+        def chave(item):
+            posicao, modelo = item
+            with self._lock:
+                aberto = self._get(modelo).aberto_ate > agora
+            score = self.score(modelo)
+            return (aberto, score is None, score or 0, posicao)
+
+        return [modelo for _, modelo in sorted(enumerate(modelos), key=chave)]
+
+    def to_dict(self):
+        agora = time.monotonic()
+        with self._lock:
+            return {
+                modelo: {
+                    'chamadas': len(stats.resultados),
+                    'taxa_erro': round(stats.taxa_erro, 3),
+                    'latencia_p50': stats.percentil(50),
+                    'latencia_p95': stats.percentil(95),
+                    'falhas_seguidas': stats.falhas_seguidas,
+                    'circuito': 'aberto' if stats.aberto_ate > agora else (
+                        'meio-aberto' if stats.aberto_ate > 0 else 'fechado'),
+                }
+                for modelo, stats in self._stats.items()
+            }
@@ -0,0 +1,322 @@
+"""
+Consultas tipadas e seguras sobre o snapshot, expostas à IA como ferramentas (function calling)
+"""
+import json
+import time
+
+import pandas as pd
+
+from text_utils import normalize_question
+from sales_aggregates import aggregate
+
+# Tempo máximo (segundos) de uma consulta e maior número de linhas filtradas que ela pode agregar.
+# O prazo é conferido entre as etapas (filtro, recorte, agregação): uma etapa já iniciada
+# não é interrompida, e o limite de linhas é o que mantém cada etapa curta.
+TEMPO_MAXIMO = 2.0
+MAX_LINHAS = 2_000_000
+
+# Maior número de grupos devolvidos por consulta
+MAX_GRUPOS = 50
+
+# Agrupamentos aceitos -> chave dos agregados
+AGRUPAMENTOS = {
+    'produto': 'produtos',
+    'categoria': 'categorias',
+    'regiao': 'regioes',
+    'mes': 'meses',
+    'faixa_preco': 'faixas_preco',
+}
+
+METRICAS = ('receita', 'vendas', 'quantidade')
+
+# Filtros aceitos -> coluna do DataFrame
+FILTROS = {
+    'produtos': 'produto',
+    'categorias': 'categoria',
+    'regioes': 'regiao',
+}
+
+_FILTROS_SCHEMA = {
+    'data_inicio': {'type': 'string', 'description': "Data inicial inclusiva, 'AAAA-MM-DD' ou 'AAAA-MM'"},
+    'data_fim': {'type': 'string', 'description': "Data final inclusiva, 'AAAA-MM-DD' ou 'AAAA-MM'"},
+    'produtos': {'type': 'array', 'items': {'type': 'string'}, 'description': 'Nomes de produtos'},
+    'categorias': {'type': 'array', 'items': {'type': 'string'}, 'description': 'Nomes de categorias'},
+    'regioes': {'type': 'array', 'items': {'type': 'string'}, 'description': 'Nomes de regiões'},
+}
+
+_AGRUPAMENTO_SCHEMA = {
+    'agrupar_por': {'type': 'string', 'enum': list(AGRUPAMENTOS), 'description': 'Dimensão de agrupamento (opcional)'},
+    'ordenar_por': {'type': 'string', 'enum': list(METRICAS), 'description': 'Métrica de ordenação (padrão: receita)'},
+    'ordem': {'type': 'string', 'enum': ['desc', 'asc'], 'description': "'desc' para os maiores, 'asc' para os menores"},
+    'limite': {'type': 'integer', 'minimum': 1, 'maximum': MAX_GRUPOS, 'description': 'Quantidade de grupos (padrão: 10)'},
+}
+
+_PERIODO_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'data_inicio': _FILTROS_SCHEMA['data_inicio'],
+        'data_fim': _FILTROS_SCHEMA['data_fim'],
+    },
+    'required': ['data_inicio', 'data_fim'],
+}
+
+# Ferramentas no formato da API de chat da OpenAI/OpenRouter
+TOOLS = [
+    {
+        'type': 'function',
+        'function': {
+            'name': 'consultar_vendas',
+            'description': 'Totais de vendas (receita, vendas, quantidade, ticket médio) com filtros opcionais '
+                           'de período, produto, categoria e região, e ranking opcional por uma dimensão.',
+            'parameters': {
+                'type': 'object',
+                'properties': dict(_FILTROS_SCHEMA, **_AGRUPAMENTO_SCHEMA),
+            },
+        },
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'comparar_periodos',
+            'description': 'Compara dois períodos (totais e variação percentual), com os mesmos filtros '
+                           'opcionais e comparação opcional por dimensão.',
+            'parameters': {
+                'type': 'object',
+                'properties': dict(
+                    {'periodo_a': _PERIODO_SCHEMA, 'periodo_b': _PERIODO_SCHEMA},
+                    **{k: v for k, v in _FILTROS_SCHEMA.items() if k not in ('data_inicio', 'data_fim')},
+                    **_AGRUPAMENTO_SCHEMA
+                ),
+                'required': ['periodo_a', 'periodo_b'],
+            },
+        },
+    },
+]
+
+class QueryError(ValueError):
+    """Argumentos inválidos em uma consulta (a mensagem volta para a IA)"""
+
+def _parse_periodo(valor, campo, fim=False):
+    """
+    'AAAA-MM-DD' ou 'AAAA-MM' -> Timestamp; no fim, o limite exclusivo (dia ou mês seguinte)
+    """
+    if valor in (None, ''):
+        return None
+    if not isinstance(valor, str):
+        raise QueryError(f"{campo}: use 'AAAA-MM-DD' ou 'AAAA-MM'")
+    try:
+        if len(valor) == 7:
+            data = pd.Timestamp(f"{valor}-01")
+            return data + pd.DateOffset(months=1) if fim else data
+        data = pd.Timestamp(valor).normalize()
+        return data + pd.Timedelta(days=1) if fim else data
+    except (ValueError, TypeError):
+        raise QueryError(f"{campo}: data inválida '{valor}' (use 'AAAA-MM-DD' ou 'AAAA-MM')")
+
+def _resolver(column, valores, campo):
+    """
+    Nomes citados -> valores exatos da dimensão (sem diferenciar maiúsculas e acentos)
+    """
+    if isinstance(valores, str):
+        valores = [valores]
+    if not isinstance(valores, list):
+        raise QueryError(f"{campo}: esperado uma lista de nomes")
+
+    por_nome = {normalize_question(str(label)): label for label in column.cat.categories}
+    resolvidos = []
+    for valor in valores:
+        label = por_nome.get(normalize_question(str(valor)))
+        if label is None:
+            opcoes = ', '.join(str(l) for l in list(column.cat.categories)[:20])
+            raise QueryError(f"{campo}: valor desconhecido '{valor}'. Opções: {opcoes}")
+        resolvidos.append(label)
+    return resolvidos
+
+def _filtros(frame, args):
+    """
+    Filtros de dimensão pedidos -> {coluna: valores exatos}
+    """
+    filtros = {}
+    for campo, coluna in FILTROS.items():
+        if args.get(campo):
+            filtros[coluna] = _resolver(frame[coluna], args[campo], campo)
+    return filtros
+
+def _conferir_prazo(prazo):
+    """
+    Levanta QueryError se o prazo da consulta (time.monotonic) já passou
+    """
+    if prazo is not None and time.monotonic() > prazo:
+        raise QueryError(f"Consulta excedeu {TEMPO_MAXIMO:.0f}s; use filtros mais restritos")
+
+def _agregar(snapshot, args, inicio=None, fim=None, agrupar_por=None, prazo=None):
+    """
+    Agregados das linhas filtradas. Um período com no máximo uma dimensão filtrada (e
+    agrupamento pela mesma dimensão, ou nenhum) sai do cubo temporal sem visitar as linhas;
+    o resto usa os índices do snapshot, com o número de linhas filtradas limitado a
+    MAX_LINHAS e o prazo conferido antes de recortar e de agregar.
+    """
+    _conferir_prazo(prazo)
+    filtros = _filtros(snapshot.frame, args)
+    chave = next(iter(filtros), None)
+    cube = snapshot.cube
+
+    if cube is not None and (inicio is not None or fim is not None) and len(filtros) <= 1 \
+            and agrupar_por in (None, 'produto', 'categoria', 'regiao') \
+            and (chave is None or agrupar_por in (None, chave)):
+        totais = cube.totals_between(inicio, fim, chave, filtros.get(chave))
+        registros = totais['vendas']
+        result = {
+            'total_registros': registros,
+            'receita_total': totais['receita'],
+            'quantidade_total': totais['quantidade'],
+            'ticket_medio': totais['receita'] / registros if registros > 0 else 0,
+        }
+        if agrupar_por:
+            result[AGRUPAMENTOS[agrupar_por]] = cube.groups_between(agrupar_por, inicio, fim, filtros.get(agrupar_por))
+        return result
+
+    positions = snapshot.index.positions(filtros, inicio, fim)
+    linhas = len(snapshot.frame) if positions is None else len(positions)
+    if linhas > MAX_LINHAS:
+        raise QueryError(f"Consulta cobre {linhas:,} linhas (máximo {MAX_LINHAS:,}); use filtros mais restritos")
+    _conferir_prazo(prazo)
+    frame = snapshot.frame if positions is None else snapshot.frame.take(positions)
+    _conferir_prazo(prazo)
+    return aggregate(frame)
+
+def _totais(aggregates):
+    return {
+        'registros': aggregates['total_registros'],
+        'receita': round(aggregates['receita_total'], 2),
+        'quantidade': aggregates['quantidade_total'],
+        'ticket_medio': round(aggregates['ticket_medio'], 2),
+    }
+
+def _opcoes_agrupamento(args):
+    agrupar_por = args.get('agrupar_por')
+    if agrupar_por in (None, '', 'nenhum'):
+        return None, None, None, None
+    if agrupar_por not in AGRUPAMENTOS:
+        raise QueryError(f"agrupar_por: use um de {', '.join(AGRUPAMENTOS)}")
+
+    ordenar_por = args.get('ordenar_por') or 'receita'
+    if ordenar_por not in METRICAS:
+        raise QueryError(f"ordenar_por: use um de {', '.join(METRICAS)}")
+    ordem = args.get('ordem') or 'desc'
+    if ordem not in ('desc', 'asc'):
+        raise QueryError("ordem: use 'desc' ou 'asc'")
+    try:
+        limite = int(args.get('limite') or 10)
+    except (ValueError, TypeError):
+        raise QueryError('limite: esperado um número inteiro')
+    return agrupar_por, ordenar_por, ordem == 'desc', max(1, min(limite, MAX_GRUPOS))
+
+def _grupo(item):
+    return {
+        'nome': item['nome'],
+        'vendas': item['vendas'],
+        'receita': round(item['receita'], 2),
+        'quantidade': item['quantidade'],
+    }
+
+def _variacao(antes, depois):
+    if not antes:
+        return None
+    return round((depois - antes) / antes * 100, 1)
+
+def consultar_vendas(snapshot, args, prazo=None):
+    inicio = _parse_periodo(args.get('data_inicio'), 'data_inicio')
+    fim = _parse_periodo(args.get('data_fim'), 'data_fim', fim=True)
+    agrupar_por, ordenar_por, desc, limite = _opcoes_agrupamento(args)
+
+    aggregates = _agregar(snapshot, args, inicio, fim, agrupar_por, prazo)
+    result = {'totais': _totais(aggregates)}
+
+    if agrupar_por:
+        grupos = aggregates[AGRUPAMENTOS[agrupar_por]]
+        if not (agrupar_por == 'mes' and not args.get('ordenar_por')):
+            grupos = sorted(grupos, key=lambda x: x[ordenar_por], reverse=desc)
+        result['agrupado_por'] = agrupar_por
+        result['total_grupos'] = len(grupos)
+        result['grupos'] = [_grupo(item) for item in grupos[:limite]]
+
+    return result
+
+def comparar_periodos(snapshot, args, prazo=None):
+    periodos = []
+    for campo in ('periodo_a', 'periodo_b'):
+        periodo = args.get(campo)
+        if not isinstance(periodo, dict):
+            raise QueryError(f"{campo}: esperado {{'data_inicio': ..., 'data_fim': ...}}")
+        periodos.append((
+            _parse_periodo(periodo.get('data_inicio'), f'{campo}.data_inicio'),
+            _parse_periodo(periodo.get('data_fim'), f'{campo}.data_fim', fim=True),
+        ))
+    agrupar_por, ordenar_por, desc, limite = _opcoes_agrupamento(args)
+
+    a, b = (_agregar(snapshot, args, inicio, fim, agrupar_por, prazo) for inicio, fim in periodos)
+    totais_a, totais_b = _totais(a), _totais(b)
+    result = {
+        'periodo_a': totais_a,
+        'periodo_b': totais_b,
+        'variacao_percentual': {
+            campo: _variacao(totais_a[campo], totais_b[campo])
+            for campo in ('registros', 'receita', 'quantidade', 'ticket_medio')
+        },
+    }
+
+    if agrupar_por:
+        chave = AGRUPAMENTOS[agrupar_por]
+        grupos_a = {item['nome']: item for item in a[chave]}
+        grupos_b = {item['nome']: item for item in b[chave]}
+        vazio = {'vendas': 0, 'receita': 0.0, 'quantidade': 0}
+        grupos = []
+        for nome in set(grupos_a) | set(grupos_b):
+            item_a = grupos_a.get(nome, vazio)
+            item_b = grupos_b.get(nome, vazio)
+            grupos.append({
+                'nome': nome,
+                f'{ordenar_por}_a': round(item_a[ordenar_por], 2),
+                f'{ordenar_por}_b': round(item_b[ordenar_por], 2),
+                'diferenca': round(item_b[ordenar_por] - item_a[ordenar_por], 2),
+                'variacao_percentual': _variacao(item_a[ordenar_por], item_b[ordenar_por]),
+            })
+        grupos.sort(key=lambda x: x['diferenca'], reverse=desc)
+        result['agrupado_por'] = agrupar_por
+        result['comparado_por'] = ordenar_por
+        result['grupos'] = grupos[:limite]
+
+    return result
+
+# Ferramentas disponíveis -> implementação
+CONSULTAS = {
+    'consultar_vendas': consultar_vendas,
+    'comparar_periodos': comparar_periodos,
+}
+
+def execute_tool(snapshot, name, arguments):
+    """
+    Executa uma chamada de ferramenta da IA e devolve o resultado em JSON.
+    Erros de argumento, consultas grandes ou lentas demais e ferramentas desconhecidas
+    voltam como {'erro': ...} para que a IA possa corrigir a chamada.
+    """
+    prazo = time.monotonic() + TEMPO_MAXIMO
+    try:
+        if name not in CONSULTAS:
+            raise QueryError(f"Ferramenta desconhecida: {name}")
+        if snapshot.frame is None:
+            raise QueryError("Nenhum dado carregado")
+
+        try:
+            args = json.loads(arguments or '{}') if isinstance(arguments, str) else (arguments or {})
+        except json.JSONDecodeError:
+            raise QueryError("Argumentos não são um JSON válido")
+        if not isinstance(args, dict):
+            raise QueryError("Argumentos devem ser um objeto JSON")
+
+        result = CONSULTAS[name](snapshot, args, prazo)
+    except QueryError as e:
+        result = {'erro': str(e)}
+
+    return json.dumps(result, ensure_ascii=False)
@@ -0,0 +1,88 @@
+"""
+Coordenador de atualizações: uma atualização por vez, pedidos repetidos reaproveitam a que está em andamento
+"""
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import uuid
+
+# Quantos jobs terminados ficam disponíveis para consulta de status
+MAX_JOBS = 50
+
+class RefreshJob:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = 'executando'
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.coalesced = 0
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'result': self.result,
+            'coalesced_requests': self.coalesced,
+        }
+
+class RefreshCoordinator:
+    def __init__(self, refresh_fn):
+        """
+        refresh_fn faz a atualização completa e retorna um resumo (dict) ou levanta exceção
+        """
+        self.refresh_fn = refresh_fn
+        self._lock = threading.Lock()
+        self._current = None
+        self._jobs = OrderedDict()
+
+    def request(self):
+        """
+        Inicia uma atualização em segundo plano, ou retorna a que já está em andamento
+        """
+        with self._lock:
+            if self._current is not None:
+                self._current.coalesced += 1
+                return self._current
+
+            job = RefreshJob()
+            self._current = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS:
+                self._jobs.popitem(last=False)
+
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job
+
+    def refresh(self, timeout=None):
+        """
+        Pede uma atualização e espera ela terminar
+        """
+        job = self.request()
+        job.done.wait(timeout)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    @property
+    def running(self):
+        return self._current is not None
+
+    def _run(self, job):
+        try:
+            job.result = self.refresh_fn()
+            job.status = 'concluido'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'erro'
+        finally:
+            job.finished_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            with self._lock:
+                self._current = None
+            job.done.set()
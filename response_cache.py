@@ -0,0 +1,144 @@
+"""
+Cache das respostas do chat, por pergunta normalizada e versão dos dados
+"""
+from collections import OrderedDict
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from text_utils import normalize_question
+
+# Dimensão do vetor de n-gramas (hashing trick) usado na busca por similaridade
+DIMENSAO = 2048
+
+# Tamanho dos n-gramas de caracteres
+NGRAMA = 3
+
+# Palavras ignoradas ao comparar perguntas parecidas (já normalizadas, sem acentos)
+PALAVRAS_VAZIAS = frozenset({
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'de', 'do', 'da', 'dos', 'das',
+    'em', 'no', 'na', 'nos', 'nas', 'ao', 'aos', 'por', 'pelo', 'pela', 'para', 'pra',
+    'com', 'e', 'ou', 'que', 'qual', 'quais', 'como', 'me', 'se', 'foi', 'foram',
+    'sao', 'esta', 'estao', 'voce', 'pode', 'poderia', 'favor', 'mostre', 'mostra',
+    'diga', 'informe', 'sobre', 'ai', 'entao', 'agora',
+})
+
+def palavras(pergunta):
+    """
+    Palavras da pergunta normalizada que mudam o sentido (sem PALAVRAS_VAZIAS), na ordem
+    """
+    return [p for p in pergunta.split() if p not in PALAVRAS_VAZIAS]
+
+def embed(pergunta):
+    """
+    Vetor normalizado de n-gramas de caracteres (hashing trick) da pergunta normalizada
+    """
+    vetor = np.zeros(DIMENSAO, dtype='float32')
+    texto = f" {pergunta} "
+    for i in range(len(texto) - NGRAMA + 1):
+        vetor[zlib.crc32(texto[i:i + NGRAMA].encode()) % DIMENSAO] += 1
+    norma = np.linalg.norm(vetor)
+    return vetor / norma if norma else vetor
+
+class ResponseCache:
+    def __init__(self, max_size=256, ttl=3600, similarity=0.92):
+        """
+        similarity: cosseno mínimo para aceitar uma pergunta parecida (>= 1 só aceita iguais)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pergunta, version):
+        """
+        Resposta em cache para a pergunta na versão dos dados, ou None
+        """
+        chave = normalize_question(pergunta)
+        agora = time.monotonic()
+
+        with self._lock:
+            self._expire(agora)
+
+            entrada = self._entries.get((version, chave))
+            if entrada is None and self.similarity < 1:
+                entrada = self._similar(chave, version)
+
+            if entrada is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entrada['chave'])
+            self.hits += 1
+            return entrada['resposta']
+
+    def put(self, pergunta, version, resposta):
+        chave = normalize_question(pergunta)
+        if not chave or not resposta:
+            return
+        conteudo = palavras(chave)
+
+        with self._lock:
+            self._entries[(version, chave)] = {
+                'chave': (version, chave),
+                'resposta': resposta,
+                'vetor': embed(' '.join(conteudo)),
+                'palavras': frozenset(conteudo),
+                'criado': time.monotonic(),
+            }
+            self._entries.move_to_end((version, chave))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, version=None):
+        """
+        Remove as respostas de outras versões dos dados (ou todas, sem versão)
+        """
+        with self._lock:
+            for chave in list(self._entries):
+                if version is None or chave[0] != version:
+                    del self._entries[chave]
+
+    def _expire(self, agora):
+        for chave, entrada in list(self._entries.items()):
+            if agora - entrada['criado'] > self.ttl:
+                del self._entries[chave]
+
+    def _similar(self, chave, version):
+        """
+        Entrada da mesma versão mais parecida com a pergunta, se passar do limite.
+        Só concorrem perguntas com as mesmas palavras (fora as vazias): uma palavra
+        diferente (mês, região, "mais"/"menos", um número) muda a resposta.
+        """
+        conteudo = palavras(chave)
+        if not conteudo:
+            return None
+        candidatas = [
+            e for (v, _), e in self._entries.items()
+            if v == version and e['palavras'] == frozenset(conteudo)
+        ]
+        if not candidatas:
+            return None
+
+        # Mesmas palavras: o cosseno só compara a ordem delas
+        vetor = embed(' '.join(conteudo))
+        scores = np.stack([e['vetor'] for e in candidatas]) @ vetor
+        melhor = int(np.argmax(scores))
+        entrada = candidatas[melhor]
+
+        if scores[melhor] < self.similarity:
+            return None
+        return entrada
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'entradas': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,258 @@
+"""
+Conversão tipada das linhas da planilha: detecta o tipo de cada coluna uma vez por
+atualização e converte moeda pt-BR, separadores de milhar e datas ISO/seriais em colunas
+tipadas, relatando as linhas que não puderam ser convertidas
+"""
+import numpy as np
+import pandas as pd
+
+from text_utils import normalize_question
+from sheet_store import SheetRows
+
+# Cabeçalhos aceitos (normalizados) -> coluna tipada
+ALIASES = {
+    'data': 'data',
+    'data da venda': 'data',
+    'produto': 'produto',
+    'categoria': 'categoria',
+    'regiao': 'regiao',
+    'quantidade': 'quantidade',
+    'qtd': 'quantidade',
+    'preco unitario': 'preco_unitario',
+    'preco': 'preco_unitario',
+    'receita total': 'receita',
+    'receita': 'receita',
+    'valor total': 'receita',
+}
+
+# Tipo de cada coluna tipada
+SCHEMA = {
+    'data': 'data',
+    'produto': 'texto',
+    'categoria': 'texto',
+    'regiao': 'texto',
+    'quantidade': 'numero',
+    'preco_unitario': 'numero',
+    'receita': 'numero',
+}
+
+# Datas seriais do Google Sheets: dias desde 30/12/1899 (faixa aceita: 1954 a 2119)
+EPOCA_SERIAL = pd.Timestamp('1899-12-30')
+SERIAL_MIN, SERIAL_MAX = 20000, 80000
+
+# Exemplos de falhas guardados no relatório
+MAX_EXEMPLOS = 20
+
+def _is_text(series):
+    if pd.api.types.is_string_dtype(series.dtype) and series.dtype != object:
+        return series.notna().to_numpy()
+    return series.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+
+def _failed(invalid, series, text):
+    """
+    Células preenchidas que não viraram valor (vazias e só espaços não contam)
+    """
+    failed = invalid & series.notna().to_numpy()
+    candidates = np.flatnonzero(failed & text)
+    if len(candidates):
+        failed[candidates] = series.iloc[candidates].str.strip().ne('').to_numpy()
+    return failed
+
+def parse_numbers(values):
+    """
+    Converte números e textos ('R$ 1.234,56', '1,234.56', '10,5', '(12,00)') em float.
+    Retorna (valores com NaN nas falhas, máscara das células preenchidas que falharam).
+    """
+    series = pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values.reset_index(drop=True)
+
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        # Coluna já numérica (o caso comum vindo do Apps Script): nada a converter
+        parsed = series.astype('float64').to_numpy(copy=True)
+        return parsed, np.zeros(len(parsed), dtype=bool)
+
+    text = _is_text(series)
+    series = series.astype(object)
+    parsed = pd.to_numeric(series.where(~text), errors='coerce').astype('float64').to_numpy(copy=True)
+
+    if text.any():
+        raw = series[text].str.strip()
+        raw = raw.str.replace(r'R\$|\s', '', regex=True)
+        raw = raw.str.replace(r'^\((.*)\)$', r'-\1', regex=True)
+
+        last_comma = raw.str.rfind(',')
+        last_dot = raw.str.rfind('.')
+        comma_decimal = last_comma > last_dot
+        comma_thousands = (last_comma >= 0) & ~comma_decimal
+        dot_thousands = (last_comma < 0) & raw.str.fullmatch(r'-?\d{1,3}(\.\d{3})+')
+
+        cleaned = raw.copy()
+        cleaned[comma_decimal] = raw[comma_decimal].str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+        cleaned[comma_thousands] = raw[comma_thousands].str.replace(',', '', regex=False)
+        cleaned[dot_thousands] = raw[dot_thousands].str.replace('.', '', regex=False)
+        parsed[text] = pd.to_numeric(cleaned, errors='coerce').to_numpy()
+
+    return parsed, _failed(np.isnan(parsed), series, text)
+
+def parse_dates(values):
+    """
+    Converte datas ISO 8601, 'DD/MM/AAAA' e seriais do Sheets em datetime64 (sem fuso).
+    Retorna (datas com NaT nas falhas, máscara das células preenchidas que falharam).
+    """
+    series = pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values.reset_index(drop=True)
+    text = _is_text(series)
+    series = series.astype(object)
+    result = np.full(len(series), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    # ISO 8601 (o formato enviado pelo Apps Script)
+    if text.any():
+        iso = pd.to_datetime(series[text], errors='coerce', utc=True, format='ISO8601').dt.tz_localize(None)
+        result[text] = iso.to_numpy()
+
+    # Seriais do Sheets (número ou texto numérico)
+    pending = np.isnat(result) & series.notna().to_numpy()
+    if pending.any():
+        numbers = pd.to_numeric(series[pending], errors='coerce').to_numpy(dtype='float64')
+        serial = (numbers >= SERIAL_MIN) & (numbers <= SERIAL_MAX)
+        if serial.any():
+            indices = np.flatnonzero(pending)[serial]
+            result[indices] = (EPOCA_SERIAL + pd.to_timedelta(numbers[serial], unit='D')).to_numpy()
+
+    # pt-BR: 'DD/MM/AAAA' (com ou sem hora)
+    pending = np.isnat(result) & text
+    if pending.any():
+        br = pd.to_datetime(series[pending].str.strip().str.slice(0, 10), errors='coerce', format='%d/%m/%Y')
+        result[pending] = br.to_numpy()
+
+    return pd.Series(result), _failed(np.isnat(result), series, text)
+
+def detect_type(values, sample=200):
+    """
+    Tipo de uma coluna ('numero', 'data' ou 'texto') a partir de uma amostra das células
+    """
+    series = pd.Series(values, dtype=object).dropna().head(sample * 2)
+    series = series[series.map(lambda v: not isinstance(v, str) or v.strip() != '')].head(sample)
+    if series.empty:
+        return 'texto'
+
+    if not parse_numbers(series)[1].any():
+        return 'numero'
+    if not parse_dates(series)[1].any():
+        return 'data'
+    return 'texto'
+
+def detect_schema(columns):
+    """
+    Cabeçalhos da planilha -> coluna tipada, pelo nome normalizado
+    """
+    schema = {}
+    for column in columns:
+        target = ALIASES.get(normalize_question(str(column)))
+        if target and target not in schema.values():
+            schema[column] = target
+    return schema
+
+def empty_typed_frame():
+    return pd.DataFrame({
+        'data': pd.Series([], dtype='datetime64[ns]'),
+        'produto': pd.Series([], dtype=object),
+        'categoria': pd.Series([], dtype=object),
+        'regiao': pd.Series([], dtype=object),
+        'quantidade': pd.Series([], dtype='int64'),
+        'preco_unitario': pd.Series([], dtype='float64'),
+        'receita': pd.Series([], dtype='float64'),
+    })
+
+def parse_sheet(df, sheet_name=None):
+    """
+    Converte o DataFrame de uma guia nas colunas tipadas. Retorna (frame tipado, relatório).
+    """
+    if df is None or len(df) == 0:
+        return empty_typed_frame(), {'linhas': 0, 'tipos': {}, 'falhas': {}, 'exemplos': []}
+
+    schema = detect_schema(df.columns)
+    by_target = {target: column for column, target in schema.items()}
+    typed = {}
+    failures = {}
+    examples = []
+
+    for target, kind in SCHEMA.items():
+        column = by_target.get(target)
+        values = df[column].reset_index(drop=True) if column is not None else pd.Series([None] * len(df), dtype=object)
+
+        if kind == 'texto':
+            is_text = _is_text(values)
+            text = values.astype(object)
+            blank = text.isna().to_numpy(copy=True)
+            if is_text.any():
+                blank[is_text] = text[is_text].str.len().to_numpy() == 0
+            typed[target] = text.where(~blank, 'Outros').astype(str).to_numpy(dtype=object)
+            continue
+
+        if kind == 'data':
+            parsed, failed = parse_dates(values)
+            typed[target] = parsed.to_numpy()
+        else:
+            parsed, failed = parse_numbers(values)
+            typed[target] = parsed
+
+        if column is not None and failed.any():
+            failures[column] = int(failed.sum())
+            for i in np.flatnonzero(failed)[:MAX_EXEMPLOS - len(examples)]:
+                # Linha na planilha: índice + 2 (cabeçalho na linha 1)
+                examples.append({'guia': sheet_name, 'linha': int(i) + 2, 'coluna': column, 'valor': str(values[i])})
+
+    frame = pd.DataFrame(typed)
+    frame['quantidade'] = np.nan_to_num(frame['quantidade'].to_numpy()).round().astype('int64')
+    frame['preco_unitario'] = frame['preco_unitario'].fillna(0.0)
+    frame['receita'] = frame['receita'].fillna(0.0)
+
+    report = {
+        'linhas': len(df),
+        'tipos': {column: SCHEMA[target] for column, target in schema.items()},
+        'falhas': failures,
+        'exemplos': examples,
+    }
+    for column in df.columns:
+        if column not in schema:
+            report['tipos'][column] = detect_type(df[column])
+
+    return frame, report
+
+def merge_reports(reports):
+    """
+    Junta os relatórios das guias em um só
+    """
+    merged = {'linhas': 0, 'falhas': {}, 'exemplos': [], 'guias': {}}
+    for name, report in reports:
+        merged['linhas'] += report['linhas']
+        for column, count in report['falhas'].items():
+            merged['falhas'][column] = merged['falhas'].get(column, 0) + count
+        merged['exemplos'].extend(report['exemplos'][:MAX_EXEMPLOS - len(merged['exemplos'])])
+        merged['guias'][name] = {'linhas': report['linhas'], 'tipos': report['tipos'], 'falhas': report['falhas']}
+    merged['celulas_com_falha'] = sum(merged['falhas'].values())
+    return merged
+
+def parse_data(data):
+    """
+    Converte todas as guias (dict de guias ou lista de linhas). Retorna (frames tipados, relatório).
+    """
+    if not data:
+        return [], merge_reports([])
+
+    if isinstance(data, dict):
+        frames, reports = [], []
+        for sheet in data.values():
+            rows = sheet.get('dados')
+            if isinstance(rows, SheetRows):
+                df = rows.to_frame()
+            else:
+                df = pd.DataFrame.from_records(rows) if rows else None
+            frame, report = parse_sheet(df, sheet.get('nome'))
+            frames.append(frame)
+            reports.append((sheet.get('nome'), report))
+        return frames, merge_reports(reports)
+
+    # Uma única guia (compatibilidade)
+    rows = list(data)
+    frame, report = parse_sheet(pd.DataFrame.from_records(rows) if rows else None)
+    return [frame], merge_reports([(None, report)])
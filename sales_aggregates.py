@@ -0,0 +1,170 @@
+"""
+Motor de agregação colunar para os dados de vendas
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from row_parser import parse_data, empty_typed_frame
+
+# Colunas da planilha usadas como dimensões de agrupamento
+DIMENSOES = {
+    'produto': 'Produto',
+    'categoria': 'Categoria',
+    'regiao': 'Região',
+}
+
+# Largura das faixas de preço unitário (R$)
+FAIXA_PRECO = 50
+
+# Filtros de período oferecidos pelo dashboard (meses)
+FILTROS_MESES = (3, 6, 12)
+
+def build_frame(data, typed=None):
+    """
+    Junta as colunas tipadas das guias em um DataFrame com dimensões categóricas.
+    typed: frames já convertidos por guia (row_parser); sem eles, as linhas são convertidas aqui.
+    """
+    if typed is None:
+        typed, _ = parse_data(data)
+    raw = pd.concat(typed, ignore_index=True) if typed else empty_typed_frame()
+
+    frame = pd.DataFrame(index=pd.RangeIndex(len(raw)))
+    frame['data'] = raw['data'].to_numpy()
+
+    for key in DIMENSOES:
+        frame[key] = pd.Categorical(raw[key].astype(str))
+
+    frame['quantidade'] = raw['quantidade'].to_numpy()
+    frame['preco_unitario'] = raw['preco_unitario'].to_numpy()
+    frame['receita'] = raw['receita'].to_numpy()
+
+    # Mês como chave inteira AAAAMM (-1 quando a data é inválida)
+    dates = frame['data']
+    month_key = (dates.dt.year * 100 + dates.dt.month).fillna(-1).astype('int64').to_numpy()
+    month_values = np.unique(month_key[month_key >= 0])
+    month_codes = np.where(month_key >= 0, np.searchsorted(month_values, month_key), -1)
+    frame['mes'] = pd.Categorical.from_codes(
+        month_codes, categories=[f"{k // 100:04d}-{k % 100:02d}" for k in month_values]
+    )
+
+    # Faixa de preço como índice inteiro (-1 sem preço)
+    price = frame['preco_unitario'].to_numpy()
+    frame['faixa_preco'] = np.where(price > 0, (price // FAIXA_PRECO), -1).astype('int64')
+
+    return frame
+
+def _group(codes, labels, receita, quantidade):
+    """
+    Soma vendas, receita e quantidade por código categórico em uma passada
+    """
+    size = len(labels)
+    valid = codes >= 0
+    codes = codes[valid]
+
+    vendas = np.bincount(codes, minlength=size)
+    receitas = np.bincount(codes, weights=receita[valid], minlength=size)
+    quantidades = np.bincount(codes, weights=quantidade[valid], minlength=size)
+
+    return vendas, receitas, quantidades
+
+def _records(labels, vendas, receitas, quantidades, extra=None):
+    """
+    Monta a lista de grupos com vendas > 0, ordenada por receita
+    """
+    groups = []
+    for i in np.flatnonzero(vendas):
+        item = {
+            'nome': str(labels[i]),
+            'vendas': int(vendas[i]),
+            'receita': float(receitas[i]),
+            'quantidade': int(quantidades[i]),
+        }
+        if extra:
+            for field, values in extra.items():
+                item[field] = values[i]
+        groups.append(item)
+
+    groups.sort(key=lambda x: x['receita'], reverse=True)
+    return groups
+
+def aggregate(frame):
+    """
+    Calcula totais e todos os agrupamentos (produto, região, categoria, mês e faixa de preço)
+    """
+    receita = frame['receita'].to_numpy()
+    quantidade = frame['quantidade'].to_numpy()
+    total_records = len(frame)
+    total_revenue = float(receita.sum())
+    total_quantity = int(quantidade.sum())
+
+    result = {
+        'total_registros': total_records,
+        'receita_total': total_revenue,
+        'quantidade_total': total_quantity,
+        'ticket_medio': total_revenue / total_records if total_records > 0 else 0,
+        'quantidade_media': total_quantity / total_records if total_records > 0 else 0,
+    }
+
+    product_codes = frame['produto'].cat.codes.to_numpy()
+    category_codes = frame['categoria'].cat.codes.to_numpy()
+    category_labels = frame['categoria'].cat.categories
+
+    # Produtos: categoria da última venda de cada produto
+    product_labels = frame['produto'].cat.categories
+    last_category = np.full(len(product_labels), -1, dtype='int64')
+    last_category[product_codes] = category_codes
+    product_category = [str(category_labels[c]) if c >= 0 else 'Outros' for c in last_category]
+    result['produtos'] = _records(
+        product_labels, *_group(product_codes, product_labels, receita, quantidade),
+        extra={'categoria': product_category}
+    )
+
+    # Categorias: contagem de produtos distintos por categoria
+    pairs = np.unique(category_codes.astype('int64') * max(len(product_labels), 1) + product_codes)
+    products_per_category = np.bincount(pairs // max(len(product_labels), 1), minlength=len(category_labels))
+    result['categorias'] = _records(
+        category_labels, *_group(category_codes, category_labels, receita, quantidade),
+        extra={'produtos': [int(n) for n in products_per_category]}
+    )
+
+    region_labels = frame['regiao'].cat.categories
+    result['regioes'] = _records(
+        region_labels, *_group(frame['regiao'].cat.codes.to_numpy(), region_labels, receita, quantidade)
+    )
+
+    month_labels = frame['mes'].cat.categories
+    months = _records(
+        month_labels, *_group(frame['mes'].cat.codes.to_numpy(), month_labels, receita, quantidade)
+    )
+    result['meses'] = sorted(months, key=lambda x: x['nome'])
+
+    # Faixas de preço
+    bands = frame['faixa_preco'].to_numpy()
+    band_count = int(bands.max()) + 1 if len(bands) and bands.max() >= 0 else 0
+    band_labels = [f"R$ {i * FAIXA_PRECO}-{i * FAIXA_PRECO + FAIXA_PRECO - 1}" for i in range(band_count)]
+    result['faixas_preco'] = _records(
+        band_labels, *_group(bands, band_labels, receita, quantidade)
+    )
+
+    return result
+
+def recent_cutoff(months, today=None):
+    """
+    Data inicial dos últimos N meses (mesmo corte do filtro do dashboard)
+    """
+    today = pd.Timestamp(today or datetime.now()).normalize()
+    return today - pd.DateOffset(months=months)
+
+def filter_recent_months(frame, months, today=None):
+    """
+    Mantém só as vendas dos últimos N meses (varredura completa; o snapshot usa o índice de datas)
+    """
+    return frame[frame['data'] >= recent_cutoff(months, today)]
+
+def empty_aggregates():
+    """
+    Agregados zerados, usados quando ainda não há dados carregados
+    """
+    return aggregate(build_frame(None))
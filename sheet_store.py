@@ -0,0 +1,243 @@
+"""
+Armazenamento colunar das linhas de cada guia: arrays NumPy por coluna, textos
+codificados por dicionário (categóricos) e os metadados da guia fora das linhas.
+As linhas em dict só são montadas quando uma resposta da API precisa delas.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Colunas de texto sempre codificadas por dicionário
+CATEGORICAS = ('Produto', 'Categoria', 'Região')
+
+# Outras colunas de texto viram categóricas quando têm até esta fração de valores distintos
+FRACAO_CATEGORICA = 0.5
+
+# Linhas montadas por vez ao gerar dicts
+BLOCO = 1000
+
+class PackedStrings:
+    """
+    Textos quase todos distintos (ex.: IDs) em um único buffer UTF-8 com offsets,
+    em vez de um objeto str do Python por célula
+    """
+    def __init__(self, blob, offsets, missing=None, na=None):
+        self.blob = blob
+        self.offsets = offsets
+        self.missing = missing
+        self.na = na
+
+    @classmethod
+    def from_values(cls, values):
+        missing = pd.isna(values)
+        encoded = [b'' if gap else value.encode('utf-8') for value, gap in zip(values, missing)]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        if offsets[-1] < np.iinfo(np.int32).max:
+            offsets = offsets.astype(np.int32)
+        na = values[np.flatnonzero(missing)[0]] if missing.any() else None
+        return cls(b''.join(encoded), offsets, missing if missing.any() else None, na)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def tolist(self, first=0, last=None):
+        last = len(self) if last is None else last
+        bounds = self.offsets[first:last + 1].tolist()
+        blob = self.blob
+        values = [blob[a:b].decode('utf-8') for a, b in zip(bounds, bounds[1:])]
+        if self.missing is not None:
+            for i in np.flatnonzero(self.missing[first:last]):
+                values[i] = self.na
+        return values
+
+    def to_numpy(self):
+        return np.array(self.tolist(), dtype=object)
+
+    @property
+    def nbytes(self):
+        return len(self.blob) + self.offsets.nbytes + (self.missing.nbytes if self.missing is not None else 0)
+
+def _encode(name, values):
+    """
+    Coluna do DataFrame -> array compacto (numérico, categórico, texto empacotado ou objeto)
+    """
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return values.to_numpy()
+    if pd.api.types.is_integer_dtype(values.dtype):
+        # Menor inteiro que comporta a coluna (volta como int do Python do mesmo jeito)
+        return values.to_numpy(dtype=np.result_type(np.min_scalar_type(values.min()), np.min_scalar_type(values.max()))) \
+            if len(values) else values.to_numpy()
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values.to_numpy()
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.array
+    if name in CATEGORICAS or values.nunique(dropna=True) <= len(values) * FRACAO_CATEGORICA:
+        return pd.Categorical(values.astype(object))
+
+    objects = values.to_numpy(dtype=object)
+    if all(isinstance(value, str) for value in objects[pd.notna(objects)]):
+        return PackedStrings.from_values(objects)
+    return objects
+
+def _to_numpy(array):
+    if isinstance(array, PackedStrings):
+        return array.to_numpy()
+    return np.asarray(array, dtype=object) if isinstance(array, pd.Categorical) else array
+
+def _concat(a, b):
+    """
+    Junta duas colunas codificadas mantendo a codificação
+    """
+    if isinstance(a, pd.Categorical) and isinstance(b, pd.Categorical):
+        return union_categoricals([a, b])
+    if isinstance(a, PackedStrings) and isinstance(b, PackedStrings):
+        missing = None
+        if a.missing is not None or b.missing is not None:
+            missing = np.concatenate([
+                a.missing if a.missing is not None else np.zeros(len(a), dtype=bool),
+                b.missing if b.missing is not None else np.zeros(len(b), dtype=bool),
+            ])
+        offsets = np.concatenate([a.offsets.astype(np.int64), b.offsets[1:].astype(np.int64) + len(a.blob)])
+        if offsets[-1] < np.iinfo(np.int32).max:
+            offsets = offsets.astype(np.int32)
+        return PackedStrings(a.blob + b.blob, offsets, missing, a.na if a.na is not None else b.na)
+    if isinstance(a, (pd.Categorical, PackedStrings)) or isinstance(b, (pd.Categorical, PackedStrings)):
+        values = pd.Series(np.concatenate([_to_numpy(a).astype(object), _to_numpy(b).astype(object)]))
+        return _encode(None, values)
+    if a.dtype == b.dtype:
+        return np.concatenate([a, b])
+    if a.dtype.kind in 'iu' and b.dtype.kind in 'iu':
+        return np.concatenate([a, b]).astype(np.result_type(a.dtype, b.dtype))
+    return np.concatenate([a.astype(object), b.astype(object)])
+
+def _values(array, first, last):
+    if isinstance(array, PackedStrings):
+        return array.tolist(first, last)
+    return array[first:last].tolist()
+
+def _missing(length):
+    return np.full(length, np.nan, dtype=object)
+
+class SheetRows:
+    """
+    Linhas de uma guia em colunas. Se comporta como uma sequência (somente leitura)
+    de dicts no formato antigo, com as colunas 'guia' e 'ultima_atualizacao'.
+    """
+    def __init__(self, name, columns, arrays, length, updates):
+        self.name = name
+        self.columns = columns
+        self.arrays = arrays
+        self.length = length
+        # (primeira linha, horário da sincronização) de cada bloco de linhas baixado
+        self.updates = updates
+
+    @classmethod
+    def from_frame(cls, df, name, updated_at):
+        columns = [str(column) for column in df.columns]
+        arrays = {str(column): _encode(str(column), df[column]) for column in df.columns}
+        return cls(name, columns, arrays, len(df), [(0, updated_at)])
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return self.rows()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return list(self)[index]
+            return list(self.rows(start, stop))
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return next(self.rows(index, index + 1))
+
+    def __add__(self, other):
+        return self.append(other)
+
+    def append(self, other):
+        """
+        Nova guia com as linhas de `other` depois das atuais (nome de `other`)
+        """
+        columns = self.columns + [column for column in other.columns if column not in self.columns]
+        arrays = {}
+        for column in columns:
+            a = self.arrays.get(column)
+            b = other.arrays.get(column)
+            arrays[column] = _concat(
+                a if a is not None else _missing(self.length),
+                b if b is not None else _missing(other.length),
+            )
+        updates = self.updates + [(start + self.length, updated_at) for start, updated_at in other.updates]
+        return SheetRows(other.name, columns, arrays, self.length + other.length, updates)
+
+    def rows(self, start=0, stop=None, fields=None):
+        """
+        Gera os dicts das linhas [start, stop), opcionalmente só com as colunas em `fields`
+        """
+        for block in self.blocks(start, stop, fields):
+            yield from block
+
+    def blocks(self, start=0, stop=None, fields=None):
+        """
+        Mesmas linhas de rows(), em listas de até BLOCO dicts
+        """
+        stop = self.length if stop is None else min(stop, self.length)
+        names = list(fields) if fields else self.columns + ['guia', 'ultima_atualizacao']
+        starts = np.array([first for first, _ in self.updates])
+
+        for first in range(start, stop, BLOCO):
+            last = min(first + BLOCO, stop)
+            values = []
+            for name in names:
+                if name in self.arrays:
+                    values.append(_values(self.arrays[name], first, last))
+                elif name == 'guia':
+                    values.append([self.name] * (last - first))
+                elif name == 'ultima_atualizacao':
+                    blocks = np.searchsorted(starts, np.arange(first, last), side='right') - 1
+                    values.append([self.updates[i][1] for i in blocks])
+                else:
+                    values.append([None] * (last - first))
+            yield [dict(zip(names, row)) for row in zip(*values)]
+
+    def to_records(self):
+        return list(self.rows())
+
+    def to_frame(self):
+        """
+        DataFrame com as colunas originais da planilha (sem os metadados da guia)
+        """
+        return pd.DataFrame({column: _to_numpy(self.arrays[column]) for column in self.columns})
+
+    @property
+    def nbytes(self):
+        """
+        Memória aproximada das colunas (inclui os textos dos dicionários e colunas de objeto)
+        """
+        total = 0
+        for array in self.arrays.values():
+            if isinstance(array, pd.Categorical):
+                total += array.codes.nbytes + sum(len(str(label)) + 49 for label in array.categories)
+            elif isinstance(array, PackedStrings):
+                total += array.nbytes
+            elif array.dtype == object:
+                total += array.nbytes + sum(len(str(value)) + 49 for value in array)
+            else:
+                total += array.nbytes
+        return total
+
+def materialize(data):
+    """
+    Guias com as linhas montadas como lista de dicts (formato original de /api/data)
+    """
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: dict(sheet, dados=sheet['dados'].to_records() if isinstance(sheet['dados'], SheetRows) else sheet['dados'])
+        for key, sheet in data.items()
+    }
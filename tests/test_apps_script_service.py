@@ -0,0 +1,59 @@
+from apps_script_service import AppsScriptService
+
+COLUNAS = ['Data', 'Produto', 'Categoria', 'Região', 'Quantidade', 'Preço Unitário', 'Receita Total']
+
+class Resposta:
+    status_code = 200
+
+    def __init__(self, corpo):
+        self.corpo = corpo
+        self.content = b'{}'
+        self.text = '{}'
+
+    def json(self):
+        return self.corpo
+
+class AppsScriptAntigo:
+    """
+    doGet sem suporte a ?mode=list: sempre devolve a planilha inteira
+    """
+    def __init__(self):
+        self.chamadas = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.chamadas.append(dict(params or {}))
+        linhas = [dict(zip(COLUNAS, ['2025-01-05T03:00:00.000Z', f'P{i}', 'C', 'Sul', 1, 10.0, 10.0])) for i in range(3)]
+        return Resposta({
+            'success': True,
+            'totalSheets': 2,
+            'sheets': [
+                {'name': f'Mês {gid}', 'gid': gid, 'columns': COLUNAS, 'data': linhas}
+                for gid in (1, 2)
+            ],
+        })
+
+def _servico(session):
+    service = AppsScriptService()
+    service.script_url = 'https://script.google.com/macros/s/teste/exec'
+    service.session = session
+    return service
+
+def test_apps_script_antigo_baixa_a_planilha_uma_vez():
+    session = AppsScriptAntigo()
+    service = _servico(session)
+
+    dados = service.get_latest_data()
+
+    assert sum(guia['total_registros'] for guia in dados.values()) == 6
+    assert session.chamadas == [{'mode': 'list'}]
+    assert service.list_supported is False
+
+def test_apps_script_antigo_nao_e_consultado_de_novo_com_mode_list():
+    session = AppsScriptAntigo()
+    service = _servico(session)
+    service.get_latest_data()
+    session.chamadas.clear()
+
+    service.get_latest_data()
+
+    assert session.chamadas == [{}]
@@ -0,0 +1,64 @@
+import dataclasses
+from datetime import date, timedelta
+import os
+
+import pytest
+
+from data_snapshot import DataSnapshot, build_snapshot, load_snapshot, save_snapshot
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'getuid'), reason='verificação de dono só em POSIX')
+
+SNAPSHOT = DataSnapshot(version=1, data={'guia_1': {}}, total_records=1)
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    path = tmp_path / 'snapshot.pkl'
+    monkeypatch.setenv('SNAPSHOT_CACHE_PATH', str(path))
+    return path
+
+def test_snapshot_gravado_pelo_usuario_carrega(path):
+    save_snapshot(SNAPSHOT)
+    assert oct(path.stat().st_mode & 0o777) == oct(0o600)
+    assert load_snapshot().version == 1
+
+def test_corpo_pre_comprimido_nao_vai_para_o_disco(path):
+    save_snapshot(dataclasses.replace(SNAPSHOT, data_payload={'gzip': b'x' * 1024}))
+    assert load_snapshot().data_payload is None
+    assert path.stat().st_size < 1024
+
+def test_arquivo_gravavel_por_outros_nao_carrega(path):
+    save_snapshot(SNAPSHOT)
+    path.chmod(0o666)
+    with pytest.raises(PermissionError):
+        load_snapshot()
+
+def test_diretorio_gravavel_por_outros_nao_carrega(path):
+    save_snapshot(SNAPSHOT)
+    path.parent.chmod(0o777)
+    try:
+        with pytest.raises(PermissionError):
+            load_snapshot()
+    finally:
+        path.parent.chmod(0o700)
+
+def test_link_simbolico_nao_carrega(path, tmp_path):
+    alvo = tmp_path / 'outro.pkl'
+    save_snapshot(SNAPSHOT, str(alvo))
+    path.symlink_to(alvo)
+    with pytest.raises(PermissionError):
+        load_snapshot()
+
+def test_filtros_de_periodo_recalculados_em_outro_dia():
+    hoje = date.today()
+    linhas = [
+        {'Data': (hoje - timedelta(days=dias)).isoformat(), 'Produto': 'Mouse', 'Categoria': 'Acessórios',
+         'Região': 'Sul', 'Quantidade': 1, 'Preço Unitário': 10.0, 'Receita Total': 10.0}
+        for dias in (1, 200)
+    ]
+    snapshot = build_snapshot(linhas, None, 1)
+    assert snapshot.aggregates_for_months(3) is snapshot.recent[3]
+
+    ontem = dataclasses.replace(snapshot, cutoff_day=(hoje - timedelta(days=1)).isoformat())
+    assert ontem.aggregates_for_months(3) is not snapshot.recent[3]
+    assert ontem.group_table(3, 'regioes') is not snapshot.group_tables[3]['regioes']
+    assert ontem.group_table(0, 'regioes') is snapshot.group_tables[0]['regioes']
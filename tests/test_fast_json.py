@@ -0,0 +1,22 @@
+import json
+import math
+
+import numpy as np
+from flask import Flask
+
+from fast_json import FastJSONProvider, dumps, stdlib_dumps
+
+VALORES = {'receita': math.nan, 'meta': math.inf, 'serie': [1.5, -math.inf, np.float64('nan')], 'media': np.array([2.0, np.nan])}
+
+def test_json_padrao_troca_nan_e_infinito_por_null():
+    texto = stdlib_dumps(VALORES)
+    assert json.loads(texto) == {'receita': None, 'meta': None, 'serie': [1.5, None, None], 'media': [2.0, None]}
+
+def test_json_padrao_igual_ao_rapido():
+    assert json.loads(stdlib_dumps(VALORES)) == json.loads(dumps(VALORES))
+
+def test_provider_respeita_argumentos_do_flask():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    texto = app.json.dumps({'b': 1, 'a': math.nan}, sort_keys=True, indent=2)
+    assert texto == '{\n  "a": null,\n  "b": 1\n}'
@@ -0,0 +1,32 @@
+import pytest
+
+from response_cache import ResponseCache
+
+VERSAO = 1
+
+@pytest.fixture
+def cache():
+    # Mesmo limite padrão de CHAT_CACHE_SIMILARITY
+    return ResponseCache(similarity=0.92)
+
+@pytest.mark.parametrize('guardada, pergunta', [
+    ('Qual foi a receita de março?', 'Qual foi a receita de maio?'),
+    ('Quais produtos vendem mais na região sul?', 'Quais produtos vendem mais na região norte?'),
+    ('Quais produtos vendem mais?', 'Quais produtos vendem menos?'),
+    ('Top 10 produtos de 2024', 'Top 5 produtos de 2024'),
+])
+def test_palavra_diferente_nao_reaproveita_resposta(cache, guardada, pergunta):
+    cache.put(guardada, VERSAO, 'resposta guardada')
+    assert cache.get(pergunta, VERSAO) is None
+
+@pytest.mark.parametrize('guardada, pergunta', [
+    ('Quais produtos vendem mais?', 'quais os produtos que vendem MAIS'),
+    ('Qual foi a receita de março?', 'Qual a receita de marco'),
+])
+def test_mesmas_palavras_reaproveitam_resposta(cache, guardada, pergunta):
+    cache.put(guardada, VERSAO, 'resposta guardada')
+    assert cache.get(pergunta, VERSAO) == 'resposta guardada'
+
+def test_outra_versao_dos_dados_nao_reaproveita(cache):
+    cache.put('Quais produtos vendem mais?', VERSAO, 'resposta guardada')
+    assert cache.get('Quais produtos vendem mais?', VERSAO + 1) is None
@@ -0,0 +1,14 @@
+"""
+Normalização de textos compartilhada (perguntas do chat, cabeçalhos da planilha,
+nomes de produtos, categorias e regiões)
+"""
+import re
+import unicodedata
+
+def normalize_question(texto):
+    """
+    Minúsculas, sem acentos, sem pontuação e com espaços simples
+    """
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', texto).split())
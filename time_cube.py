@@ -0,0 +1,295 @@
+"""
+Cubo temporal pré-calculado na atualização: vendas, receita e quantidade por
+dia, semana e mês, no total e por produto, categoria e região. Tendências
+(mês a mês, ano a ano), médias móveis, acumulados e totais de períodos saem
+do cubo em O(períodos), sem varrer as linhas.
+"""
+import numpy as np
+import pandas as pd
+
+GRANULARIDADES = ('dia', 'semana', 'mes')
+
+# Dimensões do cubo
+DIMENSOES_CUBO = ('produto', 'categoria', 'regiao')
+
+METRICAS_CUBO = ('vendas', 'receita', 'quantidade')
+
+# Maior número de células (valores x períodos) contadas em array denso antes de usar np.unique
+MAX_CELULAS_DENSAS = 5_000_000
+
+# Períodos equivalentes um ano antes (o dia usa o calendário)
+PERIODOS_ANO = {'semana': 52, 'mes': 12}
+
+def _variacao(antes, depois):
+    if not antes:
+        return None
+    return round(float((depois - antes) / antes * 100), 1)
+
+def _bucket_keys(days, granularity):
+    """
+    Dias desde 1970-01-01 -> chave inteira do período (dia, semana iniciando na segunda ou mês)
+    """
+    if granularity == 'dia':
+        return days
+    if granularity == 'semana':
+        # 1970-01-01 foi uma quinta: a segunda-feira anterior é o dia -3
+        return (days + 3) // 7
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+def _bucket_starts(first, count, granularity):
+    """
+    Data inicial (datetime64[D]) de cada período
+    """
+    keys = np.arange(first, first + count)
+    if granularity == 'dia':
+        return keys.astype('datetime64[D]')
+    if granularity == 'semana':
+        return (keys * 7 - 3).astype('datetime64[D]')
+    return keys.astype('datetime64[M]').astype('datetime64[D]')
+
+class TimeCube:
+    def __init__(self, frame):
+        dates = frame['data'].to_numpy().astype('datetime64[ns]')
+        valid = ~np.isnat(dates)
+        days = dates[valid].astype('datetime64[D]').astype(np.int64)
+        receita = frame['receita'].to_numpy()[valid]
+        quantidade = frame['quantidade'].to_numpy()[valid]
+
+        self.labels = {key: [str(label) for label in frame[key].cat.categories] for key in DIMENSOES_CUBO}
+        self.codes_by_label = {key: {label: i for i, label in enumerate(labels)} for key, labels in self.labels.items()}
+        self.spans = {}
+        self.totals = {}
+        self.cells = {}
+
+        if not len(days):
+            for granularity in GRANULARIDADES:
+                self.spans[granularity] = (0, 0)
+                self.totals[granularity] = {metric: np.zeros(0) for metric in METRICAS_CUBO}
+            return
+
+        # Cubo diário a partir das linhas; períodos contínuos do primeiro ao último dia
+        # (dias sem venda ficam zerados)
+        first = int(days.min())
+        count = int(days.max()) - first + 1
+        buckets = days - first
+        self.spans['dia'] = (first, count)
+        self.totals['dia'] = self._sum(buckets, count, None, receita, quantidade)
+        for key in DIMENSOES_CUBO:
+            codes = frame[key].cat.codes.to_numpy()[valid].astype(np.int64)
+            self.cells['dia', key] = self._build_cells(
+                codes, buckets, None, receita, quantidade, len(self.labels[key]), count)
+
+        # Semana e mês somam as células do cubo diário (nunca mais que dias x valores)
+        day_keys = np.arange(first, first + count)
+        for granularity in GRANULARIDADES[1:]:
+            keys = _bucket_keys(day_keys, granularity)
+            coarse_first = int(keys[0])
+            coarse_count = int(keys[-1]) - coarse_first + 1
+            mapping = keys - coarse_first
+            self.spans[granularity] = (coarse_first, coarse_count)
+            daily = self.totals['dia']
+            self.totals[granularity] = self._sum(mapping, coarse_count, daily['vendas'], daily['receita'], daily['quantidade'])
+            for key in DIMENSOES_CUBO:
+                cells = self.cells['dia', key]
+                codes = np.repeat(np.arange(len(self.labels[key])), np.diff(cells['offsets']))
+                self.cells[granularity, key] = self._build_cells(
+                    codes, mapping[cells['buckets']], cells['vendas'], cells['receita'], cells['quantidade'],
+                    len(self.labels[key]), coarse_count)
+
+    @staticmethod
+    def _sum(buckets, count, vendas, receita, quantidade):
+        """
+        Totais por período; vendas=None conta uma venda por linha
+        """
+        return {
+            'vendas': np.bincount(buckets, weights=vendas, minlength=count).astype(np.int64),
+            'receita': np.bincount(buckets, weights=receita, minlength=count),
+            'quantidade': np.bincount(buckets, weights=quantidade, minlength=count).astype(np.int64),
+        }
+
+    @staticmethod
+    def _build_cells(codes, buckets, vendas, receita, quantidade, size, count):
+        """
+        Células (valor, período) com venda, ordenadas por valor e período (formato CSR:
+        as células do valor c ficam em offsets[c]:offsets[c + 1]).
+        vendas=None conta uma venda por linha.
+        """
+        ok = codes >= 0
+        cell = codes[ok] * count + buckets[ok]
+        weights = [None if vendas is None else vendas[ok], receita[ok], quantidade[ok]]
+
+        if size * count <= MAX_CELULAS_DENSAS:
+            sums = [np.bincount(cell, weights=w, minlength=size * count) for w in weights]
+            ids = np.flatnonzero(sums[0])
+            sums = [values[ids] for values in sums]
+        else:
+            ids, inverse = np.unique(cell, return_inverse=True)
+            sums = [np.bincount(inverse, weights=w, minlength=len(ids)) for w in weights]
+
+        return {
+            'offsets': np.searchsorted(ids // count, np.arange(size + 1)),
+            'buckets': ids % count,
+            'vendas': sums[0].astype(np.int64),
+            'receita': sums[1],
+            'quantidade': sums[2].astype(np.int64),
+        }
+
+    def _codes(self, key, labels):
+        by_label = self.codes_by_label[key]
+        return sorted({by_label[str(label)] for label in labels if str(label) in by_label})
+
+    def bucket_labels(self, granularity):
+        first, count = self.spans[granularity]
+        starts = _bucket_starts(first, count, granularity)
+        if granularity == 'mes':
+            return [str(start)[:7] for start in starts]
+        return [str(start) for start in starts]
+
+    def series(self, granularity='mes', key=None, labels=None):
+        """
+        Vendas, receita e quantidade por período (arrays densos), no total ou só
+        das linhas com algum dos valores em `labels` da dimensão `key`
+        """
+        if key is None:
+            return self.totals[granularity]
+
+        _, count = self.spans[granularity]
+        cells = self.cells[granularity, key]
+        result = {metric: np.zeros(count, dtype=np.float64 if metric == 'receita' else np.int64)
+                  for metric in METRICAS_CUBO}
+        for code in self._codes(key, labels or []):
+            part = slice(cells['offsets'][code], cells['offsets'][code + 1])
+            # Cada período aparece uma vez por valor: soma direta pelos índices
+            for metric in METRICAS_CUBO:
+                result[metric][cells['buckets'][part]] += cells[metric][part]
+        return result
+
+    def _day_range(self, inicio, fim):
+        """
+        Posições [lo, hi) dos dias com inicio <= dia < fim no cubo diário
+        """
+        first, count = self.spans['dia']
+        lo = 0 if inicio is None else int(np.datetime64(pd.Timestamp(inicio).normalize().date(), 'D').astype(np.int64)) - first
+        hi = count if fim is None else int(np.datetime64(pd.Timestamp(fim).normalize().date(), 'D').astype(np.int64)) - first
+        return min(max(lo, 0), count), min(max(hi, 0), count)
+
+    def totals_between(self, inicio=None, fim=None, key=None, labels=None):
+        """
+        Totais do período [inicio, fim) (limites em dias inteiros), opcionalmente de alguns
+        valores de uma dimensão. Só conta linhas com data válida.
+        """
+        lo, hi = self._day_range(inicio, fim)
+        series = self.series('dia', key, labels)
+        return {
+            'vendas': int(series['vendas'][lo:hi].sum()),
+            'receita': float(series['receita'][lo:hi].sum()),
+            'quantidade': int(series['quantidade'][lo:hi].sum()),
+        }
+
+    def groups_between(self, key, inicio=None, fim=None, labels=None):
+        """
+        Vendas, receita e quantidade de cada valor da dimensão no período [inicio, fim),
+        ordenados por receita (mesmo formato dos grupos de sales_aggregates)
+        """
+        lo, hi = self._day_range(inicio, fim)
+        cells = self.cells['dia', key]
+        codes = self._codes(key, labels) if labels else range(len(self.labels[key]))
+        groups = []
+        for code in codes:
+            start, stop = cells['offsets'][code], cells['offsets'][code + 1]
+            # Períodos do valor estão em ordem: o intervalo sai por busca binária
+            a = start + np.searchsorted(cells['buckets'][start:stop], lo, side='left')
+            b = start + np.searchsorted(cells['buckets'][start:stop], hi, side='left')
+            vendas = int(cells['vendas'][a:b].sum())
+            if vendas:
+                groups.append({
+                    'nome': self.labels[key][code],
+                    'vendas': vendas,
+                    'receita': float(cells['receita'][a:b].sum()),
+                    'quantidade': int(cells['quantidade'][a:b].sum()),
+                })
+        groups.sort(key=lambda x: x['receita'], reverse=True)
+        return groups
+
+    def distinct(self, granularity, key):
+        """
+        Quantos valores distintos da dimensão venderam em cada período
+        """
+        _, count = self.spans[granularity]
+        return np.bincount(self.cells[granularity, key]['buckets'], minlength=count)
+
+    def year_before(self, granularity):
+        """
+        Posição do período equivalente um ano antes de cada período (-1 fora do cubo)
+        """
+        first, count = self.spans[granularity]
+        positions = np.arange(count)
+        if granularity in PERIODOS_ANO:
+            previous = positions - PERIODOS_ANO[granularity]
+        else:
+            days = pd.DatetimeIndex(_bucket_starts(first, count, granularity)) - pd.DateOffset(years=1)
+            previous = days.to_numpy().astype('datetime64[D]').astype(np.int64) - first
+        return np.where(previous >= 0, previous, -1)
+
+    def timeseries(self, granularity='mes', key=None, labels=None, window=3):
+        """
+        Série por período com média móvel e acumulado da receita e variações
+        em relação ao período anterior e ao mesmo período do ano anterior
+        """
+        series = self.series(granularity, key, labels)
+        receita = series['receita']
+        count = len(receita)
+        if not count:
+            return []
+
+        window = max(1, int(window))
+        cumulative = np.cumsum(receita)
+        shifted = np.concatenate([np.zeros(window), cumulative])[:count]
+        sizes = np.minimum(np.arange(1, count + 1), window)
+        moving = (cumulative - shifted) / sizes
+        year_before = self.year_before(granularity)
+
+        rows = []
+        for i, nome in enumerate(self.bucket_labels(granularity)):
+            rows.append({
+                'nome': nome,
+                'vendas': int(series['vendas'][i]),
+                'receita': float(receita[i]),
+                'quantidade': int(series['quantidade'][i]),
+                'media_movel': float(moving[i]),
+                'acumulado': float(cumulative[i]),
+                'variacao': _variacao(receita[i - 1], receita[i]) if i > 0 else None,
+                'variacao_anual': _variacao(receita[year_before[i]], receita[i]) if year_before[i] >= 0 else None,
+            })
+        return rows
+
+    def trends(self, granularity='mes'):
+        """
+        Variação do último período com dados em relação ao anterior e ao mesmo período do
+        ano anterior, para receita, vendas, produtos vendidos e regiões ativas
+        """
+        _, count = self.spans[granularity]
+        if not count:
+            return None
+
+        values = {
+            'receita': self.totals[granularity]['receita'],
+            'vendas': self.totals[granularity]['vendas'],
+            'produtos': self.distinct(granularity, 'produto'),
+            'regioes': self.distinct(granularity, 'regiao'),
+        }
+        labels = self.bucket_labels(granularity)
+        last = count - 1
+        anterior = last - 1 if last > 0 else None
+        ano = int(self.year_before(granularity)[last])
+        ano = ano if ano >= 0 else None
+
+        return {
+            'periodo': labels[last],
+            'anterior': labels[anterior] if anterior is not None else None,
+            'ano_anterior': labels[ano] if ano is not None else None,
+            'variacao': {metric: _variacao(v[anterior], v[last]) if anterior is not None else None
+                         for metric, v in values.items()},
+            'variacao_anual': {metric: _variacao(v[ano], v[last]) if ano is not None else None
+                               for metric, v in values.items()},
+        }
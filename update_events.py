@@ -0,0 +1,80 @@
+"""
+Avisos de novas versões dos dados para os dashboards abertos (Server-Sent Events
+ou long-poll): cada snapshot publicado vira um evento pequeno com a versão, os
+KPIs e a diferença dos totais, sem que o navegador precise consultar de tempos
+em tempos nem baixar os dados de novo
+"""
+import json
+import os
+import threading
+import time
+
+# Intervalo (segundos) entre comentários de keep-alive no stream SSE
+HEARTBEAT = float(os.getenv('LIVE_UPDATES_HEARTBEAT', '25'))
+
+# Duração máxima (segundos) de uma conexão SSE; o navegador reconecta sozinho com Last-Event-ID
+MAX_STREAM_SECONDS = float(os.getenv('LIVE_UPDATES_MAX_AGE', '600'))
+
+# Espera máxima (segundos) de um long-poll
+MAX_POLL_SECONDS = 30
+
+# Espera (ms) sugerida ao EventSource antes de reconectar
+RETRY_MS = 3000
+
+def format_event(event):
+    """
+    Evento SSE 'snapshot' com id = versão dos dados
+    """
+    return f"id: {event['version']}\nevent: snapshot\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+class UpdateBroadcaster:
+    """
+    Guarda o último evento publicado e acorda quem espera uma versão mais nova.
+    Só o último evento importa: quem perdeu versões intermediárias recebe o estado atual.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._latest = None
+
+    @property
+    def latest(self):
+        return self._latest
+
+    def publish(self, event):
+        """
+        event: dict serializável em JSON com ao menos 'version'
+        """
+        with self._condition:
+            self._latest = event
+            self._condition.notify_all()
+
+    def wait(self, since, timeout):
+        """
+        Evento com versão maior que `since`, esperando até `timeout` segundos (None se não houver)
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._latest is None or self._latest['version'] <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self._latest
+
+    def stream(self, since, heartbeat=HEARTBEAT, max_seconds=MAX_STREAM_SECONDS):
+        """
+        Texto SSE: um evento por versão nova, keep-alive a cada `heartbeat` segundos
+        e fim depois de `max_seconds` (não prende um worker para sempre)
+        """
+        yield f"retry: {RETRY_MS}\n\n"
+        deadline = time.monotonic() + max_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            event = self.wait(since, min(heartbeat, remaining))
+            if event is None:
+                yield ": ping\n\n"
+                continue
+            since = event['version']
+            yield format_event(event)